@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 import argparse
 from variation.variations.vars_matrices import VariationsH5
-from variation.variations.merge import merge_variations
-from numpy import mean
+from variation.variations.merge import (merge_variations, FIELD_FUNCTS,
+                                        MISSING_SITES_POLICIES,
+                                        MISSING_SITES_AS_MISSING)
 import logging
 from os.path import join
 
@@ -12,7 +13,7 @@ def _setup_argparse(**kwargs):
     parser = argparse.ArgumentParser(**kwargs)
 
     parser.add_argument('input',
-                        help='Input HDF5 files', nargs=2)
+                        help='Input HDF5 files', nargs='+')
     parser.add_argument('-o', '--output', required=True,
                         help='Output HDF5 file path')
     help_msg = 'Ignore SNPs with overlaps in the same file'
@@ -26,9 +27,15 @@ def _setup_argparse(**kwargs):
     help_msg += 'two snps with different quality, what do you want? The '
     help_msg += 'minimum of two, the maximum, the mean...'
     help_msg += 'To maximum = max, minimum = min, mean = mean'
-    help_msg += 'Example of use: qual=min. By default both values are stored'
+    help_msg += 'Example of use: qual=min. By default the value of the first '
+    help_msg += 'file is stored'
     parser.add_argument('-ff', '--fields_function', action='append',
                         help=help_msg, default=[],)
+    help_msg = 'Genotypes of the samples of the files without a site: '
+    help_msg += 'missing, ref or drop the site (missing)'
+    parser.add_argument('-m', '--missing_sites',
+                        choices=MISSING_SITES_POLICIES,
+                        default=MISSING_SITES_AS_MISSING, help=help_msg)
     parser.add_argument('-if', '--ignore_fields', default=[],
                         action='append',
                         help='Fields to avoid writing to HDF5 file (None)')
@@ -44,6 +51,9 @@ def _parse_args(parser):
     args['ignore_more_overlaps'] = parsed_args.ignore_more_overlaps
     args['fields_func'] = parsed_args.fields_function
     args['ignore_fields'] = parsed_args.ignore_fields
+    args['missing_sites'] = parsed_args.missing_sites
+    if len(args['in_fpaths']) < 2:
+        parser.error('At least two input files are required')
     return args
 
 
@@ -52,26 +62,28 @@ def main():
     parser = _setup_argparse(description=description)
     args = _parse_args(parser)
     fields_function = {}
-    allowed_functions = {'min': min, 'max': max, 'mean': mean}
     for field_f in args['fields_func']:
         field, function = field_f.split('=')
-        if function not in allowed_functions:
-            raise ('Function not supported')
-        fields_function[field] = allowed_functions[function]
+        if function not in FIELD_FUNCTS:
+            parser.error('Function not supported: ' + function)
+        fields_function[field] = function
     merged_fpath = args['out_fpath']
-    h5_1 = VariationsH5(args['in_fpaths'][0], 'r')
-    h5_2 = VariationsH5(args['in_fpaths'][1], 'r')
-    logging.basicConfig(filename=merged_fpath + '.log',
-                        filemode='w', level=logging.INFO)
     try:
-        _, log = merge_variations(h5_1, h5_2, merged_fpath,
-                                  ignore_overlaps=args['ignore_overlaps'],
-                                  ignore_2_or_more_overlaps=args['ignore_more_overlaps'],
-                                  fields_funct=fields_function,
-                                  ignore_fields=args['ignore_fields'])
-        logging.info(log)
+        out_h5 = VariationsH5(merged_fpath, 'w')
     except FileExistsError:
-        raise ('The output file already exists. Remove it to create a new one')
+        parser.error('The output file already exists. Remove it to create a '
+                     'new one')
+    in_h5s = [VariationsH5(fpath, 'r') for fpath in args['in_fpaths']]
+    logging.basicConfig(filename=merged_fpath + '.log',
+                        filemode='w', level=logging.INFO)
+    log = merge_variations(in_h5s, out_h5,
+                           ignore_overlaps=args['ignore_overlaps'],
+                           ignore_2_or_more_overlaps=args['ignore_more_overlaps'],
+                           fields_funct=fields_function,
+                           ignore_fields=args['ignore_fields'],
+                           missing_sites=args['missing_sites'])
+    logging.info(log)
+    out_h5.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import json
+import argparse
+
+from variation.variations.storage import repack_h5
+from variation import STORAGE_PROFILES, SNPS_PER_CHUNK
+
+
+def _setup_argparse(**kwargs):
+    'It prepares the command line argument parsing.'
+    parser = argparse.ArgumentParser(**kwargs)
+
+    parser.add_argument('input', help='Input HDF5 file')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output HDF5 file path')
+    help_msg = 'Storage profile, a name ({}) or a JSON file. '
+    help_msg += 'By default the one used by the input file'
+    help_msg = help_msg.format(', '.join(sorted(STORAGE_PROFILES)))
+    parser.add_argument('-p', '--profile', default=None, help=help_msg)
+    parser.add_argument('-t', '--n_processes', default=None, type=int,
+                        help='Number of fields repacked in parallel')
+    parser.add_argument('-c', '--chunk_size', default=SNPS_PER_CHUNK,
+                        type=int, help='Number of SNPs copied at a time')
+    parser.add_argument('-n', '--no_verify', action='store_true',
+                        default=False,
+                        help='Do not check the repacked file')
+    return parser
+
+
+def _parse_args(parser):
+    parsed_args = parser.parse_args()
+    args = {}
+    args['in_fpath'] = parsed_args.input
+    args['out_fpath'] = parsed_args.output
+    profile = parsed_args.profile
+    if profile is not None and profile not in STORAGE_PROFILES:
+        profile = json.load(open(profile))
+    args['profile'] = profile
+    args['n_processes'] = parsed_args.n_processes
+    args['chunk_size'] = parsed_args.chunk_size
+    args['verify'] = not parsed_args.no_verify
+    return args
+
+
+def main():
+    description = 'Repacks an HDF5 file to reclaim space and fix its chunks'
+    parser = _setup_argparse(description=description)
+    args = _parse_args(parser)
+    report = repack_h5(args['in_fpath'], args['out_fpath'],
+                       storage_profile=args['profile'],
+                       n_processes=args['n_processes'],
+                       chunk_size=args['chunk_size'], verify=args['verify'])
+    print('Input size: {} bytes'.format(report['in_size']))
+    print('Output size: {} bytes ({:.1%} of the input)'.format(
+        report['out_size'], report['out_size'] / report['in_size']))
+    print('Input read time: {:.3f}s'.format(report['in_read_time']))
+    print('Output read time: {:.3f}s'.format(report['out_read_time']))
+
+
+if __name__ == '__main__':
+    main()
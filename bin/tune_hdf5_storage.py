@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import json
+import argparse
+
+from variation.variations.vars_matrices import VariationsH5
+from variation.variations.storage import (benchmark_storage_profiles,
+                                          recommend_storage_profile,
+                                          apply_storage_profile,
+                                          ACCESS_PATTERNS,
+                                          DEF_BENCHMARK_NUM_SNPS)
+from variation import STORAGE_PROFILES, SNPS_PER_CHUNK
+
+
+def _setup_argparse(**kwargs):
+    'It prepares the command line argument parsing.'
+    parser = argparse.ArgumentParser(**kwargs)
+
+    parser.add_argument('input', help='Input HDF5 file')
+    help_msg = 'Storage profile to try, a name ({}) or a JSON file. '
+    help_msg += 'By default all named profiles'
+    help_msg = help_msg.format(', '.join(sorted(STORAGE_PROFILES)))
+    parser.add_argument('-p', '--profile', default=None, action='append',
+                        help=help_msg)
+    parser.add_argument('-a', '--access_pattern', default='chunks',
+                        choices=ACCESS_PATTERNS,
+                        help='How the data is going to be read (chunks)')
+    parser.add_argument('-kf', '--kept_fields', default=None, action='append',
+                        help='Fields read with the fields access pattern')
+    parser.add_argument('-n', '--num_snps', default=DEF_BENCHMARK_NUM_SNPS,
+                        type=int, help='Number of SNPs to benchmark')
+    parser.add_argument('-c', '--chunk_size', default=SNPS_PER_CHUNK,
+                        type=int, help='Number of SNPs per read chunk')
+    parser.add_argument('-O', '--objective', default='read_time',
+                        choices=('read_time', 'write_time', 'size'),
+                        help='What should be minimized (read_time)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Write the input with the best profile here')
+    return parser
+
+
+def _parse_args(parser):
+    parsed_args = parser.parse_args()
+    args = {}
+    args['in_fpath'] = parsed_args.input
+    profiles = parsed_args.profile
+    if profiles is not None:
+        profiles = [profile if profile in STORAGE_PROFILES
+                    else json.load(open(profile)) for profile in profiles]
+    args['profiles'] = profiles
+    args['access_pattern'] = parsed_args.access_pattern
+    args['kept_fields'] = parsed_args.kept_fields
+    args['num_snps'] = parsed_args.num_snps
+    args['chunk_size'] = parsed_args.chunk_size
+    args['objective'] = parsed_args.objective
+    args['out_fpath'] = parsed_args.output
+    return args
+
+
+def main():
+    description = 'Benchmarks HDF5 storage profiles on a sample of the data'
+    parser = _setup_argparse(description=description)
+    args = _parse_args(parser)
+    h5 = VariationsH5(args['in_fpath'], 'r')
+    results = benchmark_storage_profiles(h5, profiles=args['profiles'],
+                                         access_pattern=args['access_pattern'],
+                                         kept_fields=args['kept_fields'],
+                                         num_snps=args['num_snps'],
+                                         chunk_size=args['chunk_size'])
+    print('profile\tsize\twrite_time\tread_time')
+    for result in results:
+        profile = result['profile']
+        if not isinstance(profile, str):
+            profile = json.dumps(profile)
+        print('{}\t{}\t{:.3f}\t{:.3f}'.format(profile, result['size'],
+                                              result['write_time'],
+                                              result['read_time']))
+    best = recommend_storage_profile(results, objective=args['objective'])
+    if isinstance(best, str):
+        print('Recommended profile: ' + best)
+    else:
+        print('Recommended profile: ' + json.dumps(best))
+
+    if args['out_fpath']:
+        out_h5 = apply_storage_profile(h5, args['out_fpath'], best,
+                                       chunk_size=args['chunk_size'])
+        out_h5.close()
+
+
+if __name__ == '__main__':
+    main()
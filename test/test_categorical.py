@@ -0,0 +1,183 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+
+import numpy
+
+from variation import (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD,
+                       CATEGORIES_GROUP)
+from variation.matrix.categorical import CategoryTable, CategoricalMatrix
+from variation.variations.vars_matrices import VariationsArrays, VariationsH5
+from variation.variations.filters import SNPPositionFilter
+from variation.variations.sort import sort_variations
+from variation.variations.storage import repack_h5
+from test.test_utils import create_h5_fpath
+
+
+def _create_variations():
+    variations = VariationsArrays()
+    variations[CHROM_FIELD] = numpy.array([b'chr2', b'chr2', b'chr10', b'chr1',
+                                           b'chr2', b'chr1'])
+    variations[POS_FIELD] = numpy.array([20, 10, 5, 30, 15, 1])
+    variations[REF_FIELD] = numpy.array([b'A', b'C', b'ACGT', b'G', b'T',
+                                         b'A'])
+    variations[ALT_FIELD] = numpy.array([[b'C', b''], [b'A', b'T'],
+                                         [b'A', b''], [b'T', b''],
+                                         [b'G', b''], [b'ACGT', b'']])
+    return variations
+
+
+class CategoryTableTest(unittest.TestCase):
+    def test_encode(self):
+        table = CategoryTable()
+        codes = table.encode(numpy.array([[b'A', b'C'], [b'C', b'']]))
+        assert numpy.all(codes == [[1, 2], [2, 0]])
+        assert table.changed
+        assert numpy.all(table.decode(codes) == [[b'A', b'C'], [b'C', b'']])
+        assert table.code(b'C') == 2
+        assert table.code('C') == 2
+        assert table.code(b'G') is None
+
+        # the old categories keep their codes
+        codes = table.encode(numpy.array([b'AA', b'A']))
+        assert numpy.all(codes == [3, 1])
+        assert numpy.all(table.categories == [b'', b'A', b'C', b'AA'])
+        assert numpy.all(table.ranks == [0, 1, 3, 2])
+
+        table = CategoryTable(table.categories)
+        assert not table.changed
+        assert table.code(b'AA') == 3
+
+    def test_matrix(self):
+        table = CategoryTable()
+        chroms = numpy.array([b'chr2', b'chr10', b'chr1', b'chr2'])
+        matrix = CategoricalMatrix(table.encode(chroms), table)
+        assert matrix.shape == (4,)
+        assert len(matrix) == 4
+        assert numpy.all(matrix[:] == chroms)
+        assert numpy.all(numpy.asarray(matrix) == chroms)
+        assert matrix[1] == b'chr10'
+        assert numpy.all((matrix == b'chr2') == [True, False, False, True])
+        assert numpy.all((matrix != b'chr2') == [False, True, True, False])
+        assert not numpy.any(matrix == b'chr3')
+        assert numpy.all(numpy.argsort(matrix.sort_keys(), kind='stable') ==
+                         numpy.argsort(chroms, kind='stable'))
+        assert numpy.all(matrix.unique() == [b'chr1', b'chr10', b'chr2'])
+
+        matrix[1:3] = numpy.array([b'chr3', b'chr2'])
+        assert numpy.all(matrix[:] == [b'chr2', b'chr3', b'chr2', b'chr2'])
+
+
+class CategoricalH5Test(unittest.TestCase):
+    def test_put_chunks(self):
+        variations = _create_variations()
+        fpath = create_h5_fpath()
+        try:
+            h5 = VariationsH5(fpath, 'w', categorical=True)
+            h5.put_chunks(variations.iterate_chunks(chunk_size=2))
+            h5.close()
+
+            h5 = VariationsH5(fpath, 'r')
+            for field in (CHROM_FIELD, REF_FIELD, ALT_FIELD):
+                assert isinstance(h5[field], CategoricalMatrix)
+                assert h5[field].codes.dtype == numpy.int32
+                assert numpy.all(h5[field][:] == variations[field])
+            assert h5[POS_FIELD].dtype == variations[POS_FIELD].dtype
+            assert sorted(h5.keys()) == sorted(variations.keys())
+            # ref and alt share the allele table
+            assert h5[REF_FIELD].table is h5[ALT_FIELD].table
+            assert CATEGORIES_GROUP + '/chrom' in h5._h5file
+
+            chunk = h5.get_chunk(slice(1, 3))
+            assert isinstance(chunk[CHROM_FIELD], numpy.ndarray)
+            assert numpy.all(chunk[ALT_FIELD] == variations[ALT_FIELD][1:3])
+
+            flt = SNPPositionFilter([(b'chr2',)])
+            assert numpy.all(flt._in_any_region(h5) ==
+                             flt._in_any_region(variations))
+            h5.close()
+
+            # a wider alt matrix and new categories in the appended chunks
+            chunk = VariationsArrays()
+            chunk[CHROM_FIELD] = numpy.array([b'chr3'])
+            chunk[POS_FIELD] = numpy.array([4])
+            chunk[REF_FIELD] = numpy.array([b'C'])
+            chunk[ALT_FIELD] = numpy.array([[b'A', b'G', b'GG']])
+            h5 = VariationsH5(fpath, 'r+')
+            h5.put_chunks([chunk])
+            assert h5[ALT_FIELD].shape == (7, 3)
+            assert numpy.all(h5[ALT_FIELD][-2:] == [[b'ACGT', b'', b''],
+                                                    [b'A', b'G', b'GG']])
+            h5.close()
+            h5 = VariationsH5(fpath, 'r')
+            assert numpy.all(h5[CHROM_FIELD][-1:] == [b'chr3'])
+            h5.close()
+        finally:
+            os.remove(fpath)
+
+    def test_sort_and_index(self):
+        variations = _create_variations()
+        fpath = create_h5_fpath()
+        sorted_fpath = create_h5_fpath()
+        try:
+            h5 = VariationsH5(fpath, 'w', categorical=True)
+            h5.put_chunks([variations])
+            # the codes are sorted as the chrom names, also in the runs
+            sorted_vars = VariationsArrays()
+            sort_variations(h5, sorted_vars, run_size=2)
+            expected = numpy.lexsort((variations[POS_FIELD],
+                                      variations[CHROM_FIELD]))
+            assert numpy.all(sorted_vars[POS_FIELD] ==
+                             variations[POS_FIELD][expected])
+
+            sorted_h5 = VariationsH5(sorted_fpath, 'w', categorical=True)
+            sort_variations(variations, sorted_h5)
+            assert numpy.all(sorted_h5[CHROM_FIELD][:] ==
+                             [b'chr1', b'chr1', b'chr10', b'chr2', b'chr2',
+                              b'chr2'])
+            assert numpy.all(sorted_h5[POS_FIELD][:] == [1, 30, 5, 10, 15, 20])
+            assert list(sorted_h5.chroms) == [b'chr1', b'chr10', b'chr2']
+            index = sorted_h5.pos_index
+            assert index.get_chrom_range_index(b'chr10') == (2, 2)
+            assert index.get_chrom_range_pos(b'chr2') == (10, 20)
+            chroms = [chrom for chrom, _ in sorted_h5.iterate_chroms()]
+            assert chroms == [b'chr1', b'chr10', b'chr2']
+
+            try:
+                h5.pos_index
+                self.fail('RuntimeError expected')
+            except RuntimeError:
+                pass
+            h5.close()
+            sorted_h5.close()
+        finally:
+            os.remove(fpath)
+            os.remove(sorted_fpath)
+
+    def test_repack(self):
+        fpath = create_h5_fpath()
+        out_fpath = create_h5_fpath()
+        try:
+            h5 = VariationsH5(fpath, 'w', categorical=True)
+            h5.put_chunks([_create_variations()])
+            h5.close()
+            repack_h5(fpath, out_fpath)
+            h5 = VariationsH5(out_fpath, 'r')
+            assert isinstance(h5[ALT_FIELD], CategoricalMatrix)
+            assert numpy.all(h5[ALT_FIELD][:] ==
+                             _create_variations()[ALT_FIELD])
+            h5.close()
+        finally:
+            os.remove(fpath)
+            if os.path.exists(out_fpath):
+                os.remove(out_fpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import shutil
+import unittest
+from multiprocessing import Pool
+from tempfile import mkdtemp
+from os.path import join
+
+import numpy
+
+from test.test_utils import TEST_DATA_DIR
+from variation import GT_FIELD, POS_FIELD, CHROM_FIELD
+from variation.matrix.chunked_dir import ChunkedDirArray, create_chunked_dir
+from variation.variations.vars_matrices import (VariationsH5,
+                                                VariationsChunkedDir)
+
+
+def _write_rows(dir_path, start, stop):
+    in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+    chunk = in_snps.get_chunk(slice(start, stop))
+    out_snps = VariationsChunkedDir(dir_path, 'r+', chunk_rows=100)
+    out_snps.write_rows(chunk, start)
+    out_snps.close()
+    return start
+
+
+class ChunkedDirArrayTest(unittest.TestCase):
+    def test_array(self):
+        tmp_dir = mkdtemp()
+        try:
+            path = join(tmp_dir, 'gts')
+            create_chunked_dir(path, (10, 2), numpy.int16, fillvalue=-1,
+                               chunk_rows=4)
+            array = ChunkedDirArray(path)
+            # the chunks not written are filled
+            assert numpy.all(array[:] == -1)
+            expected = numpy.arange(20, dtype=numpy.int16).reshape((10, 2))
+            array[2:9] = expected[2:9]
+            assert sorted(os.listdir(path)) == ['.array.json', '0', '1', '2']
+            expected[:2] = -1
+            expected[9:] = -1
+            assert numpy.all(array[:] == expected)
+            assert numpy.all(array[3:6] == expected[3:6])
+            assert numpy.all(array[[9, 1, 5]] == expected[[9, 1, 5]])
+            assert numpy.all(array[5] == expected[5])
+            assert numpy.all(array[:, 1] == expected[:, 1])
+
+            array.resize(12)
+            array = ChunkedDirArray(path, writable=False)
+            assert array.shape == (12, 2)
+            assert numpy.all(array[10:] == -1)
+            try:
+                array[0:1] = expected[:1]
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class VariationsChunkedDirTest(unittest.TestCase):
+    def test_put_chunks(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        tmp_dir = mkdtemp()
+        try:
+            snps = VariationsChunkedDir(tmp_dir, 'w', chunk_rows=250)
+            snps.put_chunks(in_snps.iterate_chunks(chunk_size=200))
+            snps.close()
+
+            snps = VariationsChunkedDir(tmp_dir, 'r', n_threads=2)
+            assert snps.keys() == sorted(in_snps.keys())
+            assert snps.samples == in_snps.samples
+            assert snps.num_variations == in_snps.num_variations
+            for field in in_snps.keys():
+                in_mat = in_snps[field][:]
+                if in_mat.dtype.kind == 'f':
+                    assert numpy.allclose(snps[field][:], in_mat,
+                                          equal_nan=True)
+                else:
+                    assert numpy.all(snps[field][:] == in_mat)
+            chunk = snps.get_chunk(slice(100, 600))
+            assert numpy.all(chunk[GT_FIELD] == in_snps[GT_FIELD][100:600])
+            assert list(snps.chroms) == list(in_snps.chroms)
+            snps.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_concurrent_writers(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        n_snps = in_snps.num_variations
+        tmp_dir = mkdtemp()
+        try:
+            snps = VariationsChunkedDir(tmp_dir, 'w', chunk_rows=100)
+            snps.allocate(in_snps.get_chunk(slice(0, 1)), n_snps)
+            try:
+                snps.write_rows(in_snps.get_chunk(slice(50, 150)), 50)
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+            # a status calculated before the rows are written is not kept
+            assert snps.order_status['sorted']
+            # the chunks are the stored ones, not the ones of the writer
+            writer = VariationsChunkedDir(tmp_dir, 'r+', chunk_rows=150)
+            try:
+                writer.write_rows(in_snps.get_chunk(slice(150, 300)), 150)
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+            starts = list(range(0, n_snps, 300))
+            with Pool(2) as pool:
+                pool.starmap(_write_rows,
+                             [(tmp_dir, start, min(start + 300, n_snps))
+                              for start in starts])
+            snps = VariationsChunkedDir(tmp_dir, 'r')
+            for field in (GT_FIELD, POS_FIELD, CHROM_FIELD):
+                assert numpy.all(snps[field][:] == in_snps[field][:])
+            assert snps.order_status == in_snps.order_status
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
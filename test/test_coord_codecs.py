@@ -0,0 +1,150 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+
+import numpy
+
+from variation import CHROM_FIELD, POS_FIELD, GT_FIELD
+from variation.matrix.coord_codecs import (RunLengthMatrix, DeltaBlocksMatrix,
+                                           encode_runs, encode_delta_blocks,
+                                           N_ROWS)
+from variation.variations.vars_matrices import VariationsArrays, VariationsH5
+from test.test_utils import create_h5_fpath
+
+
+def _create_variations(n_snps=1000):
+    random_state = numpy.random.RandomState(2)
+    variations = VariationsArrays()
+    chroms = numpy.array([b'chr1', b'chr2', b'chr3'])
+    variations[CHROM_FIELD] = numpy.sort(chroms[random_state.randint(0, 3,
+                                                                     n_snps)])
+    poss = random_state.randint(1, 100000, n_snps).astype(numpy.int32)
+    order = numpy.lexsort((poss, variations[CHROM_FIELD]))
+    variations[POS_FIELD] = poss[order]
+    variations[GT_FIELD] = random_state.randint(0, 2, (n_snps, 3, 2))
+    return variations
+
+
+class RunLengthTest(unittest.TestCase):
+    def test_runs(self):
+        chroms = numpy.array([b'c1', b'c1', b'c2', b'c2', b'c2', b'c3'])
+        run_ends, run_values = encode_runs(chroms)
+        assert list(run_ends) == [2, 5, 6]
+        assert list(run_values) == [b'c1', b'c2', b'c3']
+        matrix = RunLengthMatrix(run_ends, run_values)
+        assert matrix.shape == (6,)
+        assert numpy.all(matrix[:] == chroms)
+        assert numpy.all(matrix[[1, 2, 5]] == [b'c1', b'c2', b'c3'])
+        assert matrix[4] == b'c2'
+        assert matrix[-1] == b'c3'
+        assert numpy.all((matrix == b'c2') == (chroms == b'c2'))
+        assert [(chrom, start, end) for chrom, start, end in matrix.runs()] == \
+            [(b'c1', 0, 2), (b'c2', 2, 5), (b'c3', 5, 6)]
+
+    def test_delta_blocks(self):
+        poss = numpy.array([10, 12, 12, 40, 1000, 3, 5, 7, 100000, 100001])
+        stream, blocks = encode_delta_blocks(poss, block_size=3)
+        # a block starts every 3 rows and where the positions decrease
+        assert list(blocks[:, 0]) == [0, 3, 5, 6, 9]
+        matrix = DeltaBlocksMatrix(stream, blocks, dtype=numpy.int32)
+        assert matrix.shape == (10,)
+        assert matrix.dtype == numpy.int32
+        assert numpy.all(matrix[:] == poss)
+        assert numpy.all(matrix[2:7] == poss[2:7])
+        assert numpy.all(matrix[[0, 4, 9]] == poss[[0, 4, 9]])
+        assert matrix[8] == 100000
+
+        # the rows from 5 are sorted
+        assert matrix.bisect_left(7, lo=5) == 7
+        assert matrix.bisect_left(8, lo=5) == 8
+        assert matrix.bisect_left(1, lo=5) == 5
+        assert matrix.bisect_left(200000, lo=5) == 10
+        assert matrix.bisect_left(12, lo=0, hi=5) == 1
+
+        # the appended blocks continue the rows and the stream
+        stream2, blocks2 = encode_delta_blocks([5, 6], row_start=10,
+                                               byte_start=stream.shape[0])
+        matrix = DeltaBlocksMatrix(numpy.append(stream, stream2),
+                                   numpy.vstack([blocks, blocks2]),
+                                   dtype=numpy.int32)
+        assert numpy.all(matrix[:] == list(poss) + [5, 6])
+
+
+class CompactCoordsH5Test(unittest.TestCase):
+    def test_compact_coords(self):
+        variations = _create_variations()
+        fpath = create_h5_fpath()
+        try:
+            h5 = VariationsH5(fpath, 'w', compact_coords=True)
+            h5.put_chunks(variations.iterate_chunks(chunk_size=300))
+            h5.close()
+            h5 = VariationsH5(fpath, 'r')
+            assert isinstance(h5[CHROM_FIELD], RunLengthMatrix)
+            assert isinstance(h5[POS_FIELD], DeltaBlocksMatrix)
+            # The runs are joined between chunks
+            assert h5[CHROM_FIELD].run_values.shape == (3,)
+            assert h5.num_variations == variations.num_variations
+            assert sorted(h5.keys()) == sorted(variations.keys())
+            for field in (CHROM_FIELD, POS_FIELD):
+                assert numpy.all(h5[field][:] == variations[field])
+            chunk = h5.get_chunk(slice(100, 200))
+            assert numpy.all(chunk[POS_FIELD] == variations[POS_FIELD][100:200])
+
+            assert list(h5.chroms) == list(variations.chroms)
+            wins = list(h5.iterate_wins(win_size=10000))
+            expected = list(variations.iterate_wins(win_size=10000))
+            assert [win.num_variations for win in wins] == \
+                [win.num_variations for win in expected]
+            for win, expected_win in zip(wins, expected):
+                assert numpy.all(win[POS_FIELD] == expected_win[POS_FIELD])
+            chroms = [(chrom, chunk.num_variations)
+                      for chrom, chunk in h5.iterate_chroms()]
+            expected = [(chrom, chunk.num_variations)
+                        for chrom, chunk in variations.iterate_chroms()]
+            assert chroms == expected
+            h5.close()
+
+            # longer chrom names in a new chunk
+            chunk = VariationsArrays()
+            chunk[CHROM_FIELD] = numpy.array([b'chromosome4'])
+            chunk[POS_FIELD] = numpy.array([7], dtype=numpy.int32)
+            chunk[GT_FIELD] = numpy.zeros((1, 3, 2), dtype=int)
+            h5 = VariationsH5(fpath, 'r+')
+            h5.put_chunks([chunk])
+            assert h5[CHROM_FIELD][-1] == b'chromosome4'
+            assert h5[POS_FIELD][-1] == 7
+            assert list(h5.chroms)[-1] == b'chromosome4'
+            h5.close()
+        finally:
+            os.remove(fpath)
+
+    def test_append_to_pos_blocks(self):
+        variations = VariationsArrays()
+        variations[CHROM_FIELD] = numpy.full(5000, b'chr1')
+        variations[POS_FIELD] = numpy.arange(0, 50000, 10, dtype=numpy.int32)
+        fpath = create_h5_fpath()
+        try:
+            h5 = VariationsH5(fpath, 'w', compact_coords=True)
+            h5.put_chunks(variations.iterate_chunks(chunk_size=300))
+            # The small chunks are joined in blocks of up to 4096 rows
+            assert list(h5[POS_FIELD].blocks[:, N_ROWS]) == [4096, 904]
+            assert numpy.all(h5[POS_FIELD][:] == variations[POS_FIELD])
+
+            # A decreasing position starts a new block
+            h5.put_chunks(variations.iterate_chunks(chunk_size=700))
+            assert list(h5[POS_FIELD].blocks[:, N_ROWS]) == [4096, 904,
+                                                              4096, 904]
+            expected = numpy.tile(variations[POS_FIELD], 2)
+            assert numpy.all(h5[POS_FIELD][:] == expected)
+            h5.close()
+        finally:
+            os.remove(fpath)
+
+if __name__ == "__main__":
+    unittest.main()
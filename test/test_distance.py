@@ -141,6 +141,29 @@ class IndividualDistTest(unittest.TestCase):
         assert calc_pairwise_distance(variations)[0] == 1
         assert calc_pairwise_distance(variations, chunk_size=3)[0] == 1
 
+    def test_ibs_pairwise(self):
+        a = numpy.array([[-1, -1], [0, 0], [0, 1],
+                         [0, 0], [0, 0], [0, 1], [0, 1],
+                         [0, 1], [0, 0], [0, 0], [0, 1]])
+        b = numpy.array([[1, 1], [-1, -1], [0, 0],
+                         [0, 0], [1, 1], [0, 1], [1, 0],
+                         [1, 0], [1, 0], [0, 1], [1, 1]])
+        c = numpy.full(shape=(11, 2), fill_value=1, dtype=numpy.int16)
+        d = numpy.full(shape=(11, 2), fill_value=1, dtype=numpy.int16)
+        gts = numpy.stack((a, b, c, d), axis=0)
+        gts = numpy.transpose(gts, axes=(1, 0, 2)).astype(numpy.int16)
+        variations = VariationsArrays()
+        variations['/calls/GT'] = gts
+        # For biallelic diploid gts it is the Kosman distance
+        expected = [0.33333333, 0.75, 0.75, 0.45, 0.45, 0.]
+        for chunk_size in (None, 2):
+            distance = calc_pairwise_distance(variations, method='ibs',
+                                              chunk_size=chunk_size)
+            assert numpy.allclose(distance, expected)
+        distance = calc_pairwise_distance(variations, method='ibs',
+                                          min_num_snps=11)
+        assert numpy.sum(numpy.isnan(distance)) == 5
+
     def test_kosman_pairwise_between_pops_by_chunk(self):
         a = numpy.array([[-1, -1], [0, 0], [0, 1],
                          [0, 0], [0, 0], [0, 1], [0, 1],
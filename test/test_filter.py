@@ -39,11 +39,14 @@ from variation.variations.filters import (MinCalledGTsFilter, FLT_VARS, COUNTS,
                                           AlleleObservationBasedMafFilter,
                                           VarsSamplingFilter,
                                           VarsSamplingFilter2,
-                                          VariableAndNotAllMissing)
+                                          VariableAndNotAllMissing,
+                                          DuplicatedSiteCollapser,
+                                          KEEP_BEST_QUAL, COMBINE_CALLS)
+from variation.variations.pipeline import Pipeline
 from variation.variations.stats import calc_depth_mean_by_sample
 from variation.iterutils import first
 from variation import (GT_FIELD, CHROM_FIELD, POS_FIELD, GQ_FIELD,
-                       SNPS_PER_CHUNK, ALT_FIELD, REF_FIELD)
+                       SNPS_PER_CHUNK, ALT_FIELD, REF_FIELD, QUAL_FIELD)
 from variation.variations.annotation import IsVariableAnnotator, ANNOTATED_VARS
 
 
@@ -729,6 +732,69 @@ class FixDuplicatedAllelesTest(unittest.TestCase):
         assert numpy.all(variations[ALT_FIELD] == alt_expected)
 
 
+def _create_duplicated_sites():
+    variations = VariationsArrays()
+    variations[CHROM_FIELD] = numpy.array([b'chr1', b'chr1', b'chr1', b'chr1',
+                                           b'chr2', b'chr2'])
+    variations[POS_FIELD] = numpy.array([10, 10, 10, 20, 5, 5])
+    variations[REF_FIELD] = numpy.array([b'A', b'A', b'A', b'C', b'A', b'A'])
+    variations[ALT_FIELD] = numpy.array([[b'T'], [b'G'], [b'T'], [b'G'],
+                                         [b'T'], [b'T']])
+    variations[QUAL_FIELD] = numpy.array([10, 5, 30, 1, numpy.nan, 3])
+    variations[GT_FIELD] = numpy.array([[[0, 0], [-1, -1]],
+                                        [[0, 1], [0, 1]],
+                                        [[-1, -1], [1, 1]],
+                                        [[0, 0], [0, 0]],
+                                        [[0, 0], [0, 1]],
+                                        [[1, 1], [1, 1]]])
+    return variations
+
+
+class DuplicatedSiteCollapserTest(unittest.TestCase):
+    def test_collapse(self):
+        variations = _create_duplicated_sites()
+        collapser = DuplicatedSiteCollapser()
+        result = collapser(variations)
+        # the variations of the last position are held back
+        assert list(result[FLT_VARS][QUAL_FIELD]) == [10, 5, 1]
+        assert result[FLT_STATS] == {N_KEPT: 3, N_FILTERED_OUT: 1, TOT: 4}
+        result = collapser.flush()
+        assert list(result[FLT_VARS][POS_FIELD]) == [5]
+        assert result[FLT_STATS][N_FILTERED_OUT] == 1
+        assert not collapser.flush()
+
+        collapser = DuplicatedSiteCollapser(policy=KEEP_BEST_QUAL)
+        flt_vars = collapser(variations)[FLT_VARS]
+        assert list(flt_vars[QUAL_FIELD]) == [5, 30, 1]
+        assert list(collapser.flush()[FLT_VARS][QUAL_FIELD]) == [3]
+
+        collapser = DuplicatedSiteCollapser(policy=COMBINE_CALLS)
+        flt_vars = collapser(variations)[FLT_VARS]
+        assert flt_vars[GT_FIELD][0].tolist() == [[0, 0], [1, 1]]
+        assert flt_vars[GT_FIELD][1].tolist() == [[0, 1], [0, 1]]
+        flt_vars = collapser.flush()[FLT_VARS]
+        assert flt_vars[GT_FIELD].tolist() == [[[0, 0], [0, 1]]]
+
+        try:
+            DuplicatedSiteCollapser(policy='last')
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+    def test_collapse_in_pipeline(self):
+        variations = _create_duplicated_sites()
+        pipeline = Pipeline()
+        pipeline.append(DuplicatedSiteCollapser(policy=COMBINE_CALLS),
+                        id_='dedup')
+        vars_out = VariationsArrays()
+        # the duplicates are split between chunks
+        result = pipeline.run(variations, vars_out, chunk_size=2)
+        assert list(vars_out[POS_FIELD]) == [10, 10, 20, 5]
+        assert vars_out[GT_FIELD][0].tolist() == [[0, 0], [1, 1]]
+        assert result['dedup'][FLT_STATS] == {N_KEPT: 4, N_FILTERED_OUT: 2,
+                                              TOT: 6}
+
+
 class MonoBiallelicFilterTest(unittest.TestCase):
 
     def test_filter_biallelic(self):
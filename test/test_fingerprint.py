@@ -0,0 +1,127 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+from os.path import join
+
+import numpy
+
+from test.test_utils import TEST_DATA_DIR, create_h5_fpath
+from variation import (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD,
+                       GT_FIELD, FINGERPRINTS_GROUP)
+from variation.variations.vars_matrices import VariationsArrays, VariationsH5
+from variation.variations.fingerprint import (calc_chunk_fingerprints,
+                                              diff_variations,
+                                              find_duplicated_sites)
+
+
+def _write_h5(fpath, variations):
+    h5 = VariationsH5(fpath, 'w')
+    h5.put_chunks([variations])
+    return h5
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_fingerprints(self):
+        variations = VariationsArrays()
+        variations[CHROM_FIELD] = numpy.array([b'chr1', b'chr1', b'chr2'])
+        variations[POS_FIELD] = numpy.array([10, 10, 10])
+        variations[REF_FIELD] = numpy.array([b'A', b'A', b'A'])
+        variations[ALT_FIELD] = numpy.array([[b'T', b''], [b'T', b'C'],
+                                             [b'T', b'']])
+        fingerprints = calc_chunk_fingerprints(variations)
+        locus, site = fingerprints['locus'], fingerprints['site']
+        assert locus[0] == locus[1] and locus[0] != locus[2]
+        assert site[0] != site[1]
+
+        # the fingerprints do not depend on the width of the matrices
+        wider = VariationsArrays()
+        wider[CHROM_FIELD] = numpy.array([b'chr1'], dtype='S20')
+        wider[POS_FIELD] = numpy.array([10], dtype=numpy.int64)
+        wider[REF_FIELD] = numpy.array([b'A'], dtype='S10')
+        wider[ALT_FIELD] = numpy.array([[b'T', b'', b'']], dtype='S10')
+        assert calc_chunk_fingerprints(wider)['site'][0] == site[0]
+
+    def test_diff(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        snps = in_snps.copy()
+        n_snps = snps.num_variations
+        changed = snps.copy()
+        gts = changed[GT_FIELD].copy()
+        gts[5, 0, :] = 1 - gts[5, 0, :]
+        del changed[GT_FIELD]
+        changed[GT_FIELD] = gts
+        alts = changed[ALT_FIELD].copy()
+        alts[7, 0] = b'N'
+        del changed[ALT_FIELD]
+        changed[ALT_FIELD] = alts
+        # the first variation is removed and the last one is added twice
+        kept = numpy.append(numpy.arange(1, n_snps), [n_snps - 1])
+        changed = changed.get_chunk(kept)
+
+        fpath1, fpath2 = create_h5_fpath(), create_h5_fpath()
+        try:
+            h5_1 = _write_h5(fpath1, snps)
+            h5_2 = _write_h5(fpath2, changed)
+            diff = diff_variations(h5_1, h5_2, chunk_size=100)
+            assert list(diff['removed']) == [0]
+            assert list(diff['added']) == [n_snps - 1]
+            assert diff['changed'].tolist() == [[7, 6]]
+            diff = diff_variations(h5_1, h5_2, with_gts=True)
+            assert diff['changed'].tolist() == [[5, 4], [7, 6]]
+
+            # the stored fingerprints are used
+            h5_1.write_fingerprints(with_gts=True)
+            h5_2.write_fingerprints()
+            diff = diff_variations(h5_1, h5_2, with_gts=True)
+            assert diff['changed'].tolist() == [[5, 4], [7, 6]]
+            assert numpy.all(h5_1.get_fingerprints()['site'] ==
+                             snps.get_fingerprints()['site'])
+
+            diff = diff_variations(h5_1, snps)
+            assert not diff['added'].size and not diff['removed'].size
+            assert not diff['changed'].size
+
+            assert list(find_duplicated_sites(h5_2)) == [n_snps - 1]
+            assert not find_duplicated_sites(h5_1).size
+        finally:
+            for fpath in (fpath1, fpath2):
+                if os.path.exists(fpath):
+                    os.remove(fpath)
+
+    def test_stale_fingerprints(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        snps = in_snps.copy()
+        fpath = create_h5_fpath()
+        try:
+            h5 = _write_h5(fpath, snps)
+            h5.write_fingerprints(with_gts=True)
+            h5.close()
+            h5 = VariationsH5(fpath, 'r')
+            group = h5._h5file[FINGERPRINTS_GROUP]
+            assert h5._is_derived_data_valid(group)
+            h5.close()
+
+            # the fields are written in place
+            h5 = VariationsH5(fpath, 'r+')
+            gts = h5[GT_FIELD]
+            gts[5, 0, :] = 1 - gts[5, 0, :]
+            h5[POS_FIELD][7] = h5[POS_FIELD][7] + 1
+            h5.close()
+            h5 = VariationsH5(fpath, 'r')
+            diff = diff_variations(snps, h5, with_gts=True)
+            assert list(diff['removed']) == [7]
+            assert list(diff['added']) == [7]
+            assert diff['changed'].tolist() == [[5, 5]]
+            h5.close()
+        finally:
+            os.remove(fpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+import struct
+from multiprocessing.pool import ThreadPool
+
+import h5py
+import numpy
+
+from variation import DEF_DSET_PARAMS
+from variation.matrix.h5_chunks import (fletcher32, read_rows_direct,
+                                        write_rows_direct,
+                                        supports_direct_chunk_io,
+                                        ChecksumError, decode_chunk,
+                                        get_dset_filters)
+from test.test_utils import create_h5_fpath
+
+
+class DirectChunkReadTest(unittest.TestCase):
+    def test_fletcher32(self):
+        fpath = create_h5_fpath()
+        try:
+            with h5py.File(fpath, 'w') as h5:
+                for idx, n_items in enumerate([1, 2, 3, 1000, 70001]):
+                    data = numpy.random.randint(0, 255, size=n_items)
+                    data = data.astype(numpy.uint8)
+                    if idx == 1:
+                        data[:] = 0
+                    dset = h5.create_dataset(str(idx), data=data,
+                                             chunks=(n_items,),
+                                             fletcher32=True)
+                    _, raw = dset.id.read_direct_chunk((0,))
+                    stored = struct.unpack('<I', raw[-4:])[0]
+                    assert fletcher32(raw[:-4]) == stored
+        finally:
+            os.remove(fpath)
+
+    def test_all_missing_chunk(self):
+        # the sums of the words 0xFFFF are multiples of 65535
+        fpath = create_h5_fpath()
+        try:
+            with h5py.File(fpath, 'w') as h5:
+                gts = numpy.full((200, 7, 2), -1, dtype=numpy.int16)
+                h5.create_dataset('gts', data=gts, chunks=(100, 7, 2),
+                                  **DEF_DSET_PARAMS)
+                h5.create_dataset('bytes', data=numpy.full(1000, 255,
+                                                           numpy.uint8),
+                                  chunks=(500,), fletcher32=True)
+            with h5py.File(fpath, 'r') as h5:
+                for path in ('gts', 'bytes'):
+                    dset = h5[path]
+                    assert numpy.all(read_rows_direct(dset, 0,
+                                                      dset.shape[0]) ==
+                                     dset[:])
+        finally:
+            os.remove(fpath)
+
+    def test_read_rows(self):
+        fpath = create_h5_fpath()
+        gts = numpy.random.randint(-1, 3, size=(1350, 7, 2)).astype('i1')
+        try:
+            with h5py.File(fpath, 'w') as h5:
+                dset = h5.create_dataset('gts', data=gts, chunks=(200, 7, 2),
+                                         maxshape=(None, 7, 2),
+                                         fillvalue=-1, **DEF_DSET_PARAMS)
+                # the last chunks are not allocated
+                dset.resize((1900, 7, 2))
+                pos = numpy.arange(1350, dtype=numpy.int32)
+                h5.create_dataset('pos', data=pos, chunks=(200,),
+                                  **DEF_DSET_PARAMS)
+                # The sample axis is also chunked
+                h5.create_dataset('dp', data=gts, chunks=(100, 3, 1),
+                                  **DEF_DSET_PARAMS)
+                h5.create_dataset('no_filters', data=pos, chunks=(200,))
+                h5.create_dataset('lzf', data=pos, chunks=(200,),
+                                  compression='lzf')
+
+            with h5py.File(fpath, 'r') as h5:
+                assert not supports_direct_chunk_io(h5['lzf'])
+                assert supports_direct_chunk_io(h5['no_filters'])
+                pool = ThreadPool(2)
+                for start, stop in [(0, 1900), (150, 1000), (210, 211),
+                                    (1300, 1600), (5, 5)]:
+                    for path in ('gts', 'pos', 'dp', 'no_filters'):
+                        dset = h5[path]
+                        stop_ = min(stop, dset.shape[0])
+                        expected = dset[start:stop_]
+                        for pool_ in (None, pool):
+                            result = read_rows_direct(dset, start, stop_,
+                                                      pool=pool_)
+                            assert result.dtype == dset.dtype
+                            assert numpy.all(result == expected)
+                pool.close()
+
+                dset = h5['pos']
+                filter_mask, raw = dset.id.read_direct_chunk((0,))
+                raw = raw[:10] + bytes([raw[10] ^ 1]) + raw[11:]
+                try:
+                    decode_chunk(raw, filter_mask, get_dset_filters(dset),
+                                 dset.dtype, dset.chunks)
+                    self.fail('ChecksumError expected')
+                except ChecksumError:
+                    pass
+
+            # the chunks that can not be read are not taken as missing
+            with h5py.File(fpath, 'r+') as h5:
+                h5['pos'].id.write_direct_chunk((0,), raw, filter_mask)
+            with h5py.File(fpath, 'r') as h5:
+                try:
+                    read_rows_direct(h5['pos'], 0, 200)
+                    self.fail('ChecksumError expected')
+                except ChecksumError:
+                    pass
+        finally:
+            os.remove(fpath)
+
+
+class DirectChunkWriteTest(unittest.TestCase):
+    def test_write_rows(self):
+        fpath = create_h5_fpath()
+        gts = numpy.random.randint(-1, 3, size=(1350, 7, 2)).astype('i1')
+        pool = ThreadPool(2)
+        try:
+            with h5py.File(fpath, 'w') as h5:
+                for start, stop in [(0, 1350), (150, 1000), (210, 211),
+                                    (400, 800)]:
+                    for chunks in [(200, 7, 2), (100, 3, 1)]:
+                        for pool_ in (None, pool):
+                            dset = h5.create_dataset('gts', shape=gts.shape,
+                                                     dtype=gts.dtype,
+                                                     chunks=chunks,
+                                                     fillvalue=-1,
+                                                     compression_opts=9,
+                                                     **DEF_DSET_PARAMS)
+                            write_rows_direct(dset, start, gts[start:stop],
+                                              pool=pool_)
+                            expected = numpy.full(gts.shape, -1, gts.dtype)
+                            expected[start:stop] = gts[start:stop]
+                            assert numpy.all(dset[:] == expected)
+                            assert numpy.all(read_rows_direct(dset, 0, 1350)
+                                             == expected)
+                            del h5['gts']
+
+                dset = h5.create_dataset('gts', shape=(10, 7, 2),
+                                         dtype=gts.dtype, chunks=(5, 7, 2))
+                try:
+                    write_rows_direct(dset, 0, gts[:20])
+                    self.fail('ValueError expected')
+                except ValueError:
+                    pass
+        finally:
+            pool.close()
+            os.remove(fpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
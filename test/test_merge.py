@@ -5,8 +5,11 @@
 # Missing docstring
 # pylint: disable=C0111
 
+import os
+import shutil
 import unittest
 from os.path import join
+from tempfile import mkdtemp
 
 import numpy
 
@@ -14,11 +17,16 @@ from variation.variations.merge import (_group_overlaping_vars,
                                         VarMerger, _sort_iterators,
                                         _get_overlapping_region,
                                         _pos_lt_tuples,
-                                        MalformedVariationError)
+                                        MalformedVariationError,
+                                        merge_variations,
+                                        merge_variations_in_parallel,
+                                        concat_samples)
 from variation.iterutils import PeekableIterator
 from variation.variations.vars_matrices import VariationsH5, VariationsArrays
 
 from test.test_utils import TEST_DATA_DIR
+from variation import (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD,
+                       QUAL_FIELD, GT_FIELD)
 from variation.utils.misc import remove_nans
 from collections import Counter
 
@@ -274,6 +282,236 @@ class MergeTest(unittest.TestCase):
 
         assert not merger._snps_are_mergeable(vars1[0], vars2[0])
 
+    def _check_chunks_as_vars(self, variations1, variations2, chunk_size,
+                              **kwargs):
+        merger = VarMerger(variations1, variations2, **kwargs)
+        expected = list(merger.variations)
+        merger = VarMerger(variations1, variations2, **kwargs)
+        merged = VariationsArrays()
+        merged.put_chunks(merger.iterate_chunks(chunk_size=chunk_size))
+        assert merged.num_variations == len(expected)
+        assert merged.samples == [sample.decode()
+                                  for sample in merger.samples]
+        for idx, var in enumerate(expected):
+            chrom, pos, _, ref, alt, qual, _, _, calls = var
+            assert merged[CHROM_FIELD][idx] == chrom
+            assert merged[POS_FIELD][idx] == pos
+            assert merged[REF_FIELD][idx] == ref
+            alts = [allele for allele in merged[ALT_FIELD][idx]
+                    if allele != b'']
+            assert alts == ([] if alt is None else list(alt))
+            if qual is None:
+                assert numpy.isnan(merged[QUAL_FIELD][idx])
+            else:
+                assert numpy.allclose(merged[QUAL_FIELD][idx], qual,
+                                      equal_nan=True)
+            assert numpy.all(merged[GT_FIELD][idx] == calls[0][1])
+        return merged
+
+    def test_merge_in_chunks(self):
+        vars1 = VariationsArrays()
+        vars1[CHROM_FIELD] = numpy.array([b'1', b'1', b'1', b'1', b'2'])
+        vars1[POS_FIELD] = numpy.array([1, 5, 10, 20, 3])
+        vars1[REF_FIELD] = numpy.array([b'A', b'C', b'ATT', b'G', b'T'])
+        vars1[ALT_FIELD] = numpy.array([[b'T', b''], [b'G', b'A'],
+                                        [b'A', b''], [b'C', b''],
+                                        [b'A', b'']])
+        vars1[QUAL_FIELD] = numpy.array([10, 20, 30, 40, 50],
+                                        dtype=numpy.float32)
+        vars1[GT_FIELD] = numpy.array([[[0, 0], [1, 1]], [[0, 1], [2, 2]],
+                                       [[0, 0], [1, 1]], [[0, 0], [1, 1]],
+                                       [[0, 0], [-1, -1]]])
+        vars1.samples = ['a', 'b']
+        vars2 = VariationsArrays()
+        vars2[CHROM_FIELD] = numpy.array([b'1', b'1', b'1', b'2', b'2'])
+        vars2[POS_FIELD] = numpy.array([1, 5, 11, 1, 3])
+        vars2[REF_FIELD] = numpy.array([b'A', b'C', b'TT', b'G', b'T'])
+        vars2[ALT_FIELD] = numpy.array([[b'C'], [b'A'], [b'C'], [b'C'],
+                                        [b'']])
+        vars2[QUAL_FIELD] = numpy.array([5, 25, 35, numpy.nan, 45],
+                                        dtype=numpy.float32)
+        vars2[GT_FIELD] = numpy.array([[[1, 1]], [[0, 1]], [[1, 1]], [[0, 0]],
+                                       [[0, 0]]])
+        vars2.samples = ['c']
+
+        for chunk_size in (1, 2, 100):
+            merged = self._check_chunks_as_vars(vars1, vars2, chunk_size,
+                                                ignore_complex_overlaps=True)
+        # the overlapping indels are not merged
+        assert list(merged[POS_FIELD]) == [1, 5, 20, 1, 3]
+        assert list(merged[ALT_FIELD][0]) == [b'T', b'C']
+        assert numpy.all(merged[GT_FIELD][0] == [[0, 0], [1, 1], [2, 2]])
+        assert numpy.all(merged[GT_FIELD][1] == [[0, 1], [2, 2], [0, 2]])
+        assert list(merged[QUAL_FIELD][:2]) == [5, 20]
+
+        merged = self._check_chunks_as_vars(vars1, vars2, 2,
+                                            ignore_complex_overlaps=True,
+                                            ignore_non_matching=True)
+        assert list(merged[POS_FIELD]) == [1, 5, 3]
+
+        merger = VarMerger(vars1, vars2)
+        try:
+            list(merger.iterate_chunks())
+            self.fail('NotImplementedError expected')
+        except NotImplementedError:
+            pass
+
+        h5_1 = VariationsH5(join(TEST_DATA_DIR, 'csv', 'format.h5'), "r")
+        h5_2 = VariationsH5(join(TEST_DATA_DIR, 'format_def.h5'), "r")
+        for chunk_size in (1, 100):
+            self._check_chunks_as_vars(h5_1, h5_2, chunk_size,
+                                       max_field_lens={'alt': 3},
+                                       ignore_complex_overlaps=True,
+                                       check_ref_matches=False)
+            self._check_chunks_as_vars(h5_2, h5_1, chunk_size,
+                                       max_field_lens={'alt': 3},
+                                       ignore_complex_overlaps=True,
+                                       check_ref_matches=False)
+
+    def test_merge_several_variations(self):
+        vars1 = VariationsArrays()
+        vars1[CHROM_FIELD] = numpy.array([b'1', b'1', b'2'])
+        vars1[POS_FIELD] = numpy.array([1, 5, 3])
+        vars1[REF_FIELD] = numpy.array([b'A', b'C', b'T'])
+        vars1[ALT_FIELD] = numpy.array([[b'T'], [b'G'], [b'A']])
+        vars1[QUAL_FIELD] = numpy.array([10, 20, 30], dtype=numpy.float32)
+        vars1[GT_FIELD] = numpy.array([[[0, 1]], [[1, 1]], [[0, 0]]])
+        vars1.samples = ['a']
+        vars2 = VariationsArrays()
+        vars2[CHROM_FIELD] = numpy.array([b'1', b'2'])
+        vars2[POS_FIELD] = numpy.array([1, 3])
+        vars2[REF_FIELD] = numpy.array([b'A', b'T'])
+        vars2[ALT_FIELD] = numpy.array([[b'G', b'T'], [b'A', b'']])
+        vars2[QUAL_FIELD] = numpy.array([20, numpy.nan], dtype=numpy.float32)
+        vars2[GT_FIELD] = numpy.array([[[1, 2]], [[1, 1]]])
+        vars2.samples = ['b']
+        vars3 = VariationsArrays()
+        vars3[CHROM_FIELD] = numpy.array([b'1', b'1'])
+        vars3[POS_FIELD] = numpy.array([1, 7])
+        vars3[REF_FIELD] = numpy.array([b'A', b'G'])
+        vars3[ALT_FIELD] = numpy.array([[b'C'], [b'C']])
+        vars3[GT_FIELD] = numpy.array([[[1, 0]], [[0, 1]]])
+        vars3.samples = ['c']
+
+        merged = VariationsArrays()
+        log = merge_variations([vars1, vars2, vars3], merged,
+                               fields_funct={'qual': 'mean'}, chunk_size=1)
+        assert log['merged_sites'] == 4
+        assert merged.samples == ['a', 'b', 'c']
+        assert list(merged[POS_FIELD]) == [1, 5, 7, 3]
+        assert list(merged[ALT_FIELD][0]) == [b'T', b'G', b'C']
+        assert numpy.all(merged[GT_FIELD][0] == [[0, 1], [2, 1], [3, 0]])
+        assert numpy.all(merged[GT_FIELD][1] == [[1, 1], [-1, -1], [-1, -1]])
+        assert numpy.allclose(merged[QUAL_FIELD], [15, 20, numpy.nan, 30],
+                              equal_nan=True)
+
+        merged = VariationsArrays()
+        merge_variations([vars1, vars2, vars3], merged,
+                         missing_sites='ref')
+        assert numpy.all(merged[GT_FIELD][1] == [[1, 1], [0, 0], [0, 0]])
+        merged = VariationsArrays()
+        merge_variations([vars1, vars2], merged, missing_sites='drop')
+        assert list(merged[POS_FIELD]) == [1, 3]
+        assert numpy.allclose(merged[QUAL_FIELD], [10, 30])
+
+        # overlapping variations
+        del vars3[REF_FIELD]
+        vars3[REF_FIELD] = numpy.array([b'AC', b'G'])
+        try:
+            merge_variations([vars1, vars3], VariationsArrays())
+            self.fail('NotImplementedError expected')
+        except NotImplementedError:
+            pass
+        merged = VariationsArrays()
+        log = merge_variations([vars1, vars3], merged,
+                               ignore_2_or_more_overlaps=True)
+        assert list(merged[POS_FIELD]) == [5, 7, 3]
+        assert log['overlaping_vars_between_files'] == 1
+
+    def test_merge_in_parallel(self):
+        h5_1 = VariationsH5(join(TEST_DATA_DIR, 'csv', 'format.h5'), "r")
+        h5_2 = VariationsH5(join(TEST_DATA_DIR, 'format_def.h5'), "r")
+        kwargs = {'ignore_overlaps': True, 'ignore_2_or_more_overlaps': True,
+                  'fields_funct': {'qual': 'max'}}
+        expected = VariationsArrays()
+        expected_log = merge_variations([h5_1, h5_2], expected, **kwargs)
+
+        tmp_dir = mkdtemp()
+        try:
+            in_fpaths = [h5_1.fpath, h5_2.fpath]
+            merged = VariationsArrays()
+            log = merge_variations_in_parallel(in_fpaths, merged,
+                                               n_processes=2, tmp_dir=tmp_dir,
+                                               **kwargs)
+            assert log == expected_log
+            assert merged.samples == expected.samples
+            assert sorted(merged.keys()) == sorted(expected.keys())
+            for field in expected.keys():
+                if expected[field].dtype.kind == 'f':
+                    assert numpy.allclose(merged[field], expected[field],
+                                          equal_nan=True)
+                else:
+                    assert numpy.all(merged[field] == expected[field])
+            # the chroms were merged by different processes
+            assert list(merged[CHROM_FIELD]) == [b'20'] * 4 + [b'22']
+
+            merged = VariationsArrays()
+            log = merge_variations_in_parallel(in_fpaths, merged,
+                                               tmp_dir=tmp_dir, pairwise=True,
+                                               ignore_complex_overlaps=True,
+                                               check_ref_matches=False)
+            assert log['Too_many_overlaping_vars'] == 1
+            assert merged.num_variations == 6
+            assert not os.listdir(tmp_dir)
+
+            # the temporary files are removed if a merge fails
+            kwargs['fields_funct'] = {'qual': 'median'}
+            try:
+                merge_variations_in_parallel(in_fpaths, VariationsArrays(),
+                                             n_processes=2, tmp_dir=tmp_dir,
+                                             **kwargs)
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+            assert not os.listdir(tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_concat_samples(self):
+        h5 = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), "r")
+        samples = h5.samples
+        vars1 = VariationsArrays()
+        vars1.put_chunks(h5.iterate_chunks(samples=samples[:100]))
+        vars2 = VariationsArrays()
+        vars2.put_chunks(h5.iterate_chunks(
+            samples=samples[100:],
+            kept_fields=[GT_FIELD, CHROM_FIELD, POS_FIELD, REF_FIELD,
+                         ALT_FIELD]))
+        concat = VariationsArrays()
+        concat_samples([vars1, vars2], concat, chunk_size=200)
+        assert concat.samples == samples
+        assert sorted(concat.keys()) == sorted(h5.keys())
+        assert numpy.all(concat[GT_FIELD] == h5[GT_FIELD][:])
+        assert numpy.all(concat[QUAL_FIELD] == h5[QUAL_FIELD][:])
+        # the calls not found in the second variations are missing
+        assert numpy.all(concat['/calls/DP'][:, :100] ==
+                         h5['/calls/DP'][:, :100])
+        assert numpy.all(concat['/calls/DP'][:, 100:] == -1)
+
+        vars2[POS_FIELD][500] += 1
+        try:
+            concat_samples([vars1, vars2], VariationsArrays())
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+        del vars2[REF_FIELD]
+        try:
+            concat_samples([vars1, vars2], VariationsArrays())
+            self.fail('ValueError expected')
+        except ValueError as error:
+            assert REF_FIELD in str(error) and ' 1 ' in str(error)
+
     def test_merge_variations(self):
         h5_1 = VariationsH5(join(TEST_DATA_DIR, 'csv', 'format.h5'), "r")
         h5_2 = VariationsH5(join(TEST_DATA_DIR, 'format_def.h5'), "r")
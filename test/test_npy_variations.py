@@ -0,0 +1,104 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import shutil
+import unittest
+from tempfile import NamedTemporaryFile, mkdtemp
+from os.path import join
+
+import numpy
+
+from test.test_utils import TEST_DATA_DIR
+from variation import GT_FIELD, POS_FIELD, ALT_FIELD, CHROM_FIELD
+from variation.variations.vars_matrices import (VariationsH5, VariationsNpy,
+                                                VariationsArrays)
+
+
+class VariationsNpyTest(unittest.TestCase):
+    def test_put_chunks(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        tmp_dir = mkdtemp()
+        try:
+            npy_dir = join(tmp_dir, 'vars')
+            snps = VariationsNpy(npy_dir, 'w')
+            snps.put_chunks(in_snps.iterate_chunks(chunk_size=200))
+            snps.close()
+            assert os.path.exists(join(npy_dir, 'calls', 'GT.npy'))
+
+            snps = VariationsNpy(npy_dir, 'r')
+            assert sorted(snps.keys()) == sorted(in_snps.keys())
+            assert snps.samples == in_snps.samples
+            assert snps.metadata == in_snps.metadata
+            assert isinstance(snps[GT_FIELD], numpy.memmap)
+            for field in in_snps.keys():
+                in_mat = in_snps[field][:]
+                if in_mat.dtype.kind == 'f':
+                    assert numpy.allclose(snps[field], in_mat, equal_nan=True)
+                else:
+                    assert numpy.all(snps[field][:] == in_mat)
+            chunk = snps.get_chunk(slice(100, 300))
+            assert numpy.all(chunk[POS_FIELD] == in_snps[POS_FIELD][100:300])
+            assert list(snps.chroms) == list(in_snps.chroms)
+            try:
+                snps.put_chunks([chunk])
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+
+            # back to hdf5
+            fhand = NamedTemporaryFile(suffix='.h5')
+            fpath = fhand.name
+            fhand.close()
+            try:
+                h5 = snps.copy(VariationsH5(fpath, 'w'), chunk_size=500)
+                assert numpy.all(h5[GT_FIELD][:] == in_snps[GT_FIELD][:])
+                assert numpy.all(h5[ALT_FIELD][:] == in_snps[ALT_FIELD][:])
+                h5.close()
+            finally:
+                os.remove(fpath)
+
+            # a non empty dir can not be created again
+            try:
+                VariationsNpy(npy_dir, 'w')
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_append(self):
+        tmp_dir = mkdtemp()
+        try:
+            chunk1 = VariationsArrays()
+            chunk1[CHROM_FIELD] = numpy.array([b'c1', b'c1'])
+            chunk1[POS_FIELD] = numpy.array([1, 2], dtype=numpy.int32)
+            chunk1[GT_FIELD] = numpy.zeros((2, 3, 2), dtype=numpy.int8)
+            chunk2 = VariationsArrays()
+            chunk2[CHROM_FIELD] = numpy.array([b'chr2'])
+            chunk2[POS_FIELD] = numpy.array([3], dtype=numpy.int32)
+            chunk2[GT_FIELD] = numpy.ones((1, 3, 2), dtype=numpy.int8)
+
+            snps = VariationsNpy(tmp_dir, 'w')
+            snps.put_chunks([chunk1])
+            snps.close()
+            snps = VariationsNpy(tmp_dir, 'r+')
+            snps.put_chunks([chunk2])
+            assert list(snps[POS_FIELD]) == [1, 2, 3]
+            # the wider strings rewrite the file
+            assert list(snps[CHROM_FIELD]) == [b'c1', b'c1', b'chr2']
+            assert snps[GT_FIELD].shape == (3, 3, 2)
+            assert numpy.all(snps[GT_FIELD][2] == 1)
+            # The files are still valid npy files
+            gts = numpy.load(join(tmp_dir, 'calls', 'GT.npy'))
+            assert numpy.all(gts == snps[GT_FIELD])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+from tempfile import NamedTemporaryFile
+
+import numpy
+
+from variation import GT_FIELD, PACKED_GT_FIELD, MISSING_INT
+from variation.matrix.packed_gts import PackedGTs
+from variation.matrix.stats import counts_by_row
+from variation.variations.vars_matrices import VariationsArrays, VariationsH5
+from variation.variations.stats import call_is_het, calc_missing_gt
+from variation.variations.distance import calc_pairwise_distance
+
+
+def _create_gts(n_snps, n_samples):
+    random_state = numpy.random.RandomState(3)
+    gts = random_state.randint(0, 2, size=(n_snps, n_samples, 2))
+    gts[random_state.uniform(size=(n_snps, n_samples)) < 0.1] = -1
+    return gts.astype(numpy.int16)
+
+
+class PackedGTsTest(unittest.TestCase):
+    def test_pack(self):
+        gts = numpy.array([[[0, 0], [0, 1], [1, 0], [1, 1], [-1, -1]],
+                           [[1, 1], [1, 1], [-1, -1], [0, 0], [0, 1]]])
+        packed_gts = PackedGTs.from_gts(gts)
+        assert packed_gts.packed.shape == (2, 2)
+        assert packed_gts.shape == (2, 5, 2)
+        assert numpy.all(packed_gts.codes == [[0, 1, 1, 2, 3],
+                                              [2, 2, 3, 0, 1]])
+        expected = numpy.array([[[0, 0], [0, 1], [0, 1], [1, 1], [-1, -1]],
+                                [[1, 1], [1, 1], [-1, -1], [0, 0], [0, 1]]])
+        assert numpy.all(packed_gts.unpack() == expected)
+        assert numpy.all(packed_gts[1:].codes == [[2, 2, 3, 0, 1]])
+
+        for gts in (numpy.array([[[0, 2]]]), numpy.array([[[0, 1, 1]]])):
+            try:
+                PackedGTs.from_gts(gts)
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+
+    def test_kernels(self):
+        gts = _create_gts(200, 37)
+        variations = VariationsArrays()
+        variations[GT_FIELD] = gts
+        packed_gts = variations.packed_gts
+
+        counts = packed_gts.count_gt_types()
+        assert numpy.all(counts.sum(axis=1) == 37)
+        assert numpy.all(counts[:, 1] == call_is_het(gts).sum(axis=1))
+        assert numpy.all(counts[:, 3] == calc_missing_gt(variations,
+                                                         rates=False))
+        counts = packed_gts.count_gt_types(axis=0)
+        assert numpy.all(counts[:, 1] == call_is_het(gts).sum(axis=0))
+
+        expected = counts_by_row(gts, missing_value=-1)
+        assert numpy.all(packed_gts.count_alleles() == expected)
+        assert numpy.all(packed_gts.as_mat012() == variations.gts_as_mat012)
+
+        ibs_counts, n_snps = packed_gts.calc_pairwise_ibs()
+        assert ibs_counts.shape == (37 * 36 / 2,)
+        dosages = packed_gts.codes.astype(float)
+        dosages[dosages == 3] = numpy.nan
+        shared = 2 - numpy.abs(dosages[:, 0] - dosages[:, 1])
+        assert ibs_counts[0] == numpy.nansum(shared)
+        assert n_snps[0] == numpy.sum(~numpy.isnan(shared))
+
+    def test_packed_dataset(self):
+        fpath = NamedTemporaryFile(suffix='.h5').name
+        try:
+            variations = VariationsH5(fpath, 'w')
+            chunk = VariationsArrays()
+            chunk[GT_FIELD] = _create_gts(200, 37)
+            chunk.samples = [str(idx) for idx in range(37)]
+            variations.put_chunks([chunk])
+            variations.write_packed_gts(chunk_size=60)
+            assert PACKED_GT_FIELD not in variations.keys()
+            assert variations[PACKED_GT_FIELD].shape == (200, 10)
+            packed_gts = variations.packed_gts
+            assert numpy.all(packed_gts.packed ==
+                             variations[PACKED_GT_FIELD][:])
+            expected = PackedGTs.from_gts(chunk[GT_FIELD])
+            assert numpy.all(packed_gts.packed == expected.packed)
+
+            # The chunks are read from the stored packed gts
+            chunks = list(variations.iterate_packed_gts(chunk_size=70))
+            assert [chunk.num_variations for chunk in chunks] == [70, 70, 60]
+            assert numpy.all(numpy.vstack([chunk.packed for chunk in chunks])
+                             == expected.packed)
+            distance = calc_pairwise_distance(variations, method='ibs',
+                                              chunk_size=70)
+            assert numpy.allclose(distance,
+                                  calc_pairwise_distance(variations,
+                                                         method='ibs'))
+            variations[PACKED_GT_FIELD][:] = 255
+            distance = calc_pairwise_distance(variations, method='ibs',
+                                              chunk_size=70)
+            assert numpy.all(numpy.isnan(distance))
+            assert numpy.all(variations.gts_as_mat012 == MISSING_INT)
+
+            # The stored packed gts are not used once the GTs are written
+            gts = variations[GT_FIELD]
+            gts[0, 0] = [1, 1]
+            assert numpy.all(variations.packed_gts.unpack() ==
+                             PackedGTs.from_gts(gts).unpack())
+            assert not numpy.any(numpy.isnan(calc_pairwise_distance(
+                variations, method='ibs', chunk_size=70)))
+            variations.close()
+        finally:
+            os.remove(fpath)
+
+    def test_ibs_with_no_snps(self):
+        variations = VariationsArrays()
+        variations[GT_FIELD] = numpy.empty((0, 3, 2), dtype=numpy.int16)
+        for chunk_size in (None, 10):
+            distance = calc_pairwise_distance(variations, method='ibs',
+                                              chunk_size=chunk_size)
+            assert distance.shape == (3,)
+            assert numpy.all(numpy.isnan(distance))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,12 +6,13 @@
 # Missing docstring
 # pylint: disable=C0111
 
+import json
 import unittest
 from os.path import join
 
 import numpy
 
-from variation.variations.pipeline import Pipeline
+from variation.variations.pipeline import Pipeline, PipelineProfile
 from variation.variations.filters import (MinCalledGTsFilter, MafFilter,
                                           MacFilter, ObsHetFilter, FLT_VARS,
                                           LowDPGTsToMissingSetter,
@@ -248,6 +249,104 @@ class PipelineTest(unittest.TestCase):
         assert numpy.allclose(vars_out['/calls/GT'],
                               result2[FLT_VARS]['/calls/GT'])
 
+    def test_run_in_parallel(self):
+        hdf5 = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        pipeline = Pipeline()
+        pipeline.append(MinCalledGTsFilter(min_called=0.1, do_histogram=True),
+                        id_='filter1')
+        pipeline.append(MafFilter(max_maf=0.9, do_histogram=True),
+                        id_='filter2')
+        vars_out = VariationsArrays()
+        result = pipeline.run(hdf5, vars_out, chunk_size=100)
+
+        # the workers read the chunks from the file or they are sent to them
+        for vars_in in (hdf5, hdf5.copy()):
+            vars_out2 = VariationsArrays()
+            result2 = pipeline.run(vars_in, vars_out2, chunk_size=100,
+                                   n_workers=2)
+            assert numpy.all(vars_out2['/calls/GT'] == vars_out['/calls/GT'])
+            assert numpy.all(vars_out2['/variations/pos'] ==
+                             vars_out['/variations/pos'])
+            for step_id in ('filter1', 'filter2'):
+                assert numpy.all(result2[step_id]['counts'] ==
+                                 result[step_id]['counts'])
+                assert (result2[step_id][FLT_STATS] ==
+                        result[step_id][FLT_STATS])
+
+    def test_histograms_in_one_pass(self):
+        hdf5 = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        variations = hdf5.copy()
+        pipeline = Pipeline()
+        flt = MafFilter(max_maf=0.9, do_histogram=True)
+        pipeline.append(flt, id_='filter1')
+        result = pipeline.run(variations, chunk_size=100)
+
+        # the histogram is the one of the whole variations
+        result2 = flt(variations)
+        assert numpy.all(result['filter1']['counts'] == result2['counts'])
+        assert numpy.allclose(result['filter1']['edges'], result2['edges'])
+        assert flt.range is None
+
+    def test_fused_filters(self):
+        hdf5 = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        pipeline = Pipeline()
+        pipeline.append(MinCalledGTsFilter(min_called=0.6, do_histogram=True),
+                        id_='called')
+        pipeline.append(MafFilter(max_maf=0.8, do_histogram=True), id_='maf')
+        samples = ['1_14_1_gbs', '1_17_1_gbs']
+        pipeline.append(IsVariableAnnotator(annot_id='test', samples=samples))
+        pipeline.append(FieldValueFilter(field_path='/variations/info/test',
+                                         value=1), id_='variable')
+        pipeline.append(ObsHetFilter(max_het=0.05, do_histogram=True),
+                        id_='het')
+        vars_out = VariationsArrays()
+        result = pipeline.run(hdf5, vars_out, chunk_size=200)
+
+        fused_vars_out = VariationsArrays()
+        fused_result = pipeline.run(hdf5, fused_vars_out, chunk_size=200,
+                                    fused=True)
+        assert vars_out.num_variations
+        for field in (GT_FIELD, '/variations/pos'):
+            assert numpy.all(fused_vars_out[field] == vars_out[field])
+        for step_id in ('called', 'maf', 'het'):
+            assert numpy.all(fused_result[step_id]['counts'] ==
+                             result[step_id]['counts'])
+            assert numpy.allclose(fused_result[step_id]['edges'],
+                                  result[step_id]['edges'])
+        for step_id in ('called', 'maf', 'variable', 'het'):
+            assert (fused_result[step_id][FLT_STATS] ==
+                    result[step_id][FLT_STATS])
+
+    def test_profile(self):
+        hdf5 = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        pipeline = Pipeline()
+        pipeline.append(MinCalledGTsFilter(min_called=0.6), id_='called')
+        pipeline.append(MafFilter(max_maf=0.8), id_='maf')
+
+        for kwargs in ({}, {'fused': True}, {'n_workers': 2}):
+            profile = PipelineProfile(trace_memory=True)
+            result = pipeline.run(hdf5, VariationsArrays(), chunk_size=200,
+                                  profile=profile, **kwargs)
+            steps = profile.to_dict()['steps']
+            assert [step['id'] for step in steps] == ['called', 'maf']
+            for step in steps:
+                stats = result[step['id']][FLT_STATS]
+                assert step['rows_in'] == stats[TOT]
+                assert step['rows_out'] == stats[N_KEPT]
+                assert step['wall_time'] >= 0 and step['cpu_time'] >= 0
+                assert step['peak_memory'] >= 0
+            assert profile.read['n_chunks'] == steps[0]['n_chunks'] == 5
+            assert profile.write['n_chunks'] == 5
+            assert json.loads(profile.to_json())['steps'][1]['id'] == 'maf'
+            table = profile.to_table()
+            assert 'called' in table and 'read' in table
+
+        profile = PipelineProfile()
+        pipeline.run(hdf5, chunk_size=200, profile=profile)
+        assert profile.steps['called']['peak_memory'] is None
+        assert profile.steps['called']['bytes_materialized'] > 0
+        assert not profile.write['n_chunks']
+
     def test_fieldpath(self):
         pipeline = Pipeline()
         annot_id = 'test'
@@ -0,0 +1,121 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+from os.path import join
+
+import numpy
+
+from test.test_utils import TEST_DATA_DIR, create_h5_fpath
+from variation import ALT_FIELD, AO_FIELD, CHROM_FIELD
+from variation.matrix.ragged import RaggedMatrix, encode_ragged, pad_ragged
+from variation.variations.vars_matrices import VariationsH5
+
+
+class RaggedTest(unittest.TestCase):
+    def test_encode(self):
+        alts = numpy.array([[b'A', b'', b''], [b'C', b'G', b''],
+                            [b'', b'', b''], [b'T', b'', b'TT']])
+        values, lengths = encode_ragged(alts, missing_value=b'')
+        # The missing items inside a row are kept
+        assert list(values) == [b'A', b'C', b'G', b'T', b'', b'TT']
+        assert list(lengths) == [1, 2, 0, 3]
+        assert numpy.all(pad_ragged(values, lengths, 3, b'') == alts)
+
+        ads = numpy.array([[[1, -1], [2, -1]], [[1, 2], [-1, 3]]])
+        values, lengths = encode_ragged(ads, missing_value=-1)
+        assert values.shape == (3, 2)
+        assert list(lengths) == [1, 2]
+        assert numpy.all(pad_ragged(values, lengths, 2, -1) == ads)
+
+        strs = numpy.array([b'AAAA', b'', b'B'])
+        values, lengths = encode_ragged(strs, missing_value=b'')
+        assert values.dtype == numpy.uint8
+        assert list(lengths) == [4, 0, 1]
+        assert numpy.all(pad_ragged(values, lengths, 4, b'', as_bytes=True) ==
+                         strs)
+
+        floats = numpy.array([[1.5, numpy.nan], [numpy.nan, numpy.nan]])
+        values, lengths = encode_ragged(floats, missing_value=numpy.nan)
+        assert list(lengths) == [1, 0]
+
+    def test_matrix(self):
+        ads = numpy.array([[[1, -1, -1], [2, -1, -1]],
+                           [[1, 2, -1], [-1, 3, -1]],
+                           [[1, 2, 3], [-1, -1, 4]]])
+        values, lengths = encode_ragged(ads, missing_value=-1)
+        offsets = numpy.append(0, numpy.cumsum(lengths))
+        matrix = RaggedMatrix(values, offsets, width=3, missing_value=-1)
+        assert matrix.shape == (3, 2, 3)
+        assert numpy.all(matrix[:] == ads)
+        assert numpy.all(matrix[[2, 0]] == ads[[2, 0]])
+        assert numpy.all(matrix[1] == ads[1])
+        assert numpy.all(matrix[:, 1] == ads[:, 1])
+        assert numpy.all(matrix.padded(slice(0, 2), width=2) ==
+                         ads[:2, :, :2])
+        assert list(matrix.lengths()) == [1, 2, 3]
+        items, lengths = matrix.get_items([0, 2])
+        assert items.shape == (4, 2)
+        assert list(lengths) == [1, 3]
+        try:
+            matrix.padded(width=2)
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+
+class RaggedH5Test(unittest.TestCase):
+    def test_ragged_fields(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        fields = [ALT_FIELD, AO_FIELD, '/variations/info/CIGAR']
+        fpath = create_h5_fpath()
+        try:
+            out_snps = VariationsH5(fpath, 'w', ragged_fields=fields)
+            out_snps.put_chunks(in_snps.iterate_chunks(chunk_size=200))
+            out_snps.close()
+
+            out_snps = VariationsH5(fpath, 'r')
+            assert sorted(out_snps.keys()) == sorted(in_snps.keys())
+            # The matrices are as wide as the longest row, not as the padding
+            assert out_snps[ALT_FIELD].shape == (943, 3)
+            assert in_snps[ALT_FIELD].shape == (943, 4)
+            for field in fields:
+                assert isinstance(out_snps[field], RaggedMatrix)
+                in_mat = in_snps[field][:]
+                if in_mat.ndim > 1:
+                    out_mat = out_snps[field].padded(width=in_mat.shape[-1])
+                else:
+                    out_mat = out_snps[field][:]
+                assert numpy.all(out_mat == in_mat)
+            chunk = out_snps.get_chunk(slice(100, 300))
+            width = chunk[AO_FIELD].shape[2]
+            assert numpy.all(chunk[AO_FIELD] ==
+                             in_snps[AO_FIELD][100:300, :, :width])
+            out_snps.close()
+
+            try:
+                VariationsH5(fpath, 'r', ragged_fields=fields)
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+        finally:
+            os.remove(fpath)
+
+        fpath = create_h5_fpath()
+        try:
+            VariationsH5(fpath, 'w', categorical=True,
+                         ragged_fields=[CHROM_FIELD])
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+        finally:
+            os.remove(fpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
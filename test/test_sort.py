@@ -1,13 +1,24 @@
 
+import os
 import unittest
 from os.path import join
+from tempfile import mkdtemp
 
 import numpy
 
-from variation.variations.vars_matrices import VariationsArrays
+from variation import CHROM_FIELD, POS_FIELD, GT_FIELD
+from variation.variations.vars_matrices import VariationsArrays, VariationsH5
 from variation.gt_parsers.csv import CSVParser
 from variation.variations.sort import sort_variations
-from test.test_utils import TEST_DATA_DIR
+from test.test_utils import TEST_DATA_DIR, create_h5_fpath
+
+
+class _FailingVariations(VariationsArrays):
+    'It fails to read the rows from the third run on'
+    def get_chunk(self, index, *args, **kwargs):
+        if isinstance(index, slice) and index.start >= 400:
+            raise RuntimeError('The rows could not be read')
+        return super().get_chunk(index, *args, **kwargs)
 
 
 class SortVariationsTest(unittest.TestCase):
@@ -27,5 +38,60 @@ class SortVariationsTest(unittest.TestCase):
         assert numpy.all(sorted_vars['/variations/pos'] == exp_pos)
         fhand.close()
 
+    def test_external_sort(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        shuffled = in_snps.copy()
+        shuffled = shuffled.get_chunk(numpy.random.RandomState(1).permutation(
+            in_snps.num_variations))
+        expected = shuffled.get_chunk(numpy.lexsort((shuffled[POS_FIELD],
+                                                     shuffled[CHROM_FIELD])))
+        fpath = create_h5_fpath()
+        sorted_fpath = create_h5_fpath()
+        tmp_dir = mkdtemp()
+        try:
+            h5 = VariationsH5(fpath, 'w')
+            h5.put_chunks([shuffled])
+            # the variations are merged from 5 runs
+            sorted_h5 = VariationsH5(sorted_fpath, 'w')
+            sort_variations(h5, sorted_h5, run_size=200, tmp_dir=tmp_dir)
+            # the runs are removed
+            assert not os.listdir(tmp_dir)
+            for field in (CHROM_FIELD, POS_FIELD, GT_FIELD):
+                assert numpy.all(sorted_h5[field][:] == expected[field])
+            assert sorted_h5.samples == in_snps.samples
+
+            # the sorted variations are copied
+            sorted_vars = VariationsArrays()
+            sort_variations(sorted_h5, sorted_vars, run_size=200,
+                            tmp_dir=tmp_dir)
+            assert numpy.all(sorted_vars[GT_FIELD] == expected[GT_FIELD])
+            assert not os.listdir(tmp_dir)
+            h5.close()
+            sorted_h5.close()
+        finally:
+            os.remove(fpath)
+            os.remove(sorted_fpath)
+            os.rmdir(tmp_dir)
+
+    def test_runs_removed_on_error(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        shuffled = in_snps.copy().get_chunk(
+            numpy.random.RandomState(1).permutation(in_snps.num_variations))
+        variations = _FailingVariations()
+        variations.put_chunks([shuffled])
+        tmp_dir = mkdtemp()
+        try:
+            try:
+                sort_variations(variations, VariationsArrays(), run_size=200,
+                                tmp_dir=tmp_dir)
+                self.fail('RuntimeError expected')
+            except RuntimeError:
+                pass
+            # the runs already spilled are removed
+            assert not os.listdir(tmp_dir)
+        finally:
+            os.rmdir(tmp_dir)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,166 @@
+# Method could be a function
+# pylint: disable=R0201
+# Too many public methods
+# pylint: disable=R0904
+# Missing docstring
+# pylint: disable=C0111
+
+import os
+import unittest
+from os.path import join
+
+import numpy
+
+from test.test_utils import TEST_DATA_DIR, create_h5_fpath
+from variation import GT_FIELD, POS_FIELD
+from variation.variations.vars_matrices import (VariationsH5,
+                                                get_storage_profile,
+                                                get_dset_params)
+from variation.variations.storage import (benchmark_storage_profiles,
+                                          recommend_storage_profile,
+                                          apply_storage_profile, repack_h5)
+
+
+class StorageProfileTest(unittest.TestCase):
+    def test_dset_params(self):
+        profile = get_storage_profile('default')
+        params = get_dset_params(profile, GT_FIELD, (10, 153, 2))
+        assert params == {'compression': 'gzip', 'compression_opts': 4,
+                          'shuffle': True, 'fletcher32': True,
+                          'chunks': (600, 153, 2)}
+
+        profile = {'*': {'codec': 'lzf', 'shuffle': True},
+                   '/calls/': {'codec': 'gzip', 'level': 9,
+                               'chunks': (100, 50)},
+                   POS_FIELD: {'codec': 'none', 'checksum': True}}
+        profile = get_storage_profile(profile)
+        params = get_dset_params(profile, GT_FIELD, (10, 153, 2))
+        assert params == {'compression': 'gzip', 'compression_opts': 9,
+                          'shuffle': True, 'fletcher32': False,
+                          'chunks': (100, 50, 2)}
+        params = get_dset_params(profile, POS_FIELD, (10,))
+        assert params == {'compression': None, 'shuffle': True,
+                          'fletcher32': True, 'chunks': (600,)}
+        params = get_dset_params(profile, '/variations/ref', (0,))
+        assert params['compression'] == 'lzf'
+        assert params['chunks'] == (600,)
+
+        try:
+            get_storage_profile('unknown')
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+        try:
+            get_storage_profile({'*': {'codec': 'bzip2'}})
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+        try:
+            get_storage_profile({'*': {'compression': 'gzip'}})
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+    def test_h5_with_profile(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        profile = {'*': {'codec': 'lzf', 'chunks': (300,)},
+                   GT_FIELD: {'codec': 'gzip', 'level': 1,
+                              'chunks': (100, 10)}}
+        fpath = create_h5_fpath()
+        try:
+            out_snps = VariationsH5(fpath, mode='w', storage_profile=profile)
+            out_snps.put_chunks(in_snps.iterate_chunks(stop=500))
+            out_snps.close()
+
+            # The profile is kept in the file for the next appends
+            out_snps = VariationsH5(fpath, mode='r+')
+            out_snps.put_chunks(in_snps.iterate_chunks(start=500))
+            gts = out_snps[GT_FIELD]
+            assert gts.compression == 'gzip'
+            assert gts.compression_opts == 1
+            assert gts.chunks == (100, 10, 2)
+            assert not gts.fletcher32
+            pos = out_snps[POS_FIELD]
+            assert pos.compression == 'lzf'
+            assert pos.chunks == (300,)
+            assert numpy.all(gts[:] == in_snps[GT_FIELD][:])
+            assert numpy.all(pos[:] == in_snps[POS_FIELD][:])
+            out_snps.close()
+        finally:
+            os.remove(fpath)
+
+    def test_tune_profiles(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        profiles = ['default', 'uncompressed', {'*': {'codec': 'lzf'}}]
+        for access_pattern in ('chunks', 'random', 'fields'):
+            results = benchmark_storage_profiles(in_snps, profiles=profiles,
+                                                 access_pattern=access_pattern,
+                                                 kept_fields=[GT_FIELD],
+                                                 num_snps=300, chunk_size=100,
+                                                 n_random_reads=10)
+            assert [result['profile'] for result in results] == profiles
+            assert all(result['read_time'] >= 0 for result in results)
+        sizes = {result['profile']: result['size'] for result in results
+                 if isinstance(result['profile'], str)}
+        assert sizes['default'] < sizes['uncompressed']
+        assert recommend_storage_profile(results, 'size') == 'default'
+
+        try:
+            benchmark_storage_profiles(in_snps, access_pattern='fields')
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+        fpath = create_h5_fpath()
+        try:
+            out_snps = apply_storage_profile(in_snps, fpath, 'uncompressed')
+            assert out_snps[GT_FIELD].compression is None
+            assert out_snps.num_variations == in_snps.num_variations
+            out_snps.close()
+        finally:
+            os.remove(fpath)
+
+
+class RepackTest(unittest.TestCase):
+    def test_repack(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        grown_fpath = create_h5_fpath()
+        out_fpath = create_h5_fpath()
+        try:
+            # The datasets are replaced when a chunk does not fit
+            grown_snps = VariationsH5(grown_fpath, mode='w')
+            for chunk in in_snps.iterate_chunks(chunk_size=100):
+                grown_snps.put_chunks([chunk])
+            grown_snps.close()
+
+            for n_processes in (None, 2):
+                report = repack_h5(grown_fpath, out_fpath,
+                                   storage_profile='fast',
+                                   n_processes=n_processes, chunk_size=200)
+                assert report['out_size'] > 0
+                assert report['in_read_time'] > 0
+                out_snps = VariationsH5(out_fpath, mode='r')
+                assert out_snps.samples == in_snps.samples
+                assert out_snps.metadata == in_snps.metadata
+                assert sorted(out_snps.keys()) == sorted(in_snps.keys())
+                assert out_snps[GT_FIELD].compression == 'lzf'
+                assert out_snps[GT_FIELD].chunks == (600, 153, 2)
+                assert numpy.all(out_snps[GT_FIELD][:] ==
+                                 in_snps[GT_FIELD][:])
+                assert out_snps._storage_profile['*']['codec'] == 'lzf'
+                out_snps.close()
+                os.remove(out_fpath)
+
+            # by default the storage profile of the input file
+            report = repack_h5(grown_fpath, out_fpath)
+            out_snps = VariationsH5(out_fpath, mode='r')
+            assert out_snps[GT_FIELD].compression == 'gzip'
+            out_snps.close()
+        finally:
+            for fpath in (grown_fpath, out_fpath):
+                if os.path.exists(fpath):
+                    os.remove(fpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,17 @@
 # pylint: disable=C0111
 
 from os.path import dirname, abspath, join
+from tempfile import NamedTemporaryFile
 import inspect
 
 TEST_DATA_DIR = abspath(join(dirname(inspect.getfile(inspect.currentframe())),
                         'test_data'))
 BIN_DIR = abspath(join(dirname(__file__), '..', 'bin'))
+
+
+def create_h5_fpath():
+    'It returns the path of a new temporary HDF5 file that does not exist'
+    fhand = NamedTemporaryFile(suffix='.h5')
+    fpath = fhand.name
+    fhand.close()
+    return fpath
@@ -254,6 +254,77 @@ class VarMatsTests(unittest.TestCase):
             chunk2 = var_mats.get_chunk(slice(100, 200))
             assert numpy.all(chunk1[GT_FIELD] == chunk2[GT_FIELD])
 
+    def test_get_chunk_with_threads(self):
+        fpath = join(TEST_DATA_DIR, 'ril.hdf5')
+        h5 = VariationsH5(fpath, mode='r')
+        h5_threads = VariationsH5(fpath, mode='r', n_threads=2)
+        slices = [slice(0, 200), slice(150, 700), slice(900, None),
+                  slice(None, None)]
+        for slice_ in slices:
+            chunk = h5.get_chunk(slice_)
+            chunk2 = h5_threads.get_chunk(slice_)
+            assert sorted(chunk.keys()) == sorted(chunk2.keys())
+            for path in chunk.keys():
+                equal_nan = chunk[path].dtype.kind == 'f'
+                assert numpy.array_equal(chunk[path], chunk2[path],
+                                         equal_nan=equal_nan)
+        chunks = list(h5_threads.iterate_chunks(chunk_size=300))
+        assert sum(chunk.num_variations for chunk in chunks) == 943
+        h5_threads.close()
+
+    def test_put_chunks_with_threads(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        out_fpath = NamedTemporaryFile(suffix='.hdf5').name
+        out_snps = VariationsH5(out_fpath, mode='w', n_threads=2)
+        try:
+            out_snps.put_chunks(in_snps.iterate_chunks(chunk_size=130))
+            assert sorted(out_snps.keys()) == sorted(in_snps.keys())
+            for path in in_snps.keys():
+                equal_nan = in_snps[path].dtype.kind == 'f'
+                assert numpy.array_equal(in_snps[path][:], out_snps[path][:],
+                                         equal_nan=equal_nan)
+        finally:
+            out_snps.close()
+            os.remove(out_fpath)
+
+    def test_get_chunk_for_samples(self):
+        in_snps = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        out_fpath = NamedTemporaryFile(suffix='.hdf5').name
+        out_snps = VariationsH5(out_fpath, mode='w',
+                                storage_profile={'*': {'codec': 'gzip'},
+                                                 '/calls/': {'chunks': (200,
+                                                                        20)}})
+        try:
+            out_snps.put_chunks(in_snps.iterate_chunks())
+            assert out_snps[GT_FIELD].chunks == (200, 20, 2)
+            all_samples = in_snps.samples
+            samples = all_samples[100:130] + all_samples[40:41]
+            samples += all_samples[5:8]
+            expected_cols = [5, 6, 7, 40] + list(range(100, 130))
+            arrays = in_snps.get_chunk(slice(None))
+            for snps in (in_snps, out_snps, arrays):
+                for index in (slice(0, 300), [1, 5, 900], slice(0, 0)):
+                    chunk = snps.get_chunk(index, samples=samples)
+                    assert chunk.samples == [all_samples[col]
+                                             for col in expected_cols]
+                    expected = in_snps[GT_FIELD][index, ...]
+                    expected = expected[:, expected_cols]
+                    assert numpy.all(chunk[GT_FIELD] == expected)
+                    expected = in_snps[POS_FIELD][index]
+                    assert numpy.all(chunk[POS_FIELD] == expected)
+                chunk = snps.get_chunk(slice(0, 10), samples=[])
+                assert chunk[GT_FIELD].shape == (10, 0, 2)
+            chunks = out_snps.iterate_chunks(chunk_size=300, samples=samples)
+            assert all(chunk[GT_FIELD].shape[1] == 34 for chunk in chunks)
+            try:
+                out_snps.get_chunk(slice(0, 10), samples=['no_sample'])
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+        finally:
+            out_snps.close()
+            os.remove(out_fpath)
+
     def test_copy(self):
         in_snps = VariationsH5(join(TEST_DATA_DIR, '1000snps.hdf5'), mode='r')
         for klass in VAR_MAT_CLASSES:
@@ -466,6 +537,90 @@ class GetHaploidTest(unittest.TestCase):
         assert numpy.all(haploid_gts == expected)
 
 
+class InMemoryTest(unittest.TestCase):
+
+    def test_in_memory(self):
+        fpath = join(TEST_DATA_DIR, 'ril.hdf5')
+        h5 = VariationsH5(fpath, mode='r')
+        for n_threads in (None, 2):
+            mem_h5 = VariationsH5(fpath, mode='r', in_memory=True,
+                                  n_threads=n_threads)
+            assert mem_h5.in_memory
+            assert mem_h5.load_stats['n_fields'] == len(h5.keys())
+            assert mem_h5.load_stats['n_bytes'] > 0
+            assert isinstance(mem_h5[GT_FIELD], numpy.ndarray)
+            assert numpy.all(mem_h5[GT_FIELD] == h5[GT_FIELD][:])
+            chunk = mem_h5.get_chunk(slice(10, 20))
+            assert numpy.all(chunk[POS_FIELD] == h5[POS_FIELD][10:20])
+            assert list(mem_h5.chroms) == list(h5.chroms)
+            mem_h5.close()
+
+        try:
+            fhand = NamedTemporaryFile(suffix='.h5')
+            VariationsH5(fhand.name, mode='w', in_memory=True)
+            self.fail('ValueError expected')
+        except ValueError:
+            pass
+
+
+class OrderStatusTest(unittest.TestCase):
+
+    def _create_chunk(self, chroms, poss):
+        chunk = VariationsArrays()
+        chunk[CHROM_FIELD] = numpy.array(chroms)
+        chunk[POS_FIELD] = numpy.array(poss, dtype=numpy.int32)
+        chunk[GT_FIELD] = numpy.zeros((len(poss), 2, 2), dtype=numpy.int16)
+        return chunk
+
+    def test_order_status(self):
+        chunk1 = self._create_chunk([b'chr1', b'chr1', b'chr2'], [1, 5, 3])
+        chunk2 = self._create_chunk([b'chr2', b'chr3'], [3, 1])
+        chunk3 = self._create_chunk([b'chr10'], [1])
+        chunk4 = self._create_chunk([b'chr2'], [10])
+
+        fhand = NamedTemporaryFile(suffix='.h5')
+        fpath = fhand.name
+        fhand.close()
+        try:
+            h5 = VariationsH5(fpath, 'w')
+            h5.put_chunks([chunk1])
+            assert h5.order_status == {'sorted': True, 'grouped': True,
+                                       'unique_positions': True}
+            h5.put_chunks([chunk2])
+            assert h5.order_status == {'sorted': True, 'grouped': True,
+                                       'unique_positions': False}
+            h5.close()
+            # the status is kept in the file
+            h5 = VariationsH5(fpath, 'r+')
+            h5.put_chunks([chunk3])
+            assert h5.order_status == {'sorted': False, 'grouped': True,
+                                       'unique_positions': False}
+            try:
+                h5.pos_index
+                self.fail('RuntimeError expected')
+            except RuntimeError:
+                pass
+            h5.put_chunks([chunk4])
+            assert h5.order_status == {'sorted': False, 'grouped': False,
+                                       'unique_positions': None}
+            try:
+                list(h5.iterate_chunk_pairs(max_dist=10))
+                self.fail('ValueError expected')
+            except ValueError:
+                pass
+            h5.close()
+        finally:
+            os.remove(fpath)
+
+        # the status of the arrays set by hand is calculated
+        snps = self._create_chunk([b'chr1', b'chr2', b'chr1'], [1, 2, 3])
+        assert snps.order_status == {'sorted': False, 'grouped': False,
+                                     'unique_positions': None}
+        snps = self._create_chunk([b'chr2', b'chr1'], [1, 2])
+        assert snps.order_status == {'sorted': False, 'grouped': True,
+                                     'unique_positions': True}
+
+
 if __name__ == "__main__":
     # import sys; sys.argv = ['', 'GetHaploidTest']
     unittest.main()
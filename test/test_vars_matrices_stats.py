@@ -16,6 +16,7 @@ import numpy
 from variation import AD_FIELD
 from variation.variations.vars_matrices import VariationsH5, VariationsArrays
 from variation.variations.stats import (calc_maf, calc_mac, histogram,
+                                        HistogramSketch,
                                         histogram_for_chunks,
                                         _calc_maf_depth,
                                         calc_missing_gt, calc_obs_het,
@@ -163,6 +164,59 @@ class StatsTest(unittest.TestCase):
         assert numpy.allclose(bins, bins_expected)
         assert numpy.allclose(distrib, dist_expected)
 
+    def test_stat_cache(self):
+        gts = numpy.array([[[0, 0], [0, 1], [1, 1], [-1, -1]],
+                           [[0, 0], [0, 0], [0, 1], [0, 0]]])
+        varis = VariationsArrays()
+        varis[GT_FIELD] = gts
+        calls = []
+
+        def calc_stat():
+            calls.append(1)
+            return numpy.arange(3)
+        stat = varis.get_cached_stat(('test',), calc_stat)
+        assert numpy.all(varis.get_cached_stat(('test',), calc_stat) == stat)
+        assert len(calls) == 1
+        assert not stat.flags.writeable
+
+        assert numpy.allclose(calc_maf(varis, min_num_genotypes=1,
+                                       chunk_size=None), [0.5, 0.875])
+        # the cached allele counts are not modified by the stats
+        assert numpy.allclose(calc_mac(varis, min_num_genotypes=1,
+                                       chunk_size=None), [2.5, 3.5])
+        assert numpy.allclose(calc_maf(varis, min_num_genotypes=1,
+                                       chunk_size=None), [0.5, 0.875])
+
+        # the cache is forgotten when the chunk changes
+        del varis[GT_FIELD]
+        varis[GT_FIELD] = gts[:, :, ::-1][::-1]
+        assert numpy.allclose(calc_maf(varis, min_num_genotypes=1,
+                                       chunk_size=None), [0.875, 0.5])
+        varis.get_cached_stat(('test',), calc_stat)
+        assert len(calls) == 2
+
+    def test_histogram_sketch(self):
+        varis = VariationsH5(join(TEST_DATA_DIR, 'ril.hdf5'), mode='r')
+        mafs = calc_maf(varis, min_num_genotypes=1)
+        sketch = HistogramSketch()
+        for start in range(0, mafs.shape[0], 100):
+            sketch.merge(HistogramSketch(mafs[start:start + 100]))
+        distrib, bins = sketch.histogram(n_bins=10)
+        expected_distrib, expected_bins = histogram(mafs, n_bins=10)
+        assert numpy.all(distrib == expected_distrib)
+        assert numpy.allclose(bins, expected_bins)
+
+        # with too many values they are rounded
+        values = numpy.random.RandomState(1).normal(size=5000)
+        sketch = HistogramSketch(values[:2500], max_values=1000)
+        sketch.merge(HistogramSketch(values[2500:], max_values=1000))
+        assert sketch.values.shape[0] <= 1000
+        assert sketch.counts.sum() == 5000
+        distrib, bins = sketch.histogram(n_bins=10)
+        expected_distrib, expected_bins = histogram(values, n_bins=10)
+        assert numpy.allclose(bins, expected_bins, atol=sketch.step)
+        assert numpy.abs(distrib - expected_distrib).sum() <= 50
+
     def test_calculate_maf_depth(self):
         variations = {'/calls/AO': numpy.array([[[0, 0], [5, 0], [-1, -1],
                                                  [0, -1], [0, 0], [0, 10],
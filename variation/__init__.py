@@ -22,6 +22,25 @@ AD_FIELD = '/calls/AD'
 CHROM_FIELD = '/variations/chrom'
 POS_FIELD = '/variations/pos'
 INFO_FIELD = '/variations/info'
+# The groups starting with this prefix hold data derived from the fields,
+# they are not fields
+HIDDEN_GROUPS_PREFIX = '/_'
+PACKED_GT_FIELD = '/_packed/GT'
+# The stored fingerprints of the variations, one dataset by kind
+FINGERPRINTS_GROUP = '/_fingerprints'
+# The fields that can be stored as integer codes and the name of the
+# category table (in the categories group) used by every one
+CATEGORIES_GROUP = '/_categories'
+CATEGORICAL_FIELDS = {CHROM_FIELD: 'chrom',
+                      REF_FIELD: 'alleles',
+                      ALT_FIELD: 'alleles'}
+# With the compact coordinates the chrom field holds the values of the runs
+# and the pos field the delta encoded byte stream
+CHROM_RUN_ENDS_FIELD = '/_coords/chrom_run_ends'
+POS_BLOCKS_FIELD = '/_coords/pos_blocks'
+# The row offsets of the ragged fields are stored in this group under the
+# path of the field
+RAGGED_OFFSETS_GROUP = '/_ragged'
 
 
 class _MissingValues():
@@ -76,6 +95,10 @@ MISSING_VALUES = _MissingValues()
 # Speed is related to chunksize, so if you change snps-per-chunk check the
 # performance
 SNPS_PER_CHUNK = 600
+# The variations sorted in memory at once by the external sort
+SNPS_PER_SORT_RUN = 200000
+# Used to tile the sample axis of the calls in wide cohorts
+SAMPLES_PER_CHUNK = 256
 
 MIN_NUM_GENOTYPES_FOR_POP_STAT = 10
 MIN_CALL_DP_FOR_HET = 20
@@ -87,7 +110,31 @@ DEF_DSET_PARAMS = {
                    # checksum, slower but safer
                    'fletcher32': True}
 
+# Storage profiles that can be chosen when an HDF5 file is created.
+# For every field the most specific entry is used: the field path, its
+# group (ending in /) or *.
+# chunks are the rows per chunk followed by the chunk length for the rest of
+# the dimensions, None means the whole dimension
+STORAGE_PROFILES = {
+    # The same as DEF_DSET_PARAMS
+    'default': {'*': {'codec': 'gzip', 'level': 4, 'shuffle': True,
+                      'checksum': True, 'chunks': (SNPS_PER_CHUNK,)}},
+    'fast': {'*': {'codec': 'lzf', 'shuffle': True, 'checksum': False,
+                   'chunks': (SNPS_PER_CHUNK,)}},
+    'compact': {'*': {'codec': 'gzip', 'level': 9, 'shuffle': True,
+                      'checksum': True, 'chunks': (SNPS_PER_CHUNK * 4,)}},
+    'uncompressed': {'*': {'codec': None, 'shuffle': False,
+                           'checksum': False, 'chunks': (SNPS_PER_CHUNK,)}},
+    # The calls are also chunked along the samples, so reading some samples
+    # does not require to decompress all of them
+    'wide_cohort': {'*': {'codec': 'gzip', 'level': 4, 'shuffle': True,
+                          'checksum': True, 'chunks': (SNPS_PER_CHUNK,)},
+                    '/calls/': {'chunks': (SNPS_PER_CHUNK,
+                                           SAMPLES_PER_CHUNK)}}}
+
 PRE_READ_MAX_SIZE = 10000
+# The HDF5 files loaded in memory are read in batches of rows of this size
+IN_MEMORY_BATCH_BYTES = 64 * 1024 ** 2
 STATS_DEPTHS = ','.join([str(x) for x in range(0, 75, 5)])
 MAX_DEPTH = 100
 MIN_N_GENOTYPES = 10
@@ -0,0 +1,168 @@
+import numpy
+
+from variation import MISSING_BYTE
+
+# Missing docstring
+# pylint: disable=C0111
+
+CODES_DTYPE = numpy.int32
+# The missing value is always the first category, so the code 0 can be used
+# to fill the codes matrices
+MISSING_CODE = 0
+
+
+class CategoryTable:
+    '''The categories (byte strings) of one or several encoded fields.
+
+    A category keeps its code forever, the new ones are appended at the end.
+    '''
+    def __init__(self, categories=None):
+        self._categories = [MISSING_BYTE]
+        self._codes = {MISSING_BYTE: MISSING_CODE}
+        self._array = None
+        self._ranks = None
+        self.changed = False
+        if categories is not None:
+            for category in categories:
+                self._add(bytes(category))
+            self.changed = False
+
+    def __len__(self):
+        return len(self._categories)
+
+    def _add(self, category):
+        if category not in self._codes:
+            self._codes[category] = len(self._categories)
+            self._categories.append(category)
+            self._array = None
+            self._ranks = None
+            self.changed = True
+        return self._codes[category]
+
+    @property
+    def categories(self):
+        if self._array is None:
+            self._array = numpy.array(self._categories, dtype=numpy.bytes_)
+        return self._array
+
+    @property
+    def ranks(self):
+        'The position of every category in the sorted categories'
+        if self._ranks is None:
+            ranks = numpy.empty(len(self._categories), dtype=CODES_DTYPE)
+            ranks[numpy.argsort(self.categories)] = numpy.arange(len(ranks))
+            self._ranks = ranks
+        return self._ranks
+
+    def code(self, category):
+        'It returns the code of the category or None if it is not in the table'
+        if isinstance(category, str):
+            category = category.encode()
+        return self._codes.get(category)
+
+    def encode(self, values):
+        'It returns the codes for the values, new categories are added'
+        values = numpy.asarray(values)
+        if values.dtype.kind == 'U':
+            values = numpy.char.encode(values)
+        uniq_values, inverse = numpy.unique(values, return_inverse=True)
+        uniq_codes = numpy.array([self._add(bytes(value))
+                                  for value in uniq_values],
+                                 dtype=CODES_DTYPE)
+        return uniq_codes[inverse].reshape(values.shape)
+
+    def decode(self, codes):
+        return self.categories[numpy.asarray(codes, dtype=CODES_DTYPE)]
+
+
+class CategoricalMatrix:
+    '''A matrix of byte strings stored as integer codes into a CategoryTable.
+
+    It is read as a numpy array (it decodes the requested rows), but the
+    equality with a category and the sort order can be computed with the
+    codes.
+    When the values are set, on_change is called if new categories have
+    been added to the table.
+    '''
+    def __init__(self, codes, table, on_change=None):
+        self.codes = codes
+        self.table = table
+        self._on_change = on_change
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return len(self.codes.shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.codes.shape))
+
+    @property
+    def dtype(self):
+        return self.table.categories.dtype
+
+    @property
+    def categories(self):
+        return self.table.categories
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, index):
+        return self.table.decode(self.codes[index])
+
+    def __setitem__(self, index, values):
+        self.codes[index] = self.table.encode(values)
+        if self.table.changed and self._on_change is not None:
+            self._on_change()
+
+    def __array__(self, dtype=None):
+        array = self[...]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def get_codes(self, index=Ellipsis):
+        codes = self.codes[index]
+        if not isinstance(codes, numpy.ndarray):
+            codes = numpy.array(codes)
+        return codes
+
+    def _compare(self, other):
+        if isinstance(other, (bytes, numpy.bytes_)):
+            code = self.table.code(other)
+            codes = self.get_codes()
+            if code is None:
+                return numpy.zeros(codes.shape, dtype=bool)
+            return codes == code
+        return numpy.asarray(self) == other
+
+    def __eq__(self, other):
+        return self._compare(other)
+
+    def __ne__(self, other):
+        return numpy.logical_not(self._compare(other))
+
+    __hash__ = None
+
+    def sort_keys(self, index=Ellipsis):
+        'Integer keys that sort as the decoded strings'
+        return self.table.ranks[self.get_codes(index)]
+
+    def unique(self):
+        'The sorted categories found in the matrix'
+        codes = numpy.unique(self.get_codes())
+        return numpy.sort(self.table.decode(codes))
+
+
+def is_categorical(matrix):
+    return isinstance(matrix, CategoricalMatrix)
+
@@ -0,0 +1,259 @@
+import os
+import bz2
+import json
+import lzma
+import zlib
+import shutil
+from tempfile import NamedTemporaryFile
+
+import numpy
+
+from variation.matrix.methods import rows_for_index
+
+# Missing docstring
+# pylint: disable=C0111
+
+MANIFEST_FNAME = '.array.json'
+# compress and decompress functions for every codec, the level is given
+# to compress
+CHUNK_CODECS = {'zlib': (lambda data, level: zlib.compress(data, level),
+                         zlib.decompress),
+                'bz2': (lambda data, level: bz2.compress(data, level),
+                        bz2.decompress),
+                'lzma': (lambda data, level: lzma.compress(data, preset=level),
+                         lzma.decompress),
+                None: (lambda data, level: data, bytes)}
+DEF_CHUNK_CODEC = 'zlib'
+DEF_CHUNK_LEVEL = 4
+
+
+def is_chunked_dir(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FNAME))
+
+
+def _fillvalue_to_json(fillvalue):
+    if isinstance(fillvalue, bytes):
+        return fillvalue.decode('latin1')
+    if isinstance(fillvalue, numpy.generic):
+        return fillvalue.item()
+    return fillvalue
+
+
+def _fillvalue_from_json(fillvalue, dtype):
+    if dtype.kind == 'S':
+        return fillvalue.encode('latin1')
+    return fillvalue
+
+
+def write_atomically(fpath, content, mode='wb'):
+    # The file is written aside and renamed, so a reader never sees a half
+    # written file and two writers never mix their contents
+    dir_path, fname = os.path.split(fpath)
+    fhand = NamedTemporaryFile(mode=mode, dir=dir_path, prefix='.' + fname,
+                               suffix='.tmp', delete=False)
+    try:
+        fhand.write(content)
+        fhand.close()
+        os.replace(fhand.name, fpath)
+    except Exception:
+        fhand.close()
+        os.remove(fhand.name)
+        raise
+
+
+def create_chunked_dir(path, shape, dtype, fillvalue, chunk_rows,
+                       codec=DEF_CHUNK_CODEC, level=DEF_CHUNK_LEVEL):
+    if codec not in CHUNK_CODECS:
+        raise ValueError('Unknown codec: ' + str(codec))
+    if os.path.exists(path):
+        raise ValueError('The array already exists: ' + path)
+    os.makedirs(path)
+    dtype = numpy.dtype(numpy.dtype(dtype).str)
+    manifest = {'shape': list(shape), 'dtype': dtype.str,
+                'chunk_rows': chunk_rows,
+                'fillvalue': _fillvalue_to_json(fillvalue),
+                'codec': codec, 'level': level}
+    write_atomically(os.path.join(path, MANIFEST_FNAME),
+                      json.dumps(manifest), mode='w')
+
+
+def _split_index(index):
+    if isinstance(index, tuple):
+        if not index:
+            return Ellipsis, ()
+        return index[0], index[1:]
+    return index, ()
+
+
+class ChunkedDirArray:
+    '''A matrix stored in a directory as compressed chunks of rows.
+
+    Every chunk is a file named after its number, the shape and dtype are
+    kept in a JSON manifest. The chunks that are not written are filled with
+    the fill value.
+    Writing disjoint chunks from different processes is safe, the chunks
+    are read in parallel if a pool is given.
+    '''
+    def __init__(self, path, pool=None, writable=True):
+        self.path = path
+        self.pool = pool
+        self.writable = writable
+        with open(os.path.join(path, MANIFEST_FNAME)) as fhand:
+            manifest = json.load(fhand)
+        self._shape = tuple(manifest['shape'])
+        self.dtype = numpy.dtype(manifest['dtype'])
+        self.chunk_rows = manifest['chunk_rows']
+        self.fillvalue = _fillvalue_from_json(manifest['fillvalue'],
+                                              self.dtype)
+        self.codec = manifest['codec']
+        self.level = manifest['level']
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self._shape))
+
+    @property
+    def num_chunks(self):
+        return -(-self._shape[0] // self.chunk_rows)
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def _write_manifest(self):
+        manifest = {'shape': list(self._shape), 'dtype': self.dtype.str,
+                    'chunk_rows': self.chunk_rows,
+                    'fillvalue': _fillvalue_to_json(self.fillvalue),
+                    'codec': self.codec, 'level': self.level}
+        write_atomically(os.path.join(self.path, MANIFEST_FNAME),
+                          json.dumps(manifest), mode='w')
+
+    def _check_writable(self):
+        if not self.writable:
+            raise ValueError('The array was opened in read mode')
+
+    def _chunk_fpath(self, chunk_idx):
+        return os.path.join(self.path, str(chunk_idx))
+
+    def _chunk_n_rows(self, chunk_idx):
+        start = chunk_idx * self.chunk_rows
+        return min(self.chunk_rows, self._shape[0] - start)
+
+    def _read_chunk(self, chunk_idx):
+        n_rows = self._chunk_n_rows(chunk_idx)
+        shape = (n_rows,) + self._shape[1:]
+        try:
+            with open(self._chunk_fpath(chunk_idx), 'rb') as fhand:
+                data = fhand.read()
+        except FileNotFoundError:
+            return numpy.full(shape, self.fillvalue, dtype=self.dtype)
+        data = CHUNK_CODECS[self.codec][1](data)
+        chunk = numpy.frombuffer(data, dtype=self.dtype)
+        chunk = chunk.reshape((-1,) + self._shape[1:])
+        # The chunk could have been written before the matrix grew
+        if chunk.shape[0] < n_rows:
+            padded = numpy.full(shape, self.fillvalue, dtype=self.dtype)
+            padded[:chunk.shape[0]] = chunk
+            chunk = padded
+        return chunk[:n_rows]
+
+    def _write_chunk(self, chunk_idx, chunk):
+        chunk = numpy.ascontiguousarray(chunk, dtype=self.dtype)
+        data = CHUNK_CODECS[self.codec][0](chunk.tobytes(), self.level)
+        write_atomically(self._chunk_fpath(chunk_idx), data)
+
+    def _map(self, funct, items):
+        items = list(items)
+        if self.pool is None or len(items) < 2:
+            return [funct(item) for item in items]
+        return self.pool.map(funct, items)
+
+    def read_chunks(self, chunk_idxs):
+        return self._map(self._read_chunk, chunk_idxs)
+
+    def __getitem__(self, index):
+        row_index, other_index = _split_index(index)
+        rows = rows_for_index(row_index, self._shape[0])
+        flat_rows = numpy.atleast_1d(rows)
+        if not flat_rows.size:
+            matrix = numpy.empty((0,) + self._shape[1:], dtype=self.dtype)
+        else:
+            chunk_of_rows = flat_rows // self.chunk_rows
+            chunk_idxs = numpy.unique(chunk_of_rows)
+            chunks = self.read_chunks(chunk_idxs)
+            matrix = numpy.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+            # Only the last chunk could be shorter, so the rows of every
+            # chunk start at a multiple of the chunk rows
+            rows_in_chunks = (numpy.searchsorted(chunk_idxs, chunk_of_rows) *
+                              self.chunk_rows +
+                              flat_rows % self.chunk_rows)
+            if numpy.all(numpy.diff(flat_rows) == 1):
+                first_row = rows_in_chunks[0]
+                matrix = matrix[first_row:first_row + flat_rows.shape[0]]
+            else:
+                matrix = matrix[rows_in_chunks]
+        if rows.ndim == 0:
+            matrix = matrix[0]
+        elif other_index:
+            other_index = (slice(None),) + other_index
+        if other_index:
+            matrix = matrix[other_index]
+        return matrix
+
+    def __setitem__(self, index, array):
+        self._check_writable()
+        index, other_index = _split_index(index)
+        if (not isinstance(index, slice) or index.step not in (None, 1) or
+                any(idx is not Ellipsis for idx in other_index)):
+            raise ValueError('Only slices of rows can be written')
+        start, stop, _ = index.indices(self._shape[0])
+        array = numpy.asarray(array)
+        if array.shape[0] != stop - start:
+            raise ValueError('The array does not fit in the rows')
+        first_chunk = start // self.chunk_rows
+        last_chunk = (stop - 1) // self.chunk_rows
+        self._map(lambda chunk_idx: self._write_rows_in_chunk(chunk_idx, start,
+                                                              stop, array),
+                  range(first_chunk, last_chunk + 1))
+
+    def _write_rows_in_chunk(self, chunk_idx, start, stop, array):
+        chunk_start = chunk_idx * self.chunk_rows
+        chunk_stop = chunk_start + self._chunk_n_rows(chunk_idx)
+        write_start, write_stop = max(start, chunk_start), min(stop,
+                                                               chunk_stop)
+        rows = array[write_start - start:write_stop - start]
+        if write_start > chunk_start or write_stop < chunk_stop:
+            chunk = self._read_chunk(chunk_idx).copy()
+            chunk[write_start - chunk_start:write_stop - chunk_start] = rows
+        else:
+            chunk = rows
+        self._write_chunk(chunk_idx, chunk)
+
+    def resize(self, n_rows):
+        self._check_writable()
+        old_num_chunks = self.num_chunks
+        self._shape = (n_rows,) + self._shape[1:]
+        for chunk_idx in range(self.num_chunks, old_num_chunks):
+            if os.path.exists(self._chunk_fpath(chunk_idx)):
+                os.remove(self._chunk_fpath(chunk_idx))
+        self._write_manifest()
+
+    def remove(self):
+        self._check_writable()
+        shutil.rmtree(self.path)
+
+    def __array__(self, dtype=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
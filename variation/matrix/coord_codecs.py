@@ -0,0 +1,252 @@
+import numpy
+
+from variation.matrix.methods import rows_for_index
+
+# Missing docstring
+# pylint: disable=C0111
+
+POS_BLOCK_SIZE = 4096
+# The columns of the table that describes the delta encoded blocks
+ROW_START, N_ROWS, FIRST_VALUE, BIT_WIDTH, BYTE_START = range(5)
+N_BLOCK_COLS = 5
+
+
+def encode_runs(values):
+    'It returns the end (exclusive) and the value of every run'
+    values = numpy.asarray(values)
+    if not values.shape[0]:
+        return numpy.array([], dtype=numpy.int64), values
+    run_ends = numpy.append(numpy.flatnonzero(values[1:] != values[:-1]) + 1,
+                            values.shape[0])
+    return run_ends.astype(numpy.int64), values[run_ends - 1]
+
+
+class RunLengthMatrix:
+    '''A 1D matrix stored as runs of equal values.
+
+    It is read as a numpy array, and the runs can be used to find the rows
+    for every value.
+    '''
+    def __init__(self, run_ends, run_values):
+        self.run_ends = run_ends
+        self.run_values = run_values
+
+    @property
+    def shape(self):
+        return (int(self.run_ends[-1]) if self.run_ends.shape[0] else 0,)
+
+    ndim = 1
+
+    @property
+    def dtype(self):
+        return self.run_values.dtype
+
+    @property
+    def run_starts(self):
+        return numpy.append(0, self.run_ends[:-1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        rows = rows_for_index(index, self.shape[0])
+        runs = numpy.searchsorted(self.run_ends, rows, side='right')
+        return self.run_values[runs]
+
+    def __array__(self, dtype=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def _compare(self, other):
+        if isinstance(other, (bytes, numpy.bytes_)):
+            run_lengths = numpy.diff(numpy.append(0, self.run_ends))
+            return numpy.repeat(self.run_values == other, run_lengths)
+        return numpy.asarray(self) == other
+
+    def __eq__(self, other):
+        return self._compare(other)
+
+    def __ne__(self, other):
+        return numpy.logical_not(self._compare(other))
+
+    __hash__ = None
+
+    def runs(self):
+        'It returns the value, start and end (exclusive) of every run'
+        return zip(self.run_values, self.run_starts, self.run_ends)
+
+
+def _n_bytes(n_rows, bit_width):
+    return -(-(max(n_rows - 1, 0) * bit_width) // 8)
+
+
+def _pack_deltas(deltas, bit_width):
+    # The lowest bit_width bits of every delta are kept
+    bits = numpy.unpackbits(deltas.astype('<u8').view(numpy.uint8),
+                            bitorder='little').reshape((deltas.shape[0], 64))
+    return numpy.packbits(bits[:, :bit_width].ravel(), bitorder='little')
+
+
+def _unpack_deltas(stream, n_deltas, bit_width):
+    bits = numpy.unpackbits(stream, count=n_deltas * bit_width,
+                            bitorder='little')
+    n_bytes = 4 if bit_width <= 32 else 8
+    padded = numpy.zeros((n_deltas, n_bytes * 8), dtype=numpy.uint8)
+    padded[:, :bit_width] = bits.reshape((n_deltas, bit_width))
+    deltas = numpy.packbits(padded, axis=1, bitorder='little')
+    return deltas.view('<u{}'.format(n_bytes)).ravel()
+
+
+def _calc_block_starts(values, block_size):
+    # A block is also started when the values decrease (e.g. a new chrom),
+    # so all the deltas in a block are positive
+    decreasing = numpy.flatnonzero(numpy.diff(values) < 0) + 1
+    starts = numpy.arange(0, values.shape[0], block_size)
+    return numpy.union1d(starts, decreasing)
+
+
+def encode_delta_blocks(values, block_size=POS_BLOCK_SIZE, row_start=0,
+                        byte_start=0):
+    '''It encodes the values as bit-packed deltas in blocks of rows.
+
+    It returns the byte stream and the table with the first row, number of
+    rows, first value, bits per delta and first byte of every block.
+    '''
+    values = numpy.asarray(values, dtype=numpy.int64)
+    block_starts = _calc_block_starts(values, block_size)
+    block_ends = numpy.append(block_starts[1:], values.shape[0])
+    streams, blocks = [], []
+    for start, end in zip(block_starts, block_ends):
+        deltas = numpy.diff(values[start:end])
+        bit_width = int(deltas.max()).bit_length() if deltas.shape[0] else 0
+        stream = _pack_deltas(deltas, bit_width)
+        blocks.append((row_start + start, end - start, values[start],
+                       bit_width, byte_start))
+        byte_start += stream.shape[0]
+        streams.append(stream)
+    if streams:
+        stream = numpy.concatenate(streams)
+    else:
+        stream = numpy.array([], dtype=numpy.uint8)
+    blocks = numpy.array(blocks, dtype=numpy.int64).reshape((-1, N_BLOCK_COLS))
+    return stream, blocks
+
+
+def _decode_block(stream, n_rows, first_value, bit_width):
+    values = numpy.empty(n_rows, dtype=numpy.int64)
+    values[0] = first_value
+    if bit_width:
+        numpy.cumsum(_unpack_deltas(stream, n_rows - 1, bit_width),
+                     out=values[1:])
+        values[1:] += first_value
+    else:
+        values[1:] = first_value
+    return values
+
+
+def decode_delta_block(stream, block):
+    'It decodes one block given the stream that starts at its first byte'
+    _, n_rows, first_value, bit_width, _ = block
+    stream = stream[:_n_bytes(n_rows, bit_width)]
+    return _decode_block(stream, n_rows, first_value, bit_width)
+
+
+class DeltaBlocksMatrix:
+    '''A 1D integer matrix stored as bit-packed deltas in blocks of rows.
+
+    Only the blocks that hold the requested rows are decoded.
+    '''
+    def __init__(self, stream, blocks, dtype):
+        self.stream = stream
+        self.blocks = blocks
+        self._dtype = numpy.dtype(dtype)
+        # the last decoded block, the bisections read it several times
+        self._cached_block = None, None
+
+    @property
+    def shape(self):
+        if not self.blocks.shape[0]:
+            return (0,)
+        return (int(self.blocks[-1, ROW_START] + self.blocks[-1, N_ROWS]),)
+
+    ndim = 1
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def _decode_blocks(self, first_block, last_block):
+        if first_block == last_block:
+            cached_block, values = self._cached_block
+            if cached_block == first_block:
+                return values
+        values = self._decode_block_range(first_block, last_block)
+        if first_block == last_block:
+            self._cached_block = first_block, values
+        return values
+
+    def _decode_block_range(self, first_block, last_block):
+        blocks = self.blocks[first_block:last_block + 1]
+        stream_start = blocks[0, BYTE_START]
+        stream_end = blocks[-1, BYTE_START] + _n_bytes(blocks[-1, N_ROWS],
+                                                       blocks[-1, BIT_WIDTH])
+        stream = self.stream[stream_start:stream_end]
+        values = []
+        for _, n_rows, first_value, bit_width, byte_start in blocks:
+            byte_start -= stream_start
+            byte_end = byte_start + _n_bytes(n_rows, bit_width)
+            values.append(_decode_block(stream[byte_start:byte_end], n_rows,
+                                        first_value, bit_width))
+        return numpy.concatenate(values)
+
+    def _block_for_row(self, row):
+        return numpy.searchsorted(self.blocks[:, ROW_START], row,
+                                  side='right') - 1
+
+    def __getitem__(self, index):
+        rows = rows_for_index(index, self.shape[0])
+        if not rows.size:
+            return numpy.array([], dtype=self.dtype)
+        first_block = self._block_for_row(rows.min())
+        last_block = self._block_for_row(rows.max())
+        values = self._decode_blocks(first_block, last_block)
+        values = values[rows - self.blocks[first_block, ROW_START]]
+        return values.astype(self.dtype)
+
+    def __array__(self, dtype=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def bisect_left(self, value, lo=0, hi=None):
+        '''It returns the insertion row for the value in the sorted rows lo:hi.
+
+        The first values of the blocks are used to find the block, so only
+        one block is decoded.
+        '''
+        if hi is None:
+            hi = self.shape[0]
+        if lo >= hi:
+            return lo
+        first_block = self._block_for_row(lo)
+        last_block = self._block_for_row(hi - 1)
+        first_values = self.blocks[first_block + 1:last_block + 1, FIRST_VALUE]
+        block = first_block + int(numpy.searchsorted(first_values, value))
+        block_start = self.blocks[block, ROW_START]
+        values = self._decode_blocks(block, block)
+        start = max(lo, block_start) - block_start
+        stop = min(hi, block_start + values.shape[0]) - block_start
+        return int(block_start + start +
+                   numpy.searchsorted(values[start:stop], value))
@@ -0,0 +1,277 @@
+import struct
+import zlib
+from itertools import product
+
+import numpy
+import h5py
+
+# Missing docstring
+# pylint: disable=C0111
+
+# These are the filters applied by DEF_DSET_PARAMS, any other filter
+# (e.g. lzf or scaleoffset) is left to h5py
+SUPPORTED_FILTERS = (h5py.h5z.FILTER_SHUFFLE, h5py.h5z.FILTER_DEFLATE,
+                     h5py.h5z.FILTER_FLETCHER32)
+FLETCHER32_SIZE = 4
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def fletcher32(buf):
+    # HDF5 flavour of fletcher32: big-endian 16 bit words, the sums are kept
+    # modulo 65535 but a non-zero sum is never reported as 0
+    if len(buf) % 2:
+        buf = bytes(buf) + b'\0'
+    words = numpy.frombuffer(buf, dtype='>u2').astype(numpy.uint64)
+    n_words = words.shape[0]
+    weights = numpy.arange(n_words, 0, -1, dtype=numpy.uint64) % 65535
+    mod1 = int(words.sum()) % 65535
+    mod2 = int((weights * words % 65535).sum()) % 65535
+    # Both sums are non-zero if any word is, the reduced weights can not
+    # tell it
+    if numpy.any(words):
+        mod1 = mod1 or 65535
+        mod2 = mod2 or 65535
+    return (mod2 << 16) | mod1
+
+
+def _swap_fletcher32_halves(checksum):
+    # HDF5 < 1.6.3 stored the checksum with the bytes of each half swapped
+    bytes_ = struct.pack('<I', checksum)
+    return struct.unpack('<I', bytes_[1::-1] + bytes_[:1:-1])[0]
+
+
+def get_dset_filters(dset):
+    plist = dset.id.get_create_plist()
+    filters = []
+    for idx in range(plist.get_nfilters()):
+        filter_id, _, cd_values, _ = plist.get_filter(idx)
+        filters.append((filter_id, cd_values))
+    return filters
+
+
+def supports_direct_chunk_io(dset):
+    if not hasattr(dset.id, 'read_direct_chunk'):
+        return False
+    if dset.chunks is None or dset.dtype.hasobject:
+        return False
+    if h5py.check_dtype(vlen=dset.dtype) is not None:
+        return False
+    filters = get_dset_filters(dset)
+    return all(filter_id in SUPPORTED_FILTERS for filter_id, _ in filters)
+
+
+def _unshuffle(buf, itemsize):
+    array = numpy.frombuffer(buf, dtype=numpy.uint8)
+    if itemsize == 1:
+        return array
+    n_items = array.shape[0] // itemsize
+    shuffled_len = n_items * itemsize
+    unshuffled = numpy.empty_like(array)
+    unshuffled[:shuffled_len] = array[:shuffled_len].reshape((itemsize,
+                                                              n_items)).T.ravel()
+    # the bytes that do not fill a whole item are not shuffled by HDF5
+    unshuffled[shuffled_len:] = array[shuffled_len:]
+    return unshuffled
+
+
+def _shuffle(buf, itemsize):
+    array = numpy.frombuffer(buf, dtype=numpy.uint8)
+    if itemsize == 1:
+        return array
+    n_items = array.shape[0] // itemsize
+    shuffled_len = n_items * itemsize
+    shuffled = numpy.empty_like(array)
+    shuffled[:shuffled_len] = array[:shuffled_len].reshape((n_items,
+                                                            itemsize)).T.ravel()
+    shuffled[shuffled_len:] = array[shuffled_len:]
+    return shuffled
+
+
+def encode_chunk(chunk, filters):
+    buf = numpy.ascontiguousarray(chunk).tobytes()
+    itemsize = chunk.dtype.itemsize
+    for filter_id, cd_values in filters:
+        if filter_id == h5py.h5z.FILTER_SHUFFLE:
+            buf = _shuffle(buf, itemsize).tobytes()
+        elif filter_id == h5py.h5z.FILTER_DEFLATE:
+            level = cd_values[0] if cd_values else zlib.Z_DEFAULT_COMPRESSION
+            buf = zlib.compress(buf, level)
+        elif filter_id == h5py.h5z.FILTER_FLETCHER32:
+            buf += struct.pack('<I', fletcher32(buf))
+        else:
+            msg = 'HDF5 filter not supported for direct writes: '
+            raise ValueError(msg + str(filter_id))
+    return buf
+
+
+def decode_chunk(raw_chunk, filter_mask, filters, dtype, chunk_shape):
+    buf = raw_chunk
+    # The filters are undone in reverse order
+    for filter_idx in reversed(range(len(filters))):
+        if filter_mask & (1 << filter_idx):
+            # This filter was skipped for this chunk
+            continue
+        filter_id = filters[filter_idx][0]
+        if filter_id == h5py.h5z.FILTER_FLETCHER32:
+            stored = struct.unpack('<I', buf[-FLETCHER32_SIZE:])[0]
+            buf = buf[:-FLETCHER32_SIZE]
+            checksum = fletcher32(buf)
+            if (stored != checksum and
+                    stored != _swap_fletcher32_halves(checksum)):
+                raise ChecksumError('fletcher32 checksum failed for chunk')
+        elif filter_id == h5py.h5z.FILTER_DEFLATE:
+            buf = zlib.decompress(buf)
+        elif filter_id == h5py.h5z.FILTER_SHUFFLE:
+            buf = _unshuffle(buf, dtype.itemsize)
+        else:
+            msg = 'HDF5 filter not supported for direct reads: '
+            raise ValueError(msg + str(filter_id))
+    return numpy.frombuffer(buf, dtype=dtype).reshape(chunk_shape)
+
+
+def _iter_chunk_offsets(dset, start, stop):
+    chunks = dset.chunks
+    first_row = (start // chunks[0]) * chunks[0]
+    ranges = [range(first_row, stop, chunks[0])]
+    for dim_len, chunk_len in zip(dset.shape[1:], chunks[1:]):
+        ranges.append(range(0, dim_len, chunk_len))
+    return product(*ranges)
+
+
+def _read_chunk_with_h5py(dset, offset):
+    chunk_slice = tuple(slice(dim_offset, dim_offset + chunk_len)
+                        for dim_offset, chunk_len in zip(offset, dset.chunks))
+    return dset[chunk_slice]
+
+
+def _read_raw_chunk(dset, offset):
+    if not hasattr(dset.id, 'get_chunk_info_by_coord'):
+        # The old h5py versions can not tell the chunks with no storage
+        # allocated, so HDF5 reads and decodes those chunks
+        return _read_chunk_with_h5py(dset, offset)
+    # A chunk with no storage allocated only has fillvalues
+    if dset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+        return None
+    return dset.id.read_direct_chunk(offset)
+
+
+def _decode_raw_chunk(args):
+    raw, filters, dtype, chunk_shape = args
+    if raw is None or isinstance(raw, numpy.ndarray):
+        return raw
+    filter_mask, raw_chunk = raw
+    return decode_chunk(raw_chunk, filter_mask, filters, dtype, chunk_shape)
+
+
+def read_rows_direct(dset, start, stop, pool=None, out=None):
+    '''It reads the rows [start, stop) decompressing the chunks by itself.
+
+    The raw chunks are read by HDF5, but the decompression is done in the
+    given pool (if any), zlib releases the GIL, so a ThreadPool is enough.
+    The rows are written in out if it is given.
+    '''
+    dtype = dset.dtype
+    shape = (stop - start,) + dset.shape[1:]
+    chunk_shape = dset.chunks
+    if out is None:
+        out = numpy.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('The rows do not fit in the out array')
+    if stop <= start:
+        return out
+    filters = get_dset_filters(dset)
+
+    offsets = list(_iter_chunk_offsets(dset, start, stop))
+    decode_args = [(_read_raw_chunk(dset, offset), filters, dtype,
+                    chunk_shape) for offset in offsets]
+    if pool is None:
+        chunks = map(_decode_raw_chunk, decode_args)
+    else:
+        chunks = pool.imap(_decode_raw_chunk, decode_args)
+
+    array = out
+    for offset, chunk in zip(offsets, chunks):
+        slice_in_array = [slice(max(offset[0], start) - start,
+                                min(offset[0] + chunk_shape[0], stop) - start)]
+        slice_in_chunk = [slice(max(offset[0], start) - offset[0],
+                                min(offset[0] + chunk_shape[0],
+                                    stop) - offset[0])]
+        for dim_offset, dim_len, chunk_len in zip(offset[1:], dset.shape[1:],
+                                                  chunk_shape[1:]):
+            dim_stop = min(dim_offset + chunk_len, dim_len)
+            slice_in_array.append(slice(dim_offset, dim_stop))
+            slice_in_chunk.append(slice(0, dim_stop - dim_offset))
+        slice_in_array = tuple(slice_in_array)
+        if chunk is None:
+            array[slice_in_array] = dset.fillvalue
+        else:
+            array[slice_in_array] = chunk[tuple(slice_in_chunk)]
+    return array
+
+
+def _encode_chunk(args):
+    offset, chunk, filters = args
+    return offset, encode_chunk(chunk, filters)
+
+
+def _iter_full_chunks(dset, array, start, first_row, last_row):
+    chunk_shape = dset.chunks
+    for offset in _iter_chunk_offsets(dset, first_row, last_row):
+        rows_in_array = slice(offset[0] - start,
+                              offset[0] + chunk_shape[0] - start)
+        slice_in_array = [rows_in_array]
+        slice_in_chunk = [slice(None)]
+        for dim_offset, dim_len, chunk_len in zip(offset[1:], dset.shape[1:],
+                                                  chunk_shape[1:]):
+            dim_stop = min(dim_offset + chunk_len, dim_len)
+            slice_in_array.append(slice(dim_offset, dim_stop))
+            slice_in_chunk.append(slice(0, dim_stop - dim_offset))
+        slice_in_array = tuple(slice_in_array)
+        if slice_in_chunk[1:] == [slice(0, chunk_len)
+                                  for chunk_len in chunk_shape[1:]]:
+            chunk = array[slice_in_array]
+        else:
+            # HDF5 stores the edge chunks padded to the whole chunk shape
+            chunk = numpy.full(chunk_shape, dset.fillvalue, dtype=dset.dtype)
+            chunk[tuple(slice_in_chunk)] = array[slice_in_array]
+        yield offset, chunk
+
+
+def write_rows_direct(dset, start, array, pool=None):
+    '''It writes array into the rows starting at start compressing by itself.
+
+    The chunks completely covered by the array are compressed in the given
+    pool (if any) and written in order with direct chunk writes, the rows
+    that only fill part of a chunk are left to h5py.
+    The pool can be a ThreadPool, because zlib releases the GIL, or a
+    process Pool.
+    '''
+    stop = start + array.shape[0]
+    if stop > dset.shape[0]:
+        raise ValueError('The dataset is not big enough for the array')
+    array = numpy.asarray(array, dtype=dset.dtype)
+    chunk_rows = dset.chunks[0]
+    first_full_row = -(-start // chunk_rows) * chunk_rows
+    last_full_row = (stop // chunk_rows) * chunk_rows
+    if first_full_row >= last_full_row:
+        dset[start:stop, ...] = array
+        return
+
+    if start < first_full_row:
+        dset[start:first_full_row, ...] = array[:first_full_row - start]
+    if last_full_row < stop:
+        dset[last_full_row:stop, ...] = array[last_full_row - start:]
+
+    filters = get_dset_filters(dset)
+    chunks = _iter_full_chunks(dset, array, start, first_full_row,
+                               last_full_row)
+    encode_args = ((offset, chunk, filters) for offset, chunk in chunks)
+    if pool is None:
+        encoded_chunks = map(_encode_chunk, encode_args)
+    else:
+        encoded_chunks = pool.imap(_encode_chunk, encode_args)
+    for offset, encoded_chunk in encoded_chunks:
+        dset.id.write_direct_chunk(offset, encoded_chunk)
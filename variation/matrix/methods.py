@@ -128,6 +128,23 @@ def num_variations(matrix):
     return matrix.shape[0]
 
 
+def rows_for_index(index, n_rows):
+    'It returns the row numbers selected by an index along the first axis'
+    if isinstance(index, tuple):
+        if any(idx is not Ellipsis for idx in index[1:]):
+            raise IndexError('Only the rows can be indexed')
+        index = index[0] if index else Ellipsis
+    if index is Ellipsis:
+        index = slice(None)
+    if isinstance(index, (int, numpy.integer)):
+        if index < -n_rows or index >= n_rows:
+            raise IndexError('index out of range: ' + str(index))
+        return numpy.int64(index % n_rows)
+    if isinstance(index, slice):
+        return numpy.arange(*index.indices(n_rows))
+    return numpy.arange(n_rows)[index]
+
+
 def iterate_matrix_chunks(matrix, chunk_size=SNPS_PER_CHUNK, sample_idx=None):
     nsnps = num_variations(matrix)
     for start in range(0, nsnps, chunk_size):
@@ -288,7 +305,7 @@ def _reshape_filling_dset(dset, new_shape=None, dtype=None):
 
     try:
         dset.resize(new_shape)
-    except (TypeError, ValueError):
+    except (TypeError, ValueError, RuntimeError):
         dset = _copy_dset(dset, shape=new_shape, dtype=new_dtype)
     return dset
 
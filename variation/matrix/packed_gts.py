@@ -0,0 +1,168 @@
+import numpy
+
+from variation import MISSING_INT
+from variation.matrix.methods import is_dataset
+
+# Missing docstring
+# pylint: disable=C0111
+
+# Every call is stored in 2 bits, the code is the number of alt alleles
+HOM_REF, HET, HOM_ALT, MISSING_CODE = 0, 1, 2, 3
+CALLS_PER_BYTE = 4
+
+# the code for every call in every byte
+_BYTE_CODES = ((numpy.arange(256)[:, None] >> numpy.array([0, 2, 4, 6])) &
+               3).astype(numpy.uint8)
+# number of calls with every code in every byte
+_CODE_COUNTS_LUT = numpy.array([(_BYTE_CODES == code).sum(axis=1)
+                                for code in range(4)], dtype=numpy.uint8)
+# for every byte, if every one of its calls has every code
+_CALL_CODES_LUT = (_BYTE_CODES[:, :, None] ==
+                   numpy.arange(4)[None, None, :]).astype(int)
+_POPCOUNT_LUT = numpy.array([bin(byte).count('1') for byte in range(256)],
+                            dtype=numpy.uint8)
+_CODE_TO_GT = numpy.array([[0, 0], [0, 1], [1, 1],
+                           [MISSING_INT, MISSING_INT]], dtype=numpy.int8)
+
+
+def _gts_to_codes(gts):
+    if is_dataset(gts):
+        gts = gts[:]
+    if gts.ndim != 3 or gts.shape[2] != 2:
+        raise ValueError('Only diploid genotypes can be packed')
+    if numpy.any(gts > 1) or numpy.any(gts < MISSING_INT):
+        raise ValueError('Only biallelic genotypes can be packed')
+    codes = gts.sum(axis=2, dtype=numpy.uint8)
+    codes[numpy.any(gts == MISSING_INT, axis=2)] = MISSING_CODE
+    return codes
+
+
+class PackedGTs:
+    '''Biallelic diploid genotypes with 2 bits per call.
+
+    The calls of 4 samples are stored in every byte, the padding calls at
+    the end of every row are missing.
+    As in calc_missing_gt, a call with any missing allele is missing and
+    the phase of the hets is lost.
+    '''
+    def __init__(self, packed, n_samples):
+        self.packed = packed
+        self.n_samples = n_samples
+
+    @classmethod
+    def from_gts(cls, gts):
+        codes = _gts_to_codes(gts)
+        n_snps, n_samples = codes.shape
+        n_bytes = -(-n_samples // CALLS_PER_BYTE)
+        padded = numpy.full((n_snps, n_bytes * CALLS_PER_BYTE), MISSING_CODE,
+                            dtype=numpy.uint8)
+        padded[:, :n_samples] = codes
+        padded = padded.reshape((n_snps, n_bytes, CALLS_PER_BYTE))
+        packed = (padded[:, :, 0] | (padded[:, :, 1] << 2) |
+                  (padded[:, :, 2] << 4) | (padded[:, :, 3] << 6))
+        return cls(packed, n_samples)
+
+    @property
+    def shape(self):
+        return (self.packed.shape[0], self.n_samples, 2)
+
+    @property
+    def num_variations(self):
+        return self.packed.shape[0]
+
+    def __getitem__(self, index):
+        return self.__class__(self.packed[index, ...], self.n_samples)
+
+    @property
+    def codes(self):
+        codes = _BYTE_CODES[self.packed]
+        codes = codes.reshape((self.packed.shape[0],
+                               self.packed.shape[1] * CALLS_PER_BYTE))
+        return codes[:, :self.n_samples]
+
+    def unpack(self):
+        return _CODE_TO_GT[self.codes]
+
+    def count_gt_types(self, axis=1):
+        '''It counts the hom ref, het, hom alt and missing calls.
+
+        It returns a (n_snps, 4) matrix for axis=1, and (n_samples, 4) for
+        axis=0.
+        '''
+        if axis == 1:
+            counts = numpy.column_stack([lut[self.packed].sum(axis=1,
+                                                              dtype=int)
+                                         for lut in _CODE_COUNTS_LUT])
+            n_padding = self.packed.shape[1] * CALLS_PER_BYTE - self.n_samples
+            counts[:, MISSING_CODE] -= n_padding
+        elif axis == 0:
+            # The bytes of every column are counted and the codes of every
+            # call are taken from the counts of the byte values
+            n_bytes = self.packed.shape[1]
+            byte_ids = (self.packed.astype(numpy.intp) +
+                        256 * numpy.arange(n_bytes, dtype=numpy.intp))
+            byte_counts = numpy.bincount(byte_ids.ravel(),
+                                         minlength=256 * n_bytes)
+            byte_counts = byte_counts.reshape((n_bytes, 256))
+            counts = numpy.tensordot(byte_counts, _CALL_CODES_LUT, axes=1)
+            counts = counts.reshape((n_bytes * CALLS_PER_BYTE, 4))
+            counts = counts[:self.n_samples]
+        else:
+            raise ValueError('axis should be 0 or 1')
+        return counts
+
+    def count_alleles(self):
+        'It returns the ref and alt allele counts by row'
+        counts = self.count_gt_types(axis=1)
+        ref_counts = 2 * counts[:, HOM_REF] + counts[:, HET]
+        alt_counts = 2 * counts[:, HOM_ALT] + counts[:, HET]
+        return numpy.column_stack([ref_counts, alt_counts])
+
+    def as_mat012(self):
+        '''It returns 0 (major allele hom), 1 (het), 2 (other hom).
+
+        Like gts_as_mat012, the major allele is the ref one in the ties.
+        '''
+        allele_counts = self.count_alleles()
+        alt_is_major = allele_counts[:, 1] > allele_counts[:, 0]
+        codes = self.codes
+        gts012 = codes.astype(numpy.int8)
+        gts012[alt_is_major] = 2 - gts012[alt_is_major]
+        gts012[codes == MISSING_CODE] = MISSING_INT
+        return gts012
+
+    def _bit_planes(self):
+        # For every sample a bit per snp (packed) for hom ref, het, hom alt
+        # and called
+        codes = self.codes.T
+        planes = [numpy.packbits(codes == code, axis=1)
+                  for code in (HOM_REF, HET, HOM_ALT)]
+        planes.append(numpy.packbits(codes != MISSING_CODE, axis=1))
+        return planes
+
+    def calc_pairwise_ibs(self):
+        '''It counts the alleles identical by state for every pair of samples.
+
+        It returns, in condensed form (as scipy pdist), the number of shared
+        alleles and the number of snps called in both samples.
+        '''
+        hom_ref, het, hom_alt, called = self._bit_planes()
+
+        def _popcount(bits):
+            return _POPCOUNT_LUT[bits].sum(axis=1, dtype=int)
+
+        ibs_counts, n_snps = [], []
+        for idx in range(self.n_samples - 1):
+            others = slice(idx + 1, None)
+            ibs2 = (_popcount(hom_ref[others] & hom_ref[idx]) +
+                    _popcount(het[others] & het[idx]) +
+                    _popcount(hom_alt[others] & hom_alt[idx]))
+            ibs0 = (_popcount(hom_ref[others] & hom_alt[idx]) +
+                    _popcount(hom_alt[others] & hom_ref[idx]))
+            called_in_both = _popcount(called[others] & called[idx])
+            ibs1 = called_in_both - ibs2 - ibs0
+            ibs_counts.append(2 * ibs2 + ibs1)
+            n_snps.append(called_in_both)
+        if not ibs_counts:
+            return numpy.array([], dtype=int), numpy.array([], dtype=int)
+        return numpy.concatenate(ibs_counts), numpy.concatenate(n_snps)
@@ -0,0 +1,163 @@
+import numpy
+
+from variation.matrix.methods import rows_for_index
+
+# Missing docstring
+# pylint: disable=C0111
+
+
+def _is_missing(matrix, missing_value):
+    if isinstance(missing_value, float) and numpy.isnan(missing_value):
+        return numpy.isnan(matrix)
+    return matrix == missing_value
+
+
+def _bytes_as_chars(matrix):
+    # Every string becomes a row of bytes, the padding bytes are 0
+    matrix = numpy.ascontiguousarray(matrix)
+    return matrix.view(numpy.uint8).reshape((matrix.shape[0],
+                                             matrix.dtype.itemsize))
+
+
+def encode_ragged(matrix, missing_value):
+    '''It returns the flat values and the length of every row.
+
+    The rows are ragged along the last axis (along the characters for 1D byte
+    strings) and every row ends with its last non missing item.
+    The values matrix has the items of all rows along its first axis.
+    '''
+    matrix = numpy.asarray(matrix)
+    if matrix.dtype.kind == 'S' and matrix.ndim == 1:
+        matrix = _bytes_as_chars(matrix)
+        missing_value = 0
+    if matrix.ndim < 2:
+        raise ValueError('Only matrices with 2 or more dimensions are ragged')
+    present = numpy.logical_not(_is_missing(matrix, missing_value))
+    if present.ndim > 2:
+        present = present.any(axis=tuple(range(1, present.ndim - 1)))
+    width = matrix.shape[-1]
+    lengths = width - numpy.argmax(present[:, ::-1], axis=1)
+    lengths[numpy.logical_not(present.any(axis=1))] = 0
+    in_row = numpy.arange(width) < lengths[:, None]
+    values = numpy.moveaxis(matrix, -1, 1)[in_row]
+    return values, lengths.astype(numpy.int64)
+
+
+def pad_ragged(values, lengths, width, missing_value, as_bytes=False):
+    'It returns the rows padded with the missing value up to the width'
+    if as_bytes:
+        width = max(width, 1)
+        missing_value = 0
+    if lengths.shape[0] and lengths.max() > width:
+        raise ValueError('There are rows longer than the width')
+    in_row = numpy.arange(width) < lengths[:, None]
+    padded = numpy.full((lengths.shape[0], width) + values.shape[1:],
+                        missing_value, dtype=values.dtype)
+    padded[in_row] = values
+    padded = numpy.ascontiguousarray(numpy.moveaxis(padded, 1, -1))
+    if as_bytes:
+        padded = padded.view('S{}'.format(width)).reshape(lengths.shape)
+    return padded
+
+
+def _item_indexes(starts, lengths):
+    # The indexes of the items of every row, one after the other
+    firsts = numpy.cumsum(lengths) - lengths
+    return (numpy.arange(lengths.sum(), dtype=numpy.int64) +
+            numpy.repeat(starts - firsts, lengths))
+
+
+def _split_index(index):
+    if isinstance(index, tuple):
+        return index[:1], index[1:]
+    return (index,), ()
+
+
+class RaggedMatrix:
+    '''A matrix stored as the flat items of every row and the row offsets.
+
+    It is read as a numpy array padded with the missing value to the width
+    of the longest row.
+    '''
+    def __init__(self, values, offsets, width, missing_value,
+                 as_bytes=False):
+        self.values = values
+        self.offsets = offsets
+        self.width = width
+        self.missing_value = missing_value
+        self.as_bytes = as_bytes
+
+    @property
+    def shape(self):
+        n_rows = self.offsets.shape[0] - 1
+        if self.as_bytes:
+            return (n_rows,)
+        return (n_rows,) + self.values.shape[1:] + (self.width,)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    @property
+    def dtype(self):
+        if self.as_bytes:
+            return numpy.dtype('S{}'.format(max(self.width, 1)))
+        return self.values.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def lengths(self, index=Ellipsis):
+        rows = rows_for_index(index, self.shape[0])
+        return self.offsets[rows + 1] - self.offsets[rows]
+
+    def get_items(self, index=Ellipsis):
+        'It returns the flat items and the lengths of the rows'
+        rows = numpy.atleast_1d(rows_for_index(index, self.shape[0]))
+        if not rows.size:
+            return self.values[0:0], numpy.array([], dtype=numpy.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        # The span with all the rows is read at once
+        span_start = self.offsets[rows.min()]
+        span = self.values[span_start:self.offsets[rows.max() + 1]]
+        if numpy.any(numpy.diff(rows) != 1):
+            span = span[_item_indexes(starts - span_start, lengths)]
+        return span, lengths
+
+    def padded(self, index=Ellipsis, width=None):
+        '''It returns the rows padded up to the width.
+
+        By default the width of the longest row in the matrix.
+        '''
+        row_index, other_index = _split_index(index)
+        row_index = row_index[0] if row_index else Ellipsis
+        rows = rows_for_index(row_index, self.shape[0])
+        items, lengths = self.get_items(rows)
+        if width is None:
+            width = self.width
+        padded = pad_ragged(items, lengths, width, self.missing_value,
+                            as_bytes=self.as_bytes)
+        if rows.ndim == 0:
+            padded = padded[0]
+        elif other_index:
+            other_index = (slice(None),) + other_index
+        if other_index:
+            padded = padded[other_index]
+        return padded
+
+    def __getitem__(self, index):
+        return self.padded(index)
+
+    def __array__(self, dtype=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
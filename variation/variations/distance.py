@@ -710,7 +710,44 @@ def _calc_pop_pairwise_unbiased_nei_dists(variations, populations=None,
     return dists
 
 
+def _calc_ibs_pairwise_distance(variations, chunk_size=None,
+                                min_num_snps=None):
+    '''It calculates 1 - the rate of alleles identical by state.
+
+    The 2 bit packed genotypes are used, so only biallelic diploid
+    genotypes are supported. For those it is equal to the Kosman distance.
+    '''
+    if chunk_size:
+        packed_chunks = variations.iterate_packed_gts(chunk_size=chunk_size)
+    else:
+        packed_chunks = [variations.packed_gts]
+
+    ibs_counts, n_snps = None, None
+    for packed_gts in packed_chunks:
+        chunk_ibs_counts, chunk_n_snps = packed_gts.calc_pairwise_ibs()
+        if ibs_counts is None:
+            ibs_counts, n_snps = chunk_ibs_counts, chunk_n_snps
+        else:
+            ibs_counts = ibs_counts + chunk_ibs_counts
+            n_snps = n_snps + chunk_n_snps
+
+    if ibs_counts is None:
+        # There are no snps, no pair of samples can be compared
+        n_samples = variations[GT_FIELD].shape[1]
+        n_pairs = n_samples * (n_samples - 1) // 2
+        ibs_counts = numpy.zeros(n_pairs, dtype=int)
+        n_snps = numpy.zeros(n_pairs, dtype=int)
+
+    n_snps = n_snps.astype(float)
+    if min_num_snps is not None:
+        n_snps[n_snps < min_num_snps] = numpy.nan
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        distance = 1 - ibs_counts / (2 * n_snps)
+    return distance
+
+
 DISTANCES = {'kosman': _calc_kosman_pairwise_distance,
+             'ibs': _calc_ibs_pairwise_distance,
              'matching': _calc_matching_pairwise_distance,
              'nei': _calc_nei_pop_distance,
              'nei_unbiased': _calc_pop_pairwise_unbiased_nei_dists,
@@ -11,15 +11,21 @@ from variation.variations.stats import (calc_maf, calc_obs_het, GT_FIELD,
                                         MIN_NUM_GENOTYPES_FOR_POP_STAT,
                                         calc_mac, calc_snp_density,
                                         histogram, DEF_NUM_BINS,
+                                        HistogramSketch,
                                         call_is_het,
-                                        calc_allele_observation_based_maf)
-from variation.variations.vars_matrices import VariationsArrays
+                                        calc_allele_observation_based_maf,
+                                        _get_allele_counts)
+from variation.variations.vars_matrices import (VariationsArrays, VariationsH5,
+                                                concat_chunks)
 from variation import (MISSING_INT, SNPS_PER_CHUNK, MISSING_FLOAT, ALT_FIELD,
-                       CHROM_FIELD, POS_FIELD, MISSING_BYTE, REF_FIELD)
+                       CHROM_FIELD, POS_FIELD, MISSING_BYTE, REF_FIELD,
+                       QUAL_FIELD)
 from variation.matrix.methods import is_dataset
+from variation.matrix.categorical import is_categorical
 from variation.iterutils import first, group_in_packets
 from variation.matrix.stats import (row_value_counter_fact,
                                     counts_and_allels_by_row)
+from variation.variations.fingerprint import calc_chunk_fingerprints
 
 COUNTS = 'counts'
 EDGES = 'edges'
@@ -30,12 +36,22 @@ TOT = 'tot'
 FLT_STATS = 'flt_stats'
 SELECTED_VARS = 'selected_vars'
 DISCARDED_VARS = 'discarded_vars'
+# The pipeline asks for a mergeable sketch instead of the histogram when
+# the range is not known
+HIST_SKETCH = 'hist_sketch'
 
+# How the variations with the same chrom, position and alleles are collapsed
+KEEP_FIRST = 'first'
+KEEP_BEST_QUAL = 'best_qual'
+COMBINE_CALLS = 'combine'
+DUPLICATED_SITE_POLICIES = (KEEP_FIRST, KEEP_BEST_QUAL, COMBINE_CALLS)
 
-def _filter_no_row(chunk):
-    n_snps = chunk.num_variations
-    selector = numpy.ones((n_snps,), dtype=numpy.bool_)
-    return selector
+
+def _calc_histogram_result(vector, n_bins, range_, sketch_histogram):
+    if sketch_histogram and range_ is None:
+        return {HIST_SKETCH: HistogramSketch(vector)}
+    counts, edges = histogram(vector, n_bins=n_bins, range_=range_)
+    return {COUNTS: counts, EDGES: edges}
 
 
 class _BaseFilter:
@@ -63,6 +79,7 @@ class _BaseFilter:
 
         self.n_bins = n_bins
         self.range = range_
+        self.sketch_histogram = False
         self._samples = samples
         self._filter_samples = None
 
@@ -81,7 +98,8 @@ class _BaseFilter:
         elif selector_max is not None and selector_min is not None:
             selected_rows = selector_min & selector_max
         else:
-            selected_rows = _filter_no_row(variations)
+            # the stat could be the one of some of the variations
+            selected_rows = numpy.ones((stat.shape[0],), dtype=numpy.bool_)
 
         if self._keep_nan:
             selected_rows = numpy.logical_or(selected_rows, numpy.isnan(stat))
@@ -120,29 +138,35 @@ class _BaseFilter:
         vars_for_stat = self._filter_samples_for_stats(variations)
         return self._calc_stat(vars_for_stat)
 
-    def __call__(self, variations):
-        if variations.num_variations == 0:
-            raise ValueError('No SNPs to filter')
-        stats = self._calc_stat_for_filtered_samples(variations)
-        if stats is None:
-            return {}
+    def _select_by_stats(self, variations, stats):
         result = {}
         if self.do_histogram:
-            counts, edges = histogram(stats, n_bins=self.n_bins,
-                                      range_=self.range)
-            result[COUNTS] = counts
-            result[EDGES] = edges
+            result.update(_calc_histogram_result(stats, self.n_bins,
+                                                 self.range,
+                                                 self.sketch_histogram))
 
+        selected_rows = None
         if self.report_selection or self.do_filtering:
             selected_rows, flt_stats = self._select_rows(variations, stats)
 
         if self.report_selection:
             result[SELECTED_VARS] = selected_rows
 
+        if self.do_filtering:
+            result[FLT_STATS] = flt_stats
+        return result, selected_rows
+
+    def __call__(self, variations):
+        if variations.num_variations == 0:
+            raise ValueError('No SNPs to filter')
+        stats = self._calc_stat_for_filtered_samples(variations)
+        if stats is None:
+            return {}
+        result, selected_rows = self._select_by_stats(variations, stats)
+
         if self.do_filtering:
             flt_vars = variations.get_chunk(selected_rows)
             result[FLT_VARS] = flt_vars
-            result[FLT_STATS] = flt_stats
 
             if self.return_discarded:
                 discarded_rows = numpy.logical_not(selected_rows)
@@ -151,6 +175,30 @@ class _BaseFilter:
 
         return result
 
+    @property
+    def can_filter_mask(self):
+        # The filters with their own __call__ could not compute a stat by row
+        return (type(self).__call__ is _BaseFilter.__call__ and
+                not self.return_discarded)
+
+    def filter_mask(self, variations, mask):
+        '''It filters the variations in the mask with no copy.
+
+        The stats are calculated for all the variations, but only the ones of
+        the variations in the mask are used for the histogram and the
+        selection. It returns the result, with no filtered variations, and
+        the mask of the variations kept.
+        '''
+        stats = self._calc_stat_for_filtered_samples(variations)
+        if stats is None:
+            return {}, mask
+        result, selected_rows = self._select_by_stats(variations, stats[mask])
+        if self.do_filtering:
+            kept_mask = mask.copy()
+            kept_mask[mask] = selected_rows
+            mask = kept_mask
+        return result, mask
+
 
 class IndelFilter():
 
@@ -279,8 +327,8 @@ class VariableAndNotAllMissing(_BaseFilter):
                                          axis=2)
         selected_rows1 = numpy.any(some_not_missing_gts, axis=1)
         # some variable
-        allele_counts, _ = counts_and_allels_by_row(genotypes,
-                                                    missing_value=MISSING_INT)
+        allele_counts = _get_allele_counts(vars_for_stat,
+                                           missing_value=MISSING_INT)[0]
         if allele_counts is None:
             selected_rows = numpy.full(shape=genotypes.shape[0],
                                        fill_value=False)
@@ -436,6 +484,9 @@ class SNPPositionFilter(_BaseFilter):
 
     def _in_any_region(self, variations):
         chroms = variations[CHROM_FIELD]
+        # The encoded chroms are compared using their codes
+        if not is_categorical(chroms):
+            chroms = chroms[:]
         poss = variations[POS_FIELD][:]
 
         in_any_region = None
@@ -443,7 +494,7 @@ class SNPPositionFilter(_BaseFilter):
             desired_chrom = region[0]
             if isinstance(desired_chrom, (tuple, list)):
                 raise ValueError('Malformed region: ' + str(region))
-            in_this_region = chroms[:] == desired_chrom
+            in_this_region = chroms == desired_chrom
             if len(region) > 1:
                 in_this_region = numpy.logical_and(in_this_region,
                                                    numpy.logical_and(region[1] <= poss, poss < region[2]))
@@ -493,6 +544,7 @@ class _GTsToMissingSetter:
         self.query_field_to_missing = query_field_to_missing
         self.range = range_
         self.n_bins = n_bins
+        self.sketch_histogram = False
 
     def __call__(self, variations):
 
@@ -521,10 +573,9 @@ class _GTsToMissingSetter:
             result[FLT_VARS] = copied_vars
 
         if self.do_histogram:
-            counts, edges = histogram(mat_to_check, n_bins=self.n_bins,
-                                      range_=self.range)
-            result[COUNTS] = counts
-            result[EDGES] = edges
+            result.update(_calc_histogram_result(mat_to_check, self.n_bins,
+                                                 self.range,
+                                                 self.sketch_histogram))
 
         return result
 
@@ -600,6 +651,130 @@ class DuplicatedAlleleFixer:
         return result
 
 
+def _group_duplicated_sites(fingerprints):
+    '''It groups the rows with the same site in every run of rows with the
+    same locus.
+
+    It returns the rows sorted by group and the start of every group in them.
+    '''
+    locus, site = fingerprints['locus'], fingerprints['site']
+    n_rows = locus.shape[0]
+    run_ids = numpy.cumsum(numpy.append(False, locus[1:] != locus[:-1]))
+    order = numpy.lexsort((numpy.arange(n_rows), site, run_ids))
+    sorted_site, sorted_runs = site[order], run_ids[order]
+    is_start = numpy.append(True, (sorted_site[1:] != sorted_site[:-1]) |
+                            (sorted_runs[1:] != sorted_runs[:-1]))
+    return order, numpy.flatnonzero(is_start)
+
+
+def _select_best_qual_rows(quals, order, group_starts):
+    quals = numpy.asarray(quals, dtype=numpy.float64)[order]
+    quals[numpy.isnan(quals)] = -numpy.inf
+    best_quals = numpy.maximum.reduceat(quals, group_starts)
+    group_of_rows = numpy.repeat(numpy.arange(group_starts.shape[0]),
+                                 numpy.diff(numpy.append(group_starts,
+                                                         order.shape[0])))
+    best_idxs = numpy.flatnonzero(quals == best_quals[group_of_rows])
+    # the first of the rows with the best QUAL
+    _, first_best = numpy.unique(group_of_rows[best_idxs], return_index=True)
+    return order[best_idxs[first_best]]
+
+
+def _calc_call_sources(gts, order, group_starts):
+    '''It returns, for every group and sample, the first row of the group
+    with the sample called.'''
+    n_rows = order.shape[0]
+    called = numpy.any(gts[order] != MISSING_INT, axis=2)
+    # the first rows get the highest scores, the missing calls none
+    scores = numpy.where(called, (n_rows - numpy.arange(n_rows))[:, None], 0)
+    best_scores = numpy.maximum.reduceat(scores, group_starts, axis=0)
+    sources = numpy.where(best_scores > 0, n_rows - best_scores,
+                          group_starts[:, None])
+    return order[sources]
+
+
+class DuplicatedSiteCollapser:
+    '''It collapses the variations with the same chrom, position and alleles.
+
+    The variations should be sorted or, at least, grouped by chrom and
+    position. The duplicated variations are looked for in every run of
+    variations with the same position, and the last run of every chunk is
+    held back and joined to the next chunk, so the duplicates split between
+    chunks are found as well. The held back variations are returned by
+    flush, the Pipeline calls it once all chunks are done.
+    The duplicates can be collapsed by keeping the first variation, the one
+    with the best QUAL or the first variation with, for every sample, the
+    calls of the first duplicate in which the sample is called.
+    '''
+    def __init__(self, policy=KEEP_FIRST):
+        if policy not in DUPLICATED_SITE_POLICIES:
+            raise ValueError('Unknown policy: ' + str(policy))
+        self.policy = policy
+        self._pending = None
+
+    def __call__(self, variations):
+        if self._pending is not None:
+            variations = concat_chunks([self._pending, variations],
+                                       variations)
+            self._pending = None
+        fingerprints = calc_chunk_fingerprints(variations)
+        locus = fingerprints['locus']
+        run_starts = numpy.flatnonzero(locus[1:] != locus[:-1])
+        last_run_start = run_starts[-1] + 1 if run_starts.size else 0
+        self._pending = variations.get_chunk(slice(last_run_start, None))
+        fingerprints = {kind: hashes[:last_run_start]
+                        for kind, hashes in fingerprints.items()}
+        return self._collapse(variations.get_chunk(slice(0, last_run_start)),
+                              fingerprints)
+
+    def flush(self):
+        'It collapses the variations held back'
+        pending, self._pending = self._pending, None
+        if pending is None or not pending.num_variations:
+            return {}
+        return self._collapse(pending, calc_chunk_fingerprints(pending))
+
+    def _collapse(self, variations, fingerprints):
+        tot = variations.num_variations
+        if not tot:
+            return {FLT_VARS: variations,
+                    FLT_STATS: {N_KEPT: 0, N_FILTERED_OUT: 0, TOT: 0}}
+        order, group_starts = _group_duplicated_sites(fingerprints)
+        n_kept = group_starts.shape[0]
+        if n_kept == tot:
+            flt_vars = variations
+        elif (self.policy == KEEP_BEST_QUAL and
+              QUAL_FIELD in variations.keys()):
+            kept_rows = _select_best_qual_rows(variations[QUAL_FIELD], order,
+                                               group_starts)
+            flt_vars = variations.get_chunk(numpy.sort(kept_rows))
+        else:
+            kept_rows = order[group_starts]
+            sort_idxs = numpy.argsort(kept_rows)
+            flt_vars = variations.get_chunk(kept_rows[sort_idxs])
+            if self.policy == COMBINE_CALLS and GT_FIELD in variations.keys():
+                sources = _calc_call_sources(variations[GT_FIELD], order,
+                                             group_starts)[sort_idxs]
+                self._combine_calls(variations, flt_vars, sources)
+        return {FLT_VARS: flt_vars,
+                FLT_STATS: {N_KEPT: n_kept, N_FILTERED_OUT: tot - n_kept,
+                            TOT: tot}}
+
+    @staticmethod
+    def _combine_calls(variations, flt_vars, sources):
+        n_samples = sources.shape[1]
+        samples_idx = numpy.arange(n_samples)[None, :]
+        for path in variations.keys():
+            if not path.startswith('/calls/'):
+                continue
+            mat = variations[path]
+            if mat.ndim < 2 or mat.shape[1] != n_samples:
+                continue
+            combined = mat[sources, samples_idx]
+            del flt_vars[path]
+            flt_vars[path] = combined
+
+
 class NonBiallelicFilter(_BaseFilter):
 
     def __init__(self, samples=None, report_selection=False,
@@ -619,34 +794,17 @@ class NonBiallelicFilter(_BaseFilter):
         return False
 
     def _select_mono(self, chunk):
-        keep_monomorphic = self.keep_monomorphic
-
-        gts = chunk[GT_FIELD]
-        if is_dataset(gts):
-            gts = gts[:]
-
-        shape = gts.shape
-
-        # we count how many different alleles are per row
-        # we do it adding a complex part to each number. The complex part is
-        # related with the row. Then we use unique
-        weight = 1j * numpy.arange(0, shape[0])
-        weight = numpy.repeat(weight, shape[1] * shape[2]).reshape(shape)
-        b = gts + weight
-        _, ind = numpy.unique(b, return_index=True)
-        b = numpy.zeros_like(gts)
-        c = numpy.ones_like(gts)
-        numpy.put(b, ind, c.flat[ind])
-        c = numpy.sum(b, axis=(2, 1))
-
-        # we remove the missing values from the count
-        rows_with_missing = numpy.any(gts == -1, axis=(1, 2))
-        c -= rows_with_missing
-
-        if keep_monomorphic:
-            selected_rows = (c <= 2)
+        # the alleles found by row, the missing ones are not counted
+        allele_counts = _get_allele_counts(chunk, missing_value=MISSING_INT)[0]
+        if allele_counts is None:
+            num_alleles = numpy.zeros(chunk[GT_FIELD].shape[0], dtype=int)
+        else:
+            num_alleles = numpy.sum(allele_counts > 0, axis=1)
+
+        if self.keep_monomorphic:
+            selected_rows = (num_alleles <= 2)
         else:
-            selected_rows = (c == 2)
+            selected_rows = (num_alleles == 2)
         return selected_rows
 
     def __call__(self, variations):
@@ -787,9 +945,6 @@ class Chi2GtFreqs2SampleSetsFilter(_BaseFilter):
 
 def _filter_samples_by_index(variations, sample_cols, filtered_vars=None,
                              reverse=False):
-    if filtered_vars is None:
-        filtered_vars = VariationsArrays()
-
     samples = variations.samples
     try:
         dtype = sample_cols.dtype
@@ -798,6 +953,7 @@ def _filter_samples_by_index(variations, sample_cols, filtered_vars=None,
         item = first(iter(sample_cols))
         is_bool = isinstance(item, bool)
     if not is_bool:
+        sample_cols = set(sample_cols)
         sample_cols = [idx in sample_cols for idx in range(len(samples))]
 
     if 'shape' not in dir(sample_cols):
@@ -806,6 +962,14 @@ def _filter_samples_by_index(variations, sample_cols, filtered_vars=None,
     if reverse:
         sample_cols = numpy.logical_not(sample_cols)
 
+    kept_samples = [samples[idx] for idx, keep in enumerate(sample_cols)
+                    if keep]
+    if filtered_vars is None and isinstance(variations, VariationsH5):
+        # Only the HDF5 chunks with the kept samples are read
+        return variations.get_chunk(slice(None), samples=kept_samples)
+    if filtered_vars is None:
+        filtered_vars = VariationsArrays()
+
     for path in variations.keys():
         matrix = variations[path]
         if is_dataset(matrix):
@@ -817,8 +981,6 @@ def _filter_samples_by_index(variations, sample_cols, filtered_vars=None,
         else:
             filtered_vars[path] = matrix
     filtered_vars.metadata = variations.metadata
-    kept_samples = [samples[idx] for idx, keep in enumerate(sample_cols)
-                    if keep]
     filtered_vars.samples = kept_samples
     return filtered_vars
 
@@ -1137,10 +1299,9 @@ class PseudoHetDuplicationFilter(_BaseFilter):
         result = {}
 
         if self.do_histogram:
-            counts, edges = histogram(freq_high_dp, n_bins=self.n_bins,
-                                      range_=self.range)
-            result[COUNTS] = counts
-            result[EDGES] = edges
+            result.update(_calc_histogram_result(freq_high_dp, self.n_bins,
+                                                 self.range,
+                                                 self.sketch_histogram))
 
         if self.do_filtering or self.report_selection:
             het_call = call_is_het(vars_for_stat[GT_FIELD])
@@ -0,0 +1,219 @@
+import numpy
+
+from variation import (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD, GT_FIELD,
+                       SNPS_PER_CHUNK, MISSING_BYTE)
+
+# Missing docstring
+# pylint: disable=C0111
+
+# The fingerprints are 64 bit hashes of every variation:
+# locus: chrom and position.
+# site: chrom, position, reference and alternative alleles.
+# gts: the genotypes, only if they are asked for.
+# The hashes of equal values are equal whatever the length of the strings or
+# the number of alternative alleles of the matrices.
+FINGERPRINT_KINDS = ('locus', 'site', 'gts')
+
+_SEED = numpy.uint64(0x9e3779b97f4a7c15)
+_MIX1 = numpy.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = numpy.uint64(0x94d049bb133111eb)
+_SHIFTS = numpy.uint64(30), numpy.uint64(27), numpy.uint64(31)
+
+
+def _mix(values):
+    # splitmix64 finalizer
+    values = values ^ (values >> _SHIFTS[0])
+    values = values * _MIX1
+    values = values ^ (values >> _SHIFTS[1])
+    values = values * _MIX2
+    return values ^ (values >> _SHIFTS[2])
+
+
+def _combine(hashes, values):
+    return _mix((hashes * _MIX1) ^ _mix(values + _SEED))
+
+
+def _as_words(matrix):
+    'It returns the bytes of every row as 64 bit words, filled with zeros'
+    matrix = numpy.ascontiguousarray(matrix)
+    n_rows = matrix.shape[0]
+    bytes_ = matrix.view(numpy.uint8).reshape((n_rows, -1))
+    n_bytes = bytes_.shape[1]
+    if n_bytes % 8:
+        padded = numpy.zeros((n_rows, n_bytes + 8 - n_bytes % 8),
+                             dtype=numpy.uint8)
+        padded[:, :n_bytes] = bytes_
+        bytes_ = padded
+    return bytes_.view('<u8')
+
+
+def _hash_strings(strings):
+    'It hashes the bytes of the strings up to their length'
+    lens = numpy.char.str_len(strings)
+    words = _as_words(strings)
+    hashes = _combine(numpy.full(strings.shape[0], _SEED),
+                      lens.astype(numpy.uint64))
+    for word_idx in range(words.shape[1]):
+        in_string = word_idx * 8 < lens
+        if not numpy.any(in_string):
+            break
+        hashes = numpy.where(in_string, _combine(hashes, words[:, word_idx]),
+                             hashes)
+    return hashes
+
+
+def _hash_alleles(refs, alts):
+    hashes = _hash_strings(refs)
+    for col in range(alts.shape[1]):
+        alleles = alts[:, col]
+        # the empty alleles are ignored, so the number of columns does not
+        # matter
+        hashes = numpy.where(alleles != MISSING_BYTE,
+                             _combine(hashes, _hash_strings(alleles)),
+                             hashes)
+    return hashes
+
+
+def _hash_gts(gts):
+    gts = numpy.asarray(gts).astype(numpy.int8)
+    gts = gts.reshape((gts.shape[0], -1))
+    hashes = _combine(numpy.full(gts.shape[0], _SEED),
+                      numpy.full(gts.shape[0], gts.shape[1],
+                                 dtype=numpy.uint64))
+    words = _as_words(gts)
+    for word_idx in range(words.shape[1]):
+        hashes = _combine(hashes, words[:, word_idx])
+    return hashes
+
+
+def calc_chunk_fingerprints(chunk, with_gts=False):
+    'It returns the fingerprints of every variation in the chunk'
+    locus = _combine(_hash_strings(chunk[CHROM_FIELD]),
+                     chunk[POS_FIELD].astype(numpy.int64).view(numpy.uint64))
+    fingerprints = {'locus': locus}
+    if REF_FIELD in chunk.keys() and ALT_FIELD in chunk.keys():
+        alleles = _hash_alleles(chunk[REF_FIELD], chunk[ALT_FIELD])
+    else:
+        alleles = numpy.zeros(locus.shape[0], dtype=numpy.uint64)
+    fingerprints['site'] = _combine(locus, alleles)
+    if with_gts:
+        fingerprints['gts'] = _hash_gts(chunk[GT_FIELD])
+    return fingerprints
+
+
+def calc_fingerprints(variations, with_gts=False, chunk_size=SNPS_PER_CHUNK):
+    'It reads the variations in chunks to calculate their fingerprints'
+    kept_fields = [field for field in (CHROM_FIELD, POS_FIELD, REF_FIELD,
+                                       ALT_FIELD) if field in variations.keys()]
+    if with_gts:
+        kept_fields.append(GT_FIELD)
+    fingerprints = {kind: [] for kind in FINGERPRINT_KINDS
+                    if with_gts or kind != 'gts'}
+    for chunk in variations.iterate_chunks(kept_fields=kept_fields,
+                                           chunk_size=chunk_size):
+        for kind, hashes in calc_chunk_fingerprints(chunk,
+                                                    with_gts).items():
+            fingerprints[kind].append(hashes)
+    return {kind: (numpy.concatenate(hashes) if hashes else
+                   numpy.array([], dtype=numpy.uint64))
+            for kind, hashes in fingerprints.items()}
+
+
+def _content_hashes(fingerprints):
+    if 'gts' in fingerprints:
+        return _combine(fingerprints['site'], fingerprints['gts'])
+    return fingerprints['site']
+
+
+def calc_blocks_fingerprints(fingerprints, block_size=SNPS_PER_CHUNK):
+    '''It combines the fingerprints of every block of variations.
+
+    Two blocks have the same fingerprint if their variations have the same
+    fingerprints in the same order.
+    '''
+    hashes = _content_hashes(fingerprints)
+    starts = numpy.arange(0, hashes.shape[0], block_size)
+    # every hash is mixed with its position in the block so that the order
+    # matters
+    in_block_idxs = numpy.arange(hashes.shape[0]) % block_size
+    hashes = _combine(hashes, in_block_idxs.astype(numpy.uint64))
+    if not starts.shape[0]:
+        return numpy.array([], dtype=numpy.uint64)
+    return numpy.bitwise_xor.reduceat(hashes, starts)
+
+
+def _calc_occurrences(hashes):
+    'It numbers the repeated hashes by their order of appearance'
+    order = numpy.argsort(hashes, kind='mergesort')
+    sorted_hashes = hashes[order]
+    starts = numpy.append(True, sorted_hashes[1:] != sorted_hashes[:-1])
+    group_starts = numpy.maximum.accumulate(numpy.where(
+        starts, numpy.arange(hashes.shape[0]), 0))
+    occurrences = numpy.empty(hashes.shape[0], dtype=numpy.int64)
+    occurrences[order] = numpy.arange(hashes.shape[0]) - group_starts
+    return occurrences
+
+
+def diff_fingerprints(fingerprints1, fingerprints2):
+    '''It compares the fingerprints of two variations.
+
+    The variations are paired by their locus, the variations found several
+    times in the same locus are paired in order. It returns the rows only
+    found in the first variations (removed) and in the second (added) and
+    the pairs of rows with different alleles or genotypes (changed).
+    '''
+    keys = []
+    for fingerprints in (fingerprints1, fingerprints2):
+        locus = fingerprints['locus']
+        keys.append(_combine(locus,
+                             _calc_occurrences(locus).astype(numpy.uint64)))
+    keys1, keys2 = keys
+    order2 = numpy.argsort(keys2, kind='mergesort')
+    idxs = numpy.searchsorted(keys2, keys1, sorter=order2)
+    idxs = numpy.minimum(idxs, max(keys2.shape[0] - 1, 0))
+    if keys2.shape[0]:
+        rows2 = order2[idxs]
+        paired = keys2[rows2] == keys1
+    else:
+        rows2 = numpy.zeros(keys1.shape[0], dtype=numpy.int64)
+        paired = numpy.zeros(keys1.shape[0], dtype=numpy.bool_)
+    rows1 = numpy.flatnonzero(paired)
+    rows2 = rows2[paired]
+
+    content1 = _content_hashes(fingerprints1)
+    content2 = _content_hashes(fingerprints2)
+    changed = content1[rows1] != content2[rows2]
+    in_1 = numpy.zeros(keys2.shape[0], dtype=numpy.bool_)
+    in_1[rows2] = True
+    return {'removed': numpy.flatnonzero(~paired),
+            'added': numpy.flatnonzero(~in_1),
+            'changed': numpy.column_stack([rows1[changed], rows2[changed]])}
+
+
+def diff_variations(variations1, variations2, with_gts=False,
+                    chunk_size=SNPS_PER_CHUNK):
+    '''It compares two variations using their fingerprints.
+
+    The stored fingerprints are used if there are any, otherwise the
+    variations are read in chunks. If the fingerprints of all the chunks
+    match, the variations are equal and no variation is paired.
+    '''
+    fingerprints1 = variations1.get_fingerprints(with_gts=with_gts,
+                                                 chunk_size=chunk_size)
+    fingerprints2 = variations2.get_fingerprints(with_gts=with_gts,
+                                                 chunk_size=chunk_size)
+    n_vars = fingerprints1['locus'].shape[0]
+    if (n_vars == fingerprints2['locus'].shape[0] and
+            numpy.all(calc_blocks_fingerprints(fingerprints1, chunk_size) ==
+                      calc_blocks_fingerprints(fingerprints2, chunk_size))):
+        no_rows = numpy.array([], dtype=numpy.int64)
+        return {'removed': no_rows, 'added': no_rows,
+                'changed': numpy.empty((0, 2), dtype=numpy.int64)}
+    return diff_fingerprints(fingerprints1, fingerprints2)
+
+
+def find_duplicated_sites(variations, chunk_size=SNPS_PER_CHUNK):
+    '''It returns the rows with the chrom, position and alleles of a
+    previous row'''
+    site = variations.get_fingerprints(chunk_size=chunk_size)['site']
+    return numpy.flatnonzero(_calc_occurrences(site) > 0)
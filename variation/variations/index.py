@@ -5,6 +5,8 @@ from bisect import bisect_left, bisect_right
 import numpy
 
 from variation import POS_FIELD, CHROM_FIELD
+from variation.matrix.categorical import is_categorical
+from variation.matrix.coord_codecs import RunLengthMatrix, DeltaBlocksMatrix
 
 
 class PosIndex():
@@ -43,14 +45,28 @@ class PosIndex():
         return length
 
     def index_pos(self, chrom, pos):
-        return self._bisect(self.variations[POS_FIELD], pos,
+        pos_mat = self.variations[POS_FIELD]
+        if isinstance(pos_mat, DeltaBlocksMatrix):
+            return pos_mat.bisect_left(pos, lo=self._index[chrom]['start'],
+                                       hi=self._index[chrom]['end'])
+        return self._bisect(pos_mat, pos,
                             lo=self._index[chrom]['start'],
                             hi=self._index[chrom]['end'])
 
     def _create_dict(self):
         idx = OrderedDict()
         snps = self.variations
+        # The order tracked while writing avoids scanning unsorted SNPs
+        status = None
+        if hasattr(snps, '_get_order_status'):
+            status = snps._get_order_status()
+        if status is not None and status['sorted'] is False:
+            raise RuntimeError('SNPs are not sorted')
         chrom_mat = snps[CHROM_FIELD]
+        if is_categorical(chrom_mat):
+            return self._create_dict_from_codes(chrom_mat)
+        if isinstance(chrom_mat, RunLengthMatrix):
+            return self._create_dict_from_runs(chrom_mat)
         for chrom in numpy.unique(chrom_mat):
             start = bisect_left(chrom_mat, chrom)
             end = bisect_right(chrom_mat, chrom)
@@ -63,6 +79,35 @@ class PosIndex():
             idx[chrom] = {'start': start, 'end': end}
         return idx
 
+    @staticmethod
+    def _create_dict_from_codes(chrom_mat):
+        # The chromosome runs are found comparing the codes, not the strings
+        idx = OrderedDict()
+        codes = chrom_mat.get_codes()
+        if not codes.shape[0]:
+            return idx
+        run_starts = numpy.flatnonzero(codes[1:] != codes[:-1]) + 1
+        starts = numpy.append(0, run_starts)
+        ends = numpy.append(run_starts, codes.shape[0])
+        run_ranks = chrom_mat.table.ranks[codes[starts]]
+        if numpy.any(run_ranks[1:] <= run_ranks[:-1]):
+            raise RuntimeError('Maybe SNPs are not sorted')
+        for chrom, start, end in zip(chrom_mat.table.decode(codes[starts]),
+                                     starts, ends):
+            idx[chrom] = {'start': int(start), 'end': int(end)}
+        return idx
+
+    @staticmethod
+    def _create_dict_from_runs(chrom_mat):
+        # Every chrom has one run in the run table
+        idx = OrderedDict()
+        chroms = chrom_mat.run_values
+        if numpy.any(chroms[1:] <= chroms[:-1]):
+            raise RuntimeError('Maybe SNPs are not sorted')
+        for chrom, start, end in chrom_mat.runs():
+            idx[chrom] = {'start': int(start), 'end': int(end)}
+        return idx
+
     def _bisect(self, chrom_positions, pos, lo=0, hi=None):
         if lo < 0:
             raise ValueError('lo must be non-negative')
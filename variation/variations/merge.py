@@ -6,62 +6,78 @@
 # pylint: disable=C0111
 from collections import Counter
 import copy
+import functools
+import heapq
+import os
+import shutil
+import warnings
+from itertools import chain
+from multiprocessing import Pool
+from tempfile import mkdtemp
 
 import numpy
 
-from variation import MISSING_VALUES, MISSING_BYTE, DEF_METADATA
+from variation import (MISSING_VALUES, MISSING_BYTE, MISSING_FLOAT,
+                       DEF_METADATA, SNPS_PER_CHUNK)
 from variation.iterutils import PeekableIterator
 from variation import (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD,
                        QUAL_FIELD, GT_FIELD)
 from variation.matrix.methods import is_dataset
+from variation.variations.order import _from_json_chrom
+from variation.variations.sort import _calc_sort_keys
+from variation.variations.vars_matrices import (VariationsArrays,
+                                                VariationsH5,
+                                                _prepare_metadata)
+
+# The fields read from the variations to merge and their keys in the dicts
+# used by the per variation merge
+_MERGE_FIELDS = (('chrom', CHROM_FIELD), ('pos', POS_FIELD),
+                 ('ref', REF_FIELD), ('alt', ALT_FIELD),
+                 ('qual', QUAL_FIELD), ('gts', GT_FIELD))
+
+
+def _get_var(rows, idx):
+    'It returns the variation in the row as a dict'
+    ref = None if rows['ref'] is None else rows['ref'][idx]
+    if rows['alt'] is None:
+        alts = None
+    else:
+        alts = rows['alt'][idx]
+        alts = [alt for alt in alts if alt != MISSING_BYTE]
+        if not alts:
+            alts = None
+    qual = None if rows['qual'] is None else rows['qual'][idx]
+    gts = None if rows['gts'] is None else rows['gts'][idx]
+    return {'chrom': rows['chrom'][idx], 'pos': rows['pos'][idx], 'ref': ref,
+            'alt': alts, 'qual': qual, 'gts': gts}
+
+
+def _get_rows(chunk, fields=_MERGE_FIELDS):
+    rows = {}
+    for key, field in fields:
+        if field in chunk.keys():
+            mat = chunk[field]
+            rows[key] = mat[:] if is_dataset(mat) else mat
+        else:
+            rows[key] = None
+    return rows
 
 
-def _iterate_vars(variations):
-    kept_fields = [CHROM_FIELD, POS_FIELD]
-
-    optional_fields = [REF_FIELD, ALT_FIELD, GT_FIELD, QUAL_FIELD]
-    for field in optional_fields:
-        if field in variations.keys():
-            kept_fields.append(field)
-
-    for chunk in variations.iterate_chunks(kept_fields=kept_fields):
-        chunk_keys = chunk.keys()
-        vars_chrom = chunk[CHROM_FIELD]
-        vars_pos = chunk[POS_FIELD]
-        vars_ref = chunk[REF_FIELD] if REF_FIELD in chunk_keys else None
-        vars_alt = chunk[ALT_FIELD] if ALT_FIELD in chunk_keys else None
-        vars_qual = chunk[QUAL_FIELD] if QUAL_FIELD in chunk_keys else None
-        vars_gts = chunk[GT_FIELD] if GT_FIELD in chunk_keys else None
-
-        if is_dataset(vars_chrom):
-            vars_chrom = vars_chrom[:]
-            vars_pos = vars_pos[:]
-            if vars_ref is not None:
-                vars_ref = vars_ref[:]
-            if vars_alt is not None:
-                vars_alt = vars_alt[:]
-            if vars_qual is not None:
-                vars_qual = vars_qual[:]
-            if vars_gts is not None:
-                vars_gts = vars_gts[:]
-
-        for var_idx in range(chunk.num_variations):
-            chrom = vars_chrom[var_idx]
-            pos = vars_pos[var_idx]
-            ref = None if vars_ref is None else vars_ref[var_idx]
-            if vars_alt is None:
-                alts = None
-            else:
-                alts = vars_alt[var_idx]
-                alts = [alt for alt in alts if alt != MISSING_BYTE]
-                if not alts:
-                    alts = None
-            qual = None if vars_qual is None else vars_qual[var_idx]
-            gts = None if vars_gts is None else vars_gts[var_idx]
+def _iterate_chunk_rows(variations, chunk_size=None, fields=_MERGE_FIELDS,
+                        start=0, stop=None):
+    kept_fields = [field for _, field in fields
+                   if field in variations.keys()]
+    for chunk in variations.iterate_chunks(kept_fields=kept_fields,
+                                           chunk_size=chunk_size,
+                                           start=start, stop=stop):
+        if chunk.num_variations:
+            yield _get_rows(chunk, fields), chunk.num_variations
+
 
-            var_ = {'chrom': chrom, 'pos': pos, 'ref': ref, 'alt': alts,
-                    'qual': qual, 'gts': gts}
-            yield var_
+def _iterate_vars(variations):
+    for rows, n_rows in _iterate_chunk_rows(variations):
+        for var_idx in range(n_rows):
+            yield _get_var(rows, var_idx)
 
 
 def _are_overlapping(var1, var2):
@@ -256,6 +272,191 @@ def _transform_gts_to_merge(long_alleles, new_short_alleles, gts):
     return alleles_merged, new_gts
 
 
+def _get_chrom_names(variations):
+    tracker = variations._get_order_tracker()
+    if tracker.chroms is not None:
+        return numpy.array([_from_json_chrom(chrom)
+                            for chrom in tracker.chroms])
+    chroms = [numpy.unique(rows['chrom']) for rows, _ in
+              _iterate_chunk_rows(variations)]
+    if not chroms:
+        return numpy.array([], dtype=variations[CHROM_FIELD].dtype)
+    return numpy.unique(numpy.concatenate(chroms))
+
+
+def _get_chrom_rows(variations, chrom):
+    'It returns the first row and the row after the last one of the chrom'
+    index = variations.pos_index
+    if chrom not in set(index.chroms):
+        return 0, 0
+    start, last = index.get_chrom_range_index(chrom)
+    return start, last + 1
+
+
+def _get_rows_to_merge(variations, chrom=None):
+    '''It returns the sorted chrom names and the rows of every variations to
+    merge, all or just the rows of the given chrom'''
+    if chrom is None:
+        chrom_names = functools.reduce(numpy.union1d,
+                                       [_get_chrom_names(vars_)
+                                        for vars_ in variations])
+        return chrom_names, [(0, None)] * len(variations)
+    if isinstance(chrom, str):
+        chrom = chrom.encode()
+    return (numpy.array([chrom]),
+            [_get_chrom_rows(vars_, chrom) for vars_ in variations])
+
+
+def _calc_var_lens(rows):
+    if rows['ref'] is None:
+        return numpy.ones(rows['pos'].shape[0], dtype=numpy.int64)
+    var_lens = numpy.char.str_len(rows['ref'])
+    if rows['alt'] is not None and rows['alt'].shape[1]:
+        alt_lens = numpy.char.str_len(rows['alt']).max(axis=1)
+        var_lens = numpy.maximum(var_lens, alt_lens)
+    return var_lens
+
+
+def _alts_are_packed(alts):
+    'The empty alleles are only found after the non empty ones'
+    is_allele = alts != MISSING_BYTE
+    return numpy.all(is_allele[:, :-1] >= is_allele[:, 1:], axis=1)
+
+
+class _MergeInput():
+    '''It reads the variations to merge in chunks.
+
+    The rows read and not yet merged are kept along with their sort keys and
+    the keys of their last position.
+    '''
+    def __init__(self, variations, chunk_size, chrom_names,
+                 fields=_MERGE_FIELDS, rows=(0, None)):
+        self._chunks = _iterate_chunk_rows(variations, chunk_size=chunk_size,
+                                           fields=fields, start=rows[0],
+                                           stop=rows[1])
+        self._chrom_names = chrom_names
+        self.exhausted = False
+        self.rows = {key: variations[field][:0]
+                     if field in variations.keys() else None
+                     for key, field in fields}
+        self.keys = numpy.array([], dtype=numpy.int64)
+        self.stops = numpy.array([], dtype=numpy.int64)
+
+    @property
+    def num_rows(self):
+        return self.keys.shape[0]
+
+    def read(self):
+        try:
+            rows, _ = next(self._chunks)
+        except StopIteration:
+            self.exhausted = True
+            return
+        keys = _calc_sort_keys({CHROM_FIELD: rows['chrom'],
+                                POS_FIELD: rows['pos']}, self._chrom_names)
+        prev_keys = self.keys[-1:]
+        if numpy.any(numpy.diff(numpy.append(prev_keys, keys)) < 0):
+            raise ValueError('The variations to merge should be sorted')
+        stops = keys + _calc_var_lens(rows) - 1
+        self.rows = {key: None if mat is None else
+                     numpy.concatenate([self.rows[key], mat])
+                     for key, mat in rows.items()}
+        self.keys = numpy.append(self.keys, keys)
+        self.stops = numpy.append(self.stops, stops)
+
+    def pop(self, n_rows):
+        rows = {key: None if mat is None else mat[:n_rows]
+                for key, mat in self.rows.items()}
+        self.rows = {key: None if mat is None else mat[n_rows:]
+                     for key, mat in self.rows.items()}
+        keys, self.keys = self.keys[:n_rows], self.keys[n_rows:]
+        stops, self.stops = self.stops[:n_rows], self.stops[n_rows:]
+        return rows, keys, stops
+
+
+def _align_rows(keys, stops):
+    '''It sorts the rows of several inputs and groups the overlapping ones.
+
+    The rows of the first inputs go first when the positions are equal.
+    It returns the input and the row of every sorted row, its region and the
+    maximum stop found up to it.
+    '''
+    n_rows = [input_keys.shape[0] for input_keys in keys]
+    keys = numpy.concatenate(keys)
+    order = numpy.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    region_stops = numpy.maximum.accumulate(numpy.concatenate(stops)[order])
+    new_region = numpy.ones(keys.shape[0], dtype=numpy.bool_)
+    new_region[1:] = keys[1:] > region_stops[:-1]
+
+    offsets = numpy.cumsum([0] + n_rows)
+    input_idxs = numpy.searchsorted(offsets, order, side='right') - 1
+    row_idxs = order - offsets[input_idxs]
+    return input_idxs, row_idxs, numpy.cumsum(new_region) - 1, region_stops
+
+
+def _count_closed_rows(inputs):
+    '''It counts the rows of every input in the regions that can not grow.
+
+    A region could still get rows from the inputs not exhausted if it
+    reaches their last read position.
+    '''
+    input_idxs, _, regions, region_stops = _align_rows(
+        [input_.keys for input_ in inputs],
+        [input_.stops for input_ in inputs])
+    open_keys = [input_.keys[-1] for input_ in inputs
+                 if not input_.exhausted]
+    if open_keys:
+        last_rows = numpy.append(regions[1:] != regions[:-1], True)
+        closed = last_rows & (region_stops < min(open_keys))
+        n_closed = numpy.flatnonzero(closed)
+        n_closed = n_closed[-1] + 1 if n_closed.shape[0] else 0
+    else:
+        n_closed = input_idxs.shape[0]
+    return numpy.bincount(input_idxs[:n_closed], minlength=len(inputs))
+
+
+def _merge_snp_alleles(refs1, alts1, refs2, alts2, gts2):
+    '''It merges the alleles of SNPs found at the same positions.
+
+    The alleles of the second SNPs not found in the first ones are added at
+    the end and the second genotypes are changed to the merged alleles, as
+    _transform_gts_to_merge does.
+    '''
+    alleles1 = numpy.column_stack([refs1, alts1])
+    alleles2 = numpy.column_stack([refs2, alts2])
+    is_allele1 = alleles1 != MISSING_BYTE
+    is_allele2 = alleles2 != MISSING_BYTE
+    same = ((alleles2[:, :, None] == alleles1[:, None, :]) &
+            is_allele1[:, None, :])
+    new_alleles = is_allele2 & numpy.logical_not(same.any(axis=2))
+    n_alleles1 = is_allele1.sum(axis=1)
+    allele_idxs = numpy.where(new_alleles,
+                              n_alleles1[:, None] +
+                              numpy.cumsum(new_alleles, axis=1) - 1,
+                              numpy.argmax(same, axis=2))
+
+    n_snps = gts2.shape[0]
+    flat_gts2 = gts2.reshape((n_snps, -1))
+    allele_is_known = ((flat_gts2 >= 0) &
+                       (flat_gts2 < is_allele2.sum(axis=1)[:, None]))
+    new_gts2 = numpy.take_along_axis(allele_idxs,
+                                     numpy.where(allele_is_known, flat_gts2,
+                                                 0), axis=1)
+    new_gts2 = numpy.where(allele_is_known, new_gts2, flat_gts2)
+    new_gts2 = new_gts2.reshape(gts2.shape).astype(gts2.dtype)
+
+    n_alts = n_alleles1 + new_alleles.sum(axis=1) - 1
+    alts = numpy.full((n_snps, int(n_alts.max(initial=0))), MISSING_BYTE,
+                      dtype=numpy.result_type(alts1, alts2))
+    n_cols1 = min(alts1.shape[1], alts.shape[1])
+    alts[:, :n_cols1] = alts1[:, :n_cols1]
+    snp_idxs, allele_cols = numpy.nonzero(new_alleles)
+    alts[snp_idxs, allele_idxs[snp_idxs, allele_cols] - 1] = \
+        alleles2[snp_idxs, allele_cols]
+    return alts, new_gts2
+
+
 class VarMerger():
     def __init__(self, variations1, variations2, suffix_for_sample2=None,
                  ignore_complex_overlaps=False, ignore_malformed_vars=False,
@@ -289,6 +490,10 @@ class VarMerger():
 
         if variations1.ploidy != variations2.ploidy:
             raise ValueError('Ploidies should match')
+        for variations in (variations1, variations2):
+            status = variations._get_order_status()
+            if status is not None and status['sorted'] is False:
+                raise ValueError('The variations to merge should be sorted')
         self.ploidy = variations1.ploidy
         metadata = copy.deepcopy(DEF_METADATA)
         self.metadata = metadata
@@ -344,40 +549,255 @@ class VarMerger():
         msg += template.format(type(error).__name__, error.args)
         return msg
 
+    def _merge_group(self, snps1, snps2):
+        'It merges a group of overlapping variations, None if it is ignored'
+        if not self._snps_are_mergeable(snps1, snps2):
+            if not self._ignore_complex_overlaps:
+                poss1 = [(snp['chrom'], str(snp['pos'])) for snp in snps1]
+                poss2 = [(snp['chrom'], str(snp['pos'])) for snp in snps2]
+                msg = 'We can not merge these vars:\n'
+                msg += '{}\n{}\n'
+                raise NotImplementedError(msg.format(poss1, poss2))
+            return None
+        snp1 = snps1[0] if snps1 else None
+        snp2 = snps2[0] if snps2 else None
+        if self._ignore_non_matching and (snp1 is None or snp2 is None):
+            return None
+        try:
+            return self._merge_vars(snp1, snp2)
+        except MalformedVariationError:
+            if self._ignore_malformed_vars:
+                return None
+            raise
+        except Exception as error:
+            msg = self._build_error_msg(snp1, snp2, error)
+            error.args = (msg,)
+            raise
+
     @property
     def variations(self):
-        ignore_non_matching = self._ignore_non_matching
         for snps1, snps2 in _group_overlaping_vars(self.variations1,
                                                    self.variations2):
-
-            if self._snps_are_mergeable(snps1, snps2):
-                snp1 = snps1[0] if snps1 else None
-                snp2 = snps2[0] if snps2 else None
-                if ignore_non_matching and (snp1 is None or snp2 is None):
-                    continue
-                try:
-                    var = self._merge_vars(snp1, snp2)
-                except MalformedVariationError:
-                    if self._ignore_malformed_vars:
-                        continue
-                except Exception as error:
-                    msg = self._build_error_msg(snp1, snp2, error)
-                    error.args = (msg,)
-                    raise
-                calls = [(b'GT', var['gts'])]
-                depth = var.get('dp', None)
-                if depth is not None:
-                    calls.append((b'DP', depth))
-                variation = (var['chrom'], var['pos'], None, var['ref'],
-                             var['alt'], var['qual'], [], {}, calls)
-                yield variation
+            var = self._merge_group(snps1, snps2)
+            if var is None:
+                continue
+            calls = [(b'GT', var['gts'])]
+            depth = var.get('dp', None)
+            if depth is not None:
+                calls.append((b'DP', depth))
+            variation = (var['chrom'], var['pos'], None, var['ref'],
+                         var['alt'], var['qual'], [], {}, calls)
+            yield variation
+
+    def iterate_chunks(self, chunk_size=SNPS_PER_CHUNK, chrom=None):
+        '''It yields the merged variations in chunks.
+
+        Both variations are read in chunks and aligned by chrom and position.
+        The variations that do not overlap any other and the SNPs found in
+        both variations are merged at once, only the groups of overlapping
+        indels are merged one by one, as the variations property does.
+        If a chrom is given only its variations are merged.
+        '''
+        variations = [self.variations1, self.variations2]
+        chrom_names, rows = _get_rows_to_merge(variations, chrom)
+        inputs = [_MergeInput(vars_, chunk_size, chrom_names,
+                              rows=vars_rows)
+                  for vars_, vars_rows in zip(variations, rows)]
+        self._gt_shape = (len(self.samples), self.ploidy)
+        self._gt_dtype = numpy.result_type(self.variations1[GT_FIELD].dtype,
+                                           self.variations2[GT_FIELD].dtype)
+        while True:
+            for input_ in inputs:
+                if not input_.num_rows and not input_.exhausted:
+                    input_.read()
+            if not any(input_.num_rows for input_ in inputs):
+                if all(input_.exhausted for input_ in inputs):
+                    break
+                continue
+            # the rows of the second variations go first in the ties
+            n_rows2, n_rows1 = _count_closed_rows(inputs[::-1])
+            if not n_rows1 and not n_rows2:
+                # the input that was read less limits the closed regions
+                open_inputs = [input_ for input_ in inputs
+                               if not input_.exhausted]
+                min(open_inputs, key=lambda input_: input_.keys[-1]).read()
+                continue
+            chunk = self._merge_rows(*(inputs[0].pop(n_rows1) +
+                                       inputs[1].pop(n_rows2)))
+            if chunk.num_variations:
+                yield chunk
+
+    def _merge_rows(self, rows1, keys1, stops1, rows2, keys2, stops2):
+        'It merges the rows of the closed regions in a chunk'
+        input_idxs, row_idxs, regions, _ = _align_rows([keys2, keys1],
+                                                       [stops2, stops1])
+        is_row1 = input_idxs == 1
+        n_regions = int(regions[-1]) + 1 if regions.shape[0] else 0
+
+        # the row of every region for each variations, it is only used for
+        # the regions with one row
+        region_rows = []
+        for rows, in_rows, keys, stops in ((rows1, is_row1, keys1, stops1),
+                                           (rows2, ~is_row1, keys2, stops2)):
+            idxs = numpy.zeros(n_regions, dtype=numpy.int64)
+            idxs[regions[in_rows]] = row_idxs[in_rows]
+            var_lens = numpy.zeros(n_regions, dtype=numpy.int64)
+            var_lens[regions[in_rows]] = (stops - keys + 1)[row_idxs[in_rows]]
+            packed = numpy.ones(n_regions, dtype=numpy.bool_)
+            if rows['alt'] is not None:
+                packed[regions[in_rows]] = \
+                    _alts_are_packed(rows['alt'])[row_idxs[in_rows]]
+            n_vars = numpy.bincount(regions[in_rows], minlength=n_regions)
+            region_rows.append((idxs, var_lens, packed, n_vars))
+        (idxs1, var_lens1, packed1, n_vars1), (idxs2, var_lens2, packed2,
+                                               n_vars2) = region_rows
+
+        singles1 = (n_vars1 == 1) & (n_vars2 == 0) & packed1
+        singles2 = (n_vars1 == 0) & (n_vars2 == 1) & packed2
+        if self._merge_only_snps:
+            singles1 &= var_lens1 <= 1
+            singles2 &= var_lens2 <= 1
+        matches = ((n_vars1 == 1) & (n_vars2 == 1) & (var_lens1 == 1) &
+                   (var_lens2 == 1) & packed1 & packed2)
+        if rows1['ref'] is None or rows2['ref'] is None:
+            matches[:] = False
+        else:
+            match_idxs = numpy.flatnonzero(matches)
+            refs1 = rows1['ref'][idxs1[match_idxs]]
+            refs2 = rows2['ref'][idxs2[match_idxs]]
+            refs_ok = ((numpy.char.str_len(refs1) == 1) &
+                       (numpy.char.str_len(refs2) == 1))
+            if self._check_ref_matches:
+                refs_ok &= refs1 == refs2
+            matches[match_idxs[~refs_ok]] = False
+
+        # The rest of the regions are merged one by one
+        in_bulk = singles1 | singles2 | matches
+        complex_vars = {}
+        for sorted_idx in numpy.flatnonzero(~in_bulk[regions]):
+            region = regions[sorted_idx]
+            snps = complex_vars.setdefault(region, ([], []))
+            if is_row1[sorted_idx]:
+                snps[0].append(_get_var(rows1, row_idxs[sorted_idx]))
             else:
-                if not self._ignore_complex_overlaps:
-                    poss1 = [(snp['chrom'], str(snp['pos'])) for snp in snps1]
-                    poss2 = [(snp['chrom'], str(snp['pos'])) for snp in snps2]
-                    msg = 'We can not merge these vars:\n'
-                    msg += '{}\n{}\n'
-                    raise NotImplementedError(msg.format(poss1, poss2))
+                snps[1].append(_get_var(rows2, row_idxs[sorted_idx]))
+        complex_vars = {region: self._merge_group(snps1, snps2)
+                        for region, (snps1, snps2) in complex_vars.items()}
+        complex_vars = {region: var for region, var in complex_vars.items()
+                        if var is not None}
+
+        if self._ignore_non_matching:
+            singles1[:] = False
+            singles2[:] = False
+        matches_alts, matches_gts = None, None
+        match_idxs = numpy.flatnonzero(matches)
+        if match_idxs.shape[0]:
+            matches_alts, matches_gts = _merge_snp_alleles(
+                rows1['ref'][idxs1[match_idxs]],
+                rows1['alt'][idxs1[match_idxs]],
+                rows2['ref'][idxs2[match_idxs]],
+                rows2['alt'][idxs2[match_idxs]],
+                rows2['gts'][idxs2[match_idxs]])
+
+        return self._build_merged_chunk(n_regions, rows1, rows2,
+                                        (singles1, idxs1), (singles2, idxs2),
+                                        (match_idxs, idxs1, idxs2,
+                                         matches_alts, matches_gts),
+                                        complex_vars)
+
+    def _build_merged_chunk(self, n_regions, rows1, rows2, singles1, singles2,
+                            matches, complex_vars):
+        singles1, idxs1 = singles1
+        singles2, idxs2 = singles2
+        match_idxs, match_idxs1, match_idxs2, matches_alts, matches_gts = \
+            matches
+
+        alt_dtypes = [rows['alt'].dtype for rows in (rows1, rows2)
+                      if rows['alt'] is not None]
+        n_alts = [0]
+        for singles, idxs, rows in ((singles1, idxs1, rows1),
+                                    (singles2, idxs2, rows2)):
+            if rows['alt'] is not None and numpy.any(singles):
+                alts = rows['alt'][idxs[singles]]
+                n_alts.append(int((alts != MISSING_BYTE).sum(axis=1).max()))
+        if matches_alts is not None:
+            alt_dtypes.append(matches_alts.dtype)
+            n_alts.append(matches_alts.shape[1])
+        for var in complex_vars.values():
+            if var['alt'] is not None:
+                alt_dtypes.append(numpy.array(var['alt']).dtype)
+                n_alts.append(len(var['alt']))
+        if max(n_alts) > self.max_field_lens['alt']:
+            self.max_field_lens['alt'] = max(n_alts)
+        n_alt_cols = self.max_field_lens['alt']
+        alt_dtype = numpy.result_type(*alt_dtypes) if alt_dtypes else 'S1'
+
+        field_dtypes = {}
+        for key in ('chrom', 'pos', 'ref'):
+            field_dtypes[key] = numpy.result_type(rows1[key], rows2[key])
+        chroms = numpy.empty(n_regions, dtype=field_dtypes['chrom'])
+        poss = numpy.empty(n_regions, dtype=field_dtypes['pos'])
+        refs = numpy.full(n_regions, MISSING_BYTE, dtype=field_dtypes['ref'])
+        alts = numpy.full((n_regions, n_alt_cols), MISSING_BYTE,
+                          dtype=alt_dtype)
+        quals = numpy.full(n_regions, MISSING_FLOAT, dtype=numpy.float32)
+        gts = numpy.full((n_regions,) + self._gt_shape,
+                         MISSING_VALUES[self._gt_dtype], dtype=self._gt_dtype)
+        kept = singles1 | singles2
+
+        n_samples1 = self._n_samples1
+        for singles, idxs, rows, samples in ((singles1, idxs1, rows1,
+                                              slice(None, n_samples1)),
+                                             (singles2, idxs2, rows2,
+                                              slice(n_samples1, None))):
+            idxs = idxs[singles]
+            chroms[singles] = rows['chrom'][idxs]
+            poss[singles] = rows['pos'][idxs]
+            if rows['ref'] is not None:
+                refs[singles] = rows['ref'][idxs]
+            if rows['alt'] is not None:
+                n_cols = min(n_alt_cols, rows['alt'].shape[1])
+                alts[singles, :n_cols] = rows['alt'][idxs, :n_cols]
+            if rows['qual'] is not None:
+                quals[singles] = rows['qual'][idxs]
+            gts[singles, samples] = rows['gts'][idxs]
+
+        if match_idxs.shape[0]:
+            kept[match_idxs] = True
+            chroms[match_idxs] = rows1['chrom'][match_idxs1[match_idxs]]
+            poss[match_idxs] = rows1['pos'][match_idxs1[match_idxs]]
+            refs[match_idxs] = rows1['ref'][match_idxs1[match_idxs]]
+            alts[match_idxs, :matches_alts.shape[1]] = matches_alts
+            if rows1['qual'] is not None and rows2['qual'] is not None:
+                quals1 = rows1['qual'][match_idxs1[match_idxs]]
+                quals2 = rows2['qual'][match_idxs2[match_idxs]]
+                # as min does, the first qual is kept if the second is not
+                # lower
+                quals[match_idxs] = numpy.where(quals2 < quals1, quals2,
+                                                quals1)
+            gts[match_idxs, :n_samples1] = \
+                rows1['gts'][match_idxs1[match_idxs]]
+            gts[match_idxs, n_samples1:] = matches_gts
+
+        for region, var in complex_vars.items():
+            kept[region] = True
+            chroms[region] = var['chrom']
+            poss[region] = var['pos']
+            refs[region] = var['ref']
+            if var['alt'] is not None:
+                alts[region, :len(var['alt'])] = var['alt']
+            if var['qual'] is not None:
+                quals[region] = var['qual']
+            gts[region] = var['gts']
+
+        chunk = VariationsArrays()
+        for field, mat in ((CHROM_FIELD, chroms), (POS_FIELD, poss),
+                           (REF_FIELD, refs), (ALT_FIELD, alts),
+                           (QUAL_FIELD, quals), (GT_FIELD, gts)):
+            chunk[field] = mat[kept]
+        chunk._set_samples([sample.decode() for sample in self.samples])
+        chunk._set_metadata(_prepare_metadata(self.metadata))
+        return chunk
 
     def _len_longer_allele(self, snps):
         alleles = []
@@ -402,7 +822,7 @@ class VarMerger():
             self.log['Too_many_overlaping_vars'] += 1
             result = False
 
-        elif len_snps1 == 1 or len_snps1 == 1:
+        elif len_snps1 == 1 and len_snps2 == 1:
             if _var_len(snps1[0]) > 1 and _var_len(snps2[0]) > 1:
                 self.log['overlaping_complex'] += 1
                 result = False
@@ -523,3 +943,556 @@ class VarMerger():
                 'ref': alleles_merged[0], 'alt': alt, 'gts': merged_gts,
                 'qual': qual}
         return var_
+
+
+# How the sites not found in some variations are merged: the genotypes of
+# their samples are left missing or set to the reference or the sites are
+# dropped
+MISSING_SITES_AS_MISSING = 'missing'
+MISSING_SITES_AS_REF = 'ref'
+DROP_MISSING_SITES = 'drop'
+MISSING_SITES_POLICIES = (MISSING_SITES_AS_MISSING, MISSING_SITES_AS_REF,
+                          DROP_MISSING_SITES)
+# The functions that can reduce the values of the variations fields found in
+# several variations, the missing values are ignored
+FIELD_FUNCTS = {'min': numpy.nanmin, 'max': numpy.nanmax,
+                'mean': numpy.nanmean}
+_SITE_FIELDS = (CHROM_FIELD, POS_FIELD, REF_FIELD, ALT_FIELD)
+
+
+def _pack_alts(alts):
+    'It moves the empty alleles after the non empty ones'
+    if numpy.all(_alts_are_packed(alts)):
+        return alts
+    order = numpy.argsort(alts == MISSING_BYTE, axis=1, kind='mergesort')
+    return numpy.take_along_axis(alts, order, axis=1)
+
+
+def _fit_matrix(matrix, shape, dtype):
+    'It fills the extra dimensions of the matrix up to the given shape'
+    if matrix.shape[1:] == shape and matrix.dtype == dtype:
+        return matrix
+    fitted = numpy.full((matrix.shape[0],) + shape, MISSING_VALUES[dtype],
+                        dtype=dtype)
+    fitted[tuple(slice(0, dim) for dim in matrix.shape)] = matrix
+    return fitted
+
+
+def _reduce_field(values, funct, dtype):
+    'It reduces the values of the variations (second axis) of every site'
+    with warnings.catch_warnings():
+        # the sites not found in any variations are all nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        reduced = FIELD_FUNCTS[funct](values, axis=1)
+    if dtype.kind == 'f':
+        return reduced.astype(dtype)
+    if funct == 'mean':
+        return reduced.astype(numpy.float32)
+    is_missing = numpy.isnan(reduced)
+    reduced = numpy.where(is_missing, MISSING_VALUES[dtype], reduced)
+    return reduced.astype(dtype)
+
+
+class _MultiVarMerger():
+    '''It merges several sorted variations in one pass.
+
+    Every variations is read in chunks by a cursor and the cursor that was
+    read less is read next. The variations found at the same position with
+    the same reference allele in every variations are merged, the alleles
+    are joined and the genotypes of all the samples are put side by side.
+    The allele dimensions of the calls other than GT are not changed.
+    '''
+    def __init__(self, variations, fields_funct=None, ignore_fields=None,
+                 missing_sites=MISSING_SITES_AS_MISSING,
+                 ignore_overlaps=False, ignore_2_or_more_overlaps=False,
+                 chunk_size=SNPS_PER_CHUNK):
+        if not variations:
+            raise ValueError('No variations to merge')
+        if missing_sites not in MISSING_SITES_POLICIES:
+            raise ValueError('Unknown missing sites policy: ' +
+                             str(missing_sites))
+        self.variations = variations
+        self._missing_sites = missing_sites
+        self._ignore_overlaps = ignore_overlaps
+        self._ignore_2_or_more_overlaps = ignore_2_or_more_overlaps
+        self._chunk_size = chunk_size
+        self.log = Counter()
+
+        if len(set(vars_.ploidy for vars_ in variations)) > 1:
+            raise ValueError('Ploidies should match')
+        self.ploidy = variations[0].ploidy
+        for vars_ in variations:
+            status = vars_._get_order_status()
+            if status is not None and status['sorted'] is False:
+                raise ValueError('The variations to merge should be sorted')
+            for field in _SITE_FIELDS:
+                if field not in vars_.keys():
+                    raise ValueError('The variations to merge should have ' +
+                                     field)
+
+        self.samples = []
+        self._sample_cols = []
+        for vars_ in variations:
+            start = len(self.samples)
+            self.samples.extend(vars_.samples)
+            self._sample_cols.append(slice(start, len(self.samples)))
+        if len(set(self.samples)) != len(self.samples):
+            raise ValueError('The samples of the variations should differ')
+
+        self.metadata = {}
+        for vars_ in variations:
+            for field, field_meta in vars_.metadata.items():
+                self.metadata.setdefault(field, field_meta)
+
+        self._fields = self._get_fields(ignore_fields)
+        self._fields_funct = self._resolve_fields_funct(fields_funct)
+
+    def _get_fields(self, ignore_fields):
+        ignore_fields = [] if ignore_fields is None else ignore_fields
+        fields = {}
+        for vars_ in self.variations:
+            for field in vars_.keys():
+                if field in ignore_fields and field not in _SITE_FIELDS:
+                    continue
+                mat = vars_[field]
+                if field not in fields:
+                    fields[field] = (mat.dtype, mat.shape[1:])
+                    continue
+                dtype, shape = fields[field]
+                if len(shape) != len(mat.shape[1:]):
+                    raise ValueError('The dimensions of the field differ: ' +
+                                     field)
+                shape = tuple(max(dims) for dims in zip(shape,
+                                                        mat.shape[1:]))
+                fields[field] = (numpy.result_type(dtype, mat.dtype), shape)
+        return fields
+
+    def _resolve_fields_funct(self, fields_funct):
+        fields_funct = {} if fields_funct is None else fields_funct
+        resolved = {}
+        for name, funct in fields_funct.items():
+            if funct not in FIELD_FUNCTS:
+                raise ValueError('Function not supported: ' + str(funct))
+            paths = [field for field in self._fields
+                     if field == name or field.endswith('/' + name)]
+            paths = [field for field in paths
+                     if not field.startswith('/calls/') and
+                     field not in _SITE_FIELDS]
+            if not paths:
+                raise ValueError('No field to merge found for: ' + name)
+            for path in paths:
+                if self._fields[path][0].kind not in ('i', 'u', 'f'):
+                    raise ValueError('Only numeric fields can be reduced: ' +
+                                     path)
+                resolved[path] = funct
+        return resolved
+
+    def _get_input_fields(self, variations):
+        fields = [('chrom', CHROM_FIELD), ('pos', POS_FIELD),
+                  ('ref', REF_FIELD), ('alt', ALT_FIELD)]
+        fields.extend((field, field) for field in self._fields
+                      if field not in _SITE_FIELDS and
+                      field in variations.keys())
+        return fields
+
+    def iterate_chunks(self, chrom=None):
+        chrom_names, rows = _get_rows_to_merge(self.variations, chrom)
+        cursors = [_MergeInput(vars_, self._chunk_size, chrom_names,
+                               fields=self._get_input_fields(vars_),
+                               rows=vars_rows)
+                   for vars_, vars_rows in zip(self.variations, rows)]
+        # The open cursors by their last read position
+        cursors_heap = []
+        for idx, cursor in enumerate(cursors):
+            cursor.read()
+            if not cursor.exhausted:
+                heapq.heappush(cursors_heap, (cursor.keys[-1], idx))
+
+        while True:
+            if not any(cursor.num_rows for cursor in cursors):
+                break
+            n_rows = _count_closed_rows(cursors)
+            if not numpy.any(n_rows):
+                _, idx = heapq.heappop(cursors_heap)
+                cursors[idx].read()
+                if not cursors[idx].exhausted:
+                    heapq.heappush(cursors_heap, (cursors[idx].keys[-1], idx))
+                continue
+            chunk = self._merge_rows([cursor.pop(n_cursor_rows)
+                                      for cursor, n_cursor_rows in
+                                      zip(cursors, n_rows)])
+            if chunk.num_variations:
+                yield chunk
+
+    def _raise_overlaps(self, msg, overlaps, regions, input_idxs, row_idxs,
+                        popped):
+        sorted_idx = numpy.searchsorted(regions, numpy.flatnonzero(overlaps)[0])
+        rows = popped[input_idxs[sorted_idx]][0]
+        row = row_idxs[sorted_idx]
+        msg += ', chrom: {} pos: {}'.format(rows['chrom'][row],
+                                            rows['pos'][row])
+        raise NotImplementedError(msg)
+
+    def _classify_sites(self, popped, input_idxs, row_idxs, regions):
+        n_inputs = len(popped)
+        n_regions = int(regions[-1]) + 1
+        n_vars = numpy.zeros((n_regions, n_inputs), dtype=numpy.int64)
+        numpy.add.at(n_vars, (regions, input_idxs), 1)
+        site_rows = numpy.full((n_regions, n_inputs), -1, dtype=numpy.int64)
+        site_rows[regions, input_idxs] = row_idxs
+
+        keys = numpy.concatenate([keys for _, keys, _ in popped])
+        refs = numpy.concatenate([rows['ref'] for rows, _, _ in popped])
+        offsets = numpy.cumsum([0] + [keys_.shape[0]
+                                      for _, keys_, _ in popped])
+        flat_idxs = offsets[input_idxs] + row_idxs
+        keys, refs = keys[flat_idxs], refs[flat_idxs]
+        first_rows = numpy.flatnonzero(numpy.append(True, regions[1:] !=
+                                                    regions[:-1]))
+        differ = ((keys != keys[first_rows][regions]) |
+                  (refs != refs[first_rows][regions]))
+        differ = numpy.bincount(regions, weights=differ,
+                                minlength=n_regions) > 0
+
+        overlaps_in_file = numpy.any(n_vars > 1, axis=1)
+        overlaps_between_files = differ & ~overlaps_in_file
+        kept = numpy.ones(n_regions, dtype=numpy.bool_)
+        for overlaps, ignore, log_key, msg in (
+                (overlaps_in_file, self._ignore_overlaps,
+                 'overlaping_vars_in_same_file',
+                 'Overlapping variations in the same file'),
+                (overlaps_between_files, self._ignore_2_or_more_overlaps,
+                 'overlaping_vars_between_files',
+                 'Overlapping variations between files')):
+            if not numpy.any(overlaps):
+                continue
+            if not ignore:
+                self._raise_overlaps(msg, overlaps, regions, input_idxs,
+                                     row_idxs, popped)
+            self.log[log_key] += int(numpy.sum(overlaps))
+            kept &= ~overlaps
+
+        incomplete = kept & numpy.any(site_rows < 0, axis=1)
+        self.log['sites_missing_in_some_files'] += int(numpy.sum(incomplete))
+        if self._missing_sites == DROP_MISSING_SITES:
+            kept &= ~incomplete
+        site_rows = site_rows[kept]
+        self.log['merged_sites'] += site_rows.shape[0]
+        return site_rows
+
+    def _merge_rows(self, popped):
+        input_idxs, row_idxs, regions, _ = _align_rows(
+            [keys for _, keys, _ in popped], [stops for _, _, stops in popped])
+        site_rows = self._classify_sites(popped, input_idxs, row_idxs,
+                                         regions)
+        n_sites = site_rows.shape[0]
+        first_inputs = numpy.argmax(site_rows >= 0, axis=1)
+
+        merged = {}
+        for field in (CHROM_FIELD, POS_FIELD, REF_FIELD):
+            dtype = self._fields[field][0]
+            merged[field] = numpy.empty(n_sites, dtype=dtype)
+        key_fields = {CHROM_FIELD: 'chrom', POS_FIELD: 'pos',
+                      REF_FIELD: 'ref'}
+        for input_idx, (rows, _, _) in enumerate(popped):
+            sites = first_inputs == input_idx
+            for field, key in key_fields.items():
+                merged[field][sites] = rows[key][site_rows[sites, input_idx]]
+
+        self._merge_alleles(popped, site_rows, merged)
+        for field, (dtype, shape) in self._fields.items():
+            if field in _SITE_FIELDS or field == GT_FIELD:
+                continue
+            if field.startswith('/calls/'):
+                merged[field] = self._merge_calls(popped, site_rows, field,
+                                                  dtype, shape)
+            else:
+                merged[field] = self._merge_field(popped, site_rows, field,
+                                                  dtype, shape)
+
+        chunk = VariationsArrays()
+        for field, mat in merged.items():
+            chunk[field] = mat
+        chunk._set_samples(self.samples)
+        chunk._set_metadata(self.metadata)
+        return chunk
+
+    def _merge_alleles(self, popped, site_rows, merged):
+        n_sites = site_rows.shape[0]
+        refs = merged[REF_FIELD]
+        alts = numpy.empty((n_sites, 0), dtype=self._fields[ALT_FIELD][0])
+        gts = None
+        if GT_FIELD in self._fields:
+            gt_dtype = self._fields[GT_FIELD][0]
+            gts = numpy.full((n_sites, len(self.samples), self.ploidy),
+                             MISSING_VALUES[gt_dtype], dtype=gt_dtype)
+        for input_idx, (rows, _, _) in enumerate(popped):
+            sites = numpy.flatnonzero(site_rows[:, input_idx] >= 0)
+            if not sites.shape[0]:
+                continue
+            idxs = site_rows[sites, input_idx]
+            input_gts = rows.get(GT_FIELD)
+            if input_gts is None:
+                input_gts = numpy.zeros((sites.shape[0], 0),
+                                        dtype=numpy.int8)
+            else:
+                input_gts = input_gts[idxs]
+            new_alts, new_gts = _merge_snp_alleles(refs[sites], alts[sites],
+                                                   rows['ref'][idxs],
+                                                   _pack_alts(rows['alt'][idxs]),
+                                                   input_gts)
+            if new_alts.shape[1] > alts.shape[1]:
+                alts = _fit_matrix(alts, new_alts.shape[1:], alts.dtype)
+            alts[sites] = _fit_matrix(new_alts, alts.shape[1:], alts.dtype)
+
+            if gts is None or rows.get(GT_FIELD) is None:
+                continue
+            samples = self._sample_cols[input_idx]
+            gts[sites, samples] = new_gts
+            if self._missing_sites == MISSING_SITES_AS_REF:
+                gts[site_rows[:, input_idx] < 0, samples] = 0
+        merged[ALT_FIELD] = alts
+        if gts is not None:
+            merged[GT_FIELD] = gts
+
+    def _merge_calls(self, popped, site_rows, field, dtype, shape):
+        calls = numpy.full((site_rows.shape[0], len(self.samples)) +
+                           shape[1:], MISSING_VALUES[dtype], dtype=dtype)
+        for input_idx, (rows, _, _) in enumerate(popped):
+            if rows.get(field) is None:
+                continue
+            sites = site_rows[:, input_idx] >= 0
+            input_calls = rows[field][site_rows[sites, input_idx]]
+            n_samples = input_calls.shape[1]
+            input_calls = _fit_matrix(input_calls, (n_samples,) + shape[1:],
+                                      dtype)
+            calls[sites, self._sample_cols[input_idx]] = input_calls
+        return calls
+
+    def _merge_field(self, popped, site_rows, field, dtype, shape):
+        n_sites = site_rows.shape[0]
+        funct = self._fields_funct.get(field)
+        if funct is None:
+            # the value of the first variations with the site is kept
+            values = numpy.full((n_sites,) + shape, MISSING_VALUES[dtype],
+                                dtype=dtype)
+            for input_idx in reversed(range(len(popped))):
+                rows = popped[input_idx][0]
+                if rows.get(field) is None:
+                    continue
+                sites = site_rows[:, input_idx] >= 0
+                values[sites] = _fit_matrix(
+                    rows[field][site_rows[sites, input_idx]], shape, dtype)
+            return values
+
+        values = numpy.full((n_sites, len(popped)) + shape, numpy.nan)
+        for input_idx, (rows, _, _) in enumerate(popped):
+            if rows.get(field) is None:
+                continue
+            sites = site_rows[:, input_idx] >= 0
+            input_values = _fit_matrix(rows[field][site_rows[sites,
+                                                             input_idx]],
+                                       shape, dtype).astype(float)
+            if dtype.kind != 'f':
+                input_values[input_values == MISSING_VALUES[dtype]] = \
+                    numpy.nan
+            values[sites, input_idx] = input_values
+        return _reduce_field(values, funct, dtype)
+
+
+def merge_variations(variations, output_variations, fields_funct=None,
+                     ignore_fields=None,
+                     missing_sites=MISSING_SITES_AS_MISSING,
+                     ignore_overlaps=False, ignore_2_or_more_overlaps=False,
+                     chunk_size=SNPS_PER_CHUNK, chrom=None):
+    '''It merges several sorted variations into the output in one pass.
+
+    The variations found in the same position with the same reference in
+    several variations are merged. The sites not found in all variations are
+    kept with missing or reference genotypes or dropped depending on
+    missing_sites.
+    fields_funct maps field names, like qual, to min, max or mean, the
+    values of these fields are reduced, for the rest of the fields the value
+    of the first variations is kept.
+    The overlapping variations, in the same file or between files, raise
+    a NotImplementedError unless they are ignored.
+    If a chrom is given only its variations are merged.
+    It returns a log with the number of sites merged and ignored.
+    '''
+    merger = _MultiVarMerger(variations, fields_funct=fields_funct,
+                             ignore_fields=ignore_fields,
+                             missing_sites=missing_sites,
+                             ignore_overlaps=ignore_overlaps,
+                             ignore_2_or_more_overlaps=ignore_2_or_more_overlaps,
+                             chunk_size=chunk_size)
+    output_variations.put_chunks(merger.iterate_chunks(chrom=chrom))
+    return merger.log
+
+
+def _merge_chrom(chrom, tmp_fpath, in_fpaths, pairwise, chunk_size,
+                 merge_kwargs):
+    in_vars = [VariationsH5(fpath, 'r') for fpath in in_fpaths]
+    out_vars = VariationsH5(tmp_fpath, 'w', storage_profile='fast')
+    try:
+        if pairwise:
+            merger = VarMerger(in_vars[0], in_vars[1], **merge_kwargs)
+            out_vars.put_chunks(merger.iterate_chunks(chunk_size=chunk_size,
+                                                      chrom=chrom))
+            log = merger.log
+        else:
+            log = merge_variations(in_vars, out_vars, chunk_size=chunk_size,
+                                   chrom=chrom, **merge_kwargs)
+    finally:
+        out_vars.close()
+        for vars_ in in_vars:
+            vars_.close()
+    return log
+
+
+def merge_variations_in_parallel(in_fpaths, output_variations,
+                                 n_processes=None, tmp_dir=None,
+                                 pairwise=False, chunk_size=SNPS_PER_CHUNK,
+                                 **merge_kwargs):
+    '''It merges the variations of several HDF5 files by chromosome.
+
+    Every chromosome is merged by a process into a temporary file, with
+    merge_variations or, if pairwise, with the VarMerger of two files. The
+    merge_kwargs are given to them. The temporary files are written to the
+    output in chromosome order.
+    The temporary files are created in a directory inside tmp_dir, which is
+    removed even if a merge fails.
+    It returns the log of all the chromosome merges.
+    '''
+    if pairwise and len(in_fpaths) != 2:
+        raise ValueError('VarMerger merges two files')
+    chroms = set()
+    for fpath in in_fpaths:
+        in_vars = VariationsH5(fpath, 'r')
+        chroms.update(in_vars.pos_index.chroms)
+        in_vars.close()
+    # the merged variations are sorted by chrom name
+    chroms = sorted(chroms)
+
+    _partial_merge_chrom = functools.partial(_merge_chrom,
+                                             in_fpaths=in_fpaths,
+                                             pairwise=pairwise,
+                                             chunk_size=chunk_size,
+                                             merge_kwargs=merge_kwargs)
+    work_dir = mkdtemp(suffix='.merge', dir=tmp_dir)
+    try:
+        # Every chrom has its file from the start, so the files of the
+        # merges not collected yet are also removed
+        chrom_fpaths = [(chrom, os.path.join(work_dir,
+                                             '{}.h5'.format(idx)))
+                        for idx, chrom in enumerate(chroms)]
+        if n_processes is None:
+            logs = [_partial_merge_chrom(chrom, fpath)
+                    for chrom, fpath in chrom_fpaths]
+        else:
+            with Pool(n_processes) as pool:
+                logs = pool.starmap(_partial_merge_chrom, chrom_fpaths)
+
+        log = Counter()
+        for chrom_log in logs:
+            log.update(chrom_log)
+        tmp_vars = [VariationsH5(fpath, 'r') for _, fpath in chrom_fpaths]
+        try:
+            output_variations.put_chunks(chain.from_iterable(
+                vars_.iterate_chunks(chunk_size=chunk_size)
+                for vars_ in tmp_vars))
+        finally:
+            for vars_ in tmp_vars:
+                vars_.close()
+    finally:
+        shutil.rmtree(work_dir)
+    return log
+
+
+def _check_same_sites(chunks):
+    first = chunks[0]
+    for chunk in chunks[1:]:
+        if chunk.num_variations != first.num_variations:
+            raise ValueError('The variations should have the same sites')
+        for field in _SITE_FIELDS:
+            mat1, mat2 = first[field], chunk[field]
+            if field == ALT_FIELD and mat1.shape != mat2.shape:
+                shape = (max(mat1.shape[1], mat2.shape[1]),)
+                mat1 = _fit_matrix(mat1, shape, mat1.dtype)
+                mat2 = _fit_matrix(mat2, shape, mat2.dtype)
+            differ = numpy.flatnonzero(mat1 != mat2
+                                       if mat1.ndim == 1 else
+                                       numpy.any(mat1 != mat2, axis=1))
+            if differ.shape[0]:
+                row = differ[0]
+                msg = 'The variations differ in {}, chrom: {} pos: {}'
+                raise ValueError(msg.format(field, first[CHROM_FIELD][row],
+                                            first[POS_FIELD][row]))
+
+
+def concat_samples(variations, output_variations, chunk_size=SNPS_PER_CHUNK):
+    '''It puts side by side the samples of variations with the same sites.
+
+    All the variations should have the chrom, position, ref and alt fields.
+    The chroms, positions and alleles of the variations are checked chunk by
+    chunk, the variations fields are copied from the first variations and the
+    calls of all the variations are concatenated.
+    '''
+    for idx, vars_ in enumerate(variations):
+        fields = vars_.keys()
+        for field in _SITE_FIELDS:
+            if field not in fields:
+                msg = 'The variations {} (counting from 0) lack the field {}'
+                raise ValueError(msg.format(idx, field))
+    samples = []
+    for vars_ in variations:
+        samples.extend(vars_.samples)
+    if len(set(samples)) != len(samples):
+        raise ValueError('The samples of the variations should differ')
+    if len(set(vars_.num_variations for vars_ in variations)) > 1:
+        raise ValueError('The variations should have the same sites')
+    call_fields = {}
+    for vars_ in variations:
+        for field in vars_.keys():
+            if not field.startswith('/calls/'):
+                continue
+            mat = vars_[field]
+            dtype, shape = call_fields.get(field, (mat.dtype, mat.shape[2:]))
+            shape = tuple(max(dims) for dims in zip(shape, mat.shape[2:]))
+            call_fields[field] = (numpy.result_type(dtype, mat.dtype), shape)
+    metadata = {}
+    for vars_ in variations:
+        for field, field_meta in vars_.metadata.items():
+            metadata.setdefault(field, field_meta)
+
+    def _concat_chunks():
+        first_fields = variations[0].keys()
+        readers = [variations[0].iterate_chunks(chunk_size=chunk_size)]
+        readers.extend(vars_.iterate_chunks(
+            kept_fields=[field for field in vars_.keys()
+                         if field in _SITE_FIELDS or
+                         field.startswith('/calls/')],
+            chunk_size=chunk_size) for vars_ in variations[1:])
+        for chunks in zip(*readers):
+            _check_same_sites(chunks)
+            concat = VariationsArrays()
+            for field in first_fields:
+                if not field.startswith('/calls/'):
+                    concat[field] = chunks[0][field]
+            for field, (dtype, shape) in call_fields.items():
+                calls = []
+                for chunk in chunks:
+                    n_samples = len(chunk.samples)
+                    if field in chunk.keys():
+                        calls.append(_fit_matrix(chunk[field],
+                                                 (n_samples,) + shape, dtype))
+                    else:
+                        calls.append(numpy.full((chunk.num_variations,
+                                                 n_samples) + shape,
+                                                MISSING_VALUES[dtype],
+                                                dtype=dtype))
+                concat[field] = numpy.concatenate(calls, axis=1)
+            concat._set_samples(samples)
+            concat._set_metadata(metadata)
+            yield concat
+
+    output_variations.put_chunks(_concat_chunks())
@@ -0,0 +1,127 @@
+import numpy
+
+from variation import CHROM_FIELD, POS_FIELD
+
+# Missing docstring
+# pylint: disable=C0111
+
+# sorted: the variations are sorted by chrom name and position, as
+# sort_variations does.
+# grouped: every chrom is in one block of variations sorted by position,
+# as in a VCF, the chroms are kept in the order they were found.
+# unique_positions: no chrom and position are repeated, only known for the
+# grouped variations.
+# None means unknown.
+ORDER_STATUS_KEYS = ('sorted', 'grouped', 'unique_positions')
+
+
+def _to_json_chrom(chrom):
+    if isinstance(chrom, bytes):
+        return chrom.decode('latin1')
+    return str(chrom)
+
+
+def _from_json_chrom(chrom):
+    return chrom.encode('latin1')
+
+
+class OrderTracker():
+    '''It tracks the order of the variations while they are written.
+
+    The chunks are checked as they are written, so only the last chrom and
+    position and the chroms found are kept between chunks.
+    '''
+    def __init__(self, status=None):
+        if status is None:
+            status = {'sorted': True, 'grouped': True,
+                      'unique_positions': True, 'chroms': [],
+                      'last_chrom': None, 'last_pos': None}
+        self.sorted = status['sorted']
+        self.grouped = status['grouped']
+        self.unique_positions = status['unique_positions']
+        self.chroms = status.get('chroms')
+        self._chrom_set = set(self.chroms) if self.chroms else set()
+        last_chrom = status.get('last_chrom')
+        if last_chrom is not None:
+            last_chrom = _from_json_chrom(last_chrom)
+        self._last_chrom = last_chrom
+        self._last_pos = status.get('last_pos')
+
+    @classmethod
+    def unknown(cls):
+        return cls({key: None for key in ORDER_STATUS_KEYS})
+
+    @property
+    def is_known(self):
+        return self.sorted is not None
+
+    def to_dict(self):
+        status = {'sorted': self.sorted, 'grouped': self.grouped,
+                  'unique_positions': self.unique_positions,
+                  'chroms': self.chroms if self.grouped else None,
+                  'last_chrom': None, 'last_pos': self._last_pos}
+        if self._last_chrom is not None:
+            status['last_chrom'] = _to_json_chrom(self._last_chrom)
+        return status
+
+    def _set_unknown(self):
+        self.sorted, self.grouped, self.unique_positions = None, None, None
+        self.chroms, self._chrom_set = None, set()
+
+    def update(self, chroms, poss):
+        'It updates the status with the chroms and positions of a chunk'
+        if not self.is_known:
+            return
+        if chroms is None or poss is None:
+            self._set_unknown()
+            return
+        chroms = numpy.asarray(chroms)
+        poss = numpy.asarray(poss)
+        if not chroms.shape[0]:
+            return
+        if self._last_chrom is not None:
+            chroms = numpy.append(numpy.array([self._last_chrom]), chroms)
+            poss = numpy.append(self._last_pos, poss)
+        same_chrom = chroms[1:] == chroms[:-1]
+        pos_increases = poss[1:] >= poss[:-1]
+
+        if self.sorted:
+            self.sorted = bool(numpy.all((chroms[1:] > chroms[:-1]) |
+                                         (same_chrom & pos_increases)))
+        if self.grouped:
+            self._update_grouped(chroms, same_chrom, pos_increases)
+        if self.grouped:
+            if self.unique_positions:
+                self.unique_positions = not bool(numpy.any(
+                    same_chrom & (poss[1:] == poss[:-1])))
+        else:
+            self.unique_positions = None
+        self._last_chrom = chroms[-1].item()
+        self._last_pos = int(poss[-1])
+
+    def _update_grouped(self, chroms, same_chrom, pos_increases):
+        if not numpy.all(pos_increases | numpy.logical_not(same_chrom)):
+            self.grouped = False
+            self.chroms, self._chrom_set = None, set()
+            return
+        new_chroms = [_to_json_chrom(chrom) for chrom in
+                      chroms[1:][numpy.logical_not(same_chrom)]]
+        if self._last_chrom is None:
+            new_chroms.insert(0, _to_json_chrom(chroms[0]))
+        if (len(set(new_chroms)) != len(new_chroms) or
+                self._chrom_set.intersection(new_chroms)):
+            self.grouped = False
+            self.chroms, self._chrom_set = None, set()
+            return
+        self.chroms.extend(new_chroms)
+        self._chrom_set.update(new_chroms)
+
+
+def calc_order_status(variations, chunk_size=None):
+    'It reads the chroms and positions to calculate the order status'
+    tracker = OrderTracker()
+    for chunk in variations.iterate_chunks(kept_fields=[CHROM_FIELD,
+                                                        POS_FIELD],
+                                           chunk_size=chunk_size):
+        tracker.update(chunk[CHROM_FIELD], chunk[POS_FIELD])
+    return tracker
@@ -1,15 +1,203 @@
 
 import itertools
+import json
+import time
+import tracemalloc
+from functools import partial
+from multiprocessing import Pool
 
 import numpy
 
 from variation import SNPS_PER_CHUNK
+from variation.iterutils import group_in_packets
+from variation.variations.vars_matrices import VariationsH5
 from variation.variations.filters import (COUNTS, EDGES, FLT_VARS, FLT_STATS,
                                           N_KEPT, TOT, N_FILTERED_OUT,
-                                          SELECTED_VARS)
+                                          SELECTED_VARS, HIST_SKETCH)
 from collections import OrderedDict
 from variation.variations.annotation import ANNOTATED_VARS
 
+# The chunks given at once to every worker, so only a few chunks are read
+# ahead of the ones written
+CHUNKS_PER_WORKER = 2
+
+# In the fused mode the filtered variations are copied once more than this
+# fraction of them has been filtered out, so the following stats are not
+# calculated for them
+MIN_FUSED_KEPT_FRACTION = 0.5
+
+# The measures of every step in every chunk travel in the step results
+STEP_PROFILE = 'step_profile'
+PROFILE_MEASURES = ('wall_time', 'cpu_time', 'rows_in', 'rows_out',
+                    'bytes_materialized', 'peak_memory')
+
+# The pipeline and the variations used by every worker process
+_WORKER_STATE = {}
+
+
+def _calc_chunk_nbytes(chunk):
+    return sum(chunk[path].nbytes for path in chunk.keys())
+
+
+class _StepProfiler():
+    'It measures the time and memory taken by a step or by the reading'
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+
+    def start(self):
+        memory = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        return time.perf_counter(), time.process_time(), memory
+
+    def stop(self, start):
+        wall_start, cpu_start, memory = start
+        measures = {'wall_time': time.perf_counter() - wall_start,
+                    'cpu_time': time.process_time() - cpu_start}
+        if memory is not None:
+            measures['peak_memory'] = tracemalloc.get_traced_memory()[1] - memory
+        return measures
+
+    def stop_step(self, start, rows_in, rows_out, materialized_chunk=None):
+        measures = self.stop(start)
+        measures['rows_in'] = rows_in
+        measures['rows_out'] = rows_out
+        measures['bytes_materialized'] = (0 if materialized_chunk is None else
+                                          _calc_chunk_nbytes(materialized_chunk))
+        return measures
+
+
+class PipelineProfile():
+    '''It collects, for every step of a Pipeline run, the time and memory
+    taken and the variations and bytes that go through it.
+
+    The time taken reading the chunks and writing the output variations is
+    kept apart. The peak memory, the increase of the memory allocated while
+    the step runs, is only measured if trace_memory is True, because
+    tracing the memory slows the run down.
+    '''
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.steps = OrderedDict()
+        self.read = None
+        self.write = None
+        self.wall_time = None
+
+    def _start(self, pipeline):
+        self.steps = OrderedDict()
+        for step in pipeline:
+            measures = {measure: 0 for measure in PROFILE_MEASURES}
+            if not self.trace_memory:
+                measures['peak_memory'] = None
+            measures['name'] = step['name']
+            measures['n_chunks'] = 0
+            self.steps[step['id']] = measures
+        self.read = {'n_chunks': 0, 'wall_time': 0, 'cpu_time': 0}
+        self.write = {'n_chunks': 0, 'wall_time': 0, 'cpu_time': 0}
+        self.wall_time = 0
+
+    def _add_step_measures(self, step_id, measures):
+        step_measures = self.steps[step_id]
+        step_measures['n_chunks'] += 1
+        for measure, value in measures.items():
+            if measure == 'peak_memory':
+                step_measures[measure] = max(step_measures[measure], value)
+            else:
+                step_measures[measure] += value
+
+    @staticmethod
+    def _add_measures(io_measures, measures):
+        io_measures['n_chunks'] += 1
+        io_measures['wall_time'] += measures['wall_time']
+        io_measures['cpu_time'] += measures['cpu_time']
+
+    def to_dict(self):
+        return {'wall_time': self.wall_time, 'read': dict(self.read),
+                'write': dict(self.write),
+                'steps': [dict(measures, id=step_id)
+                          for step_id, measures in self.steps.items()]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_table(self):
+        header = ('step', 'name', 'chunks', 'wall (s)', 'cpu (s)', 'rows in',
+                  'rows out', 'MB copied', 'peak MB')
+        rows = []
+        for step_id, measures in self.steps.items():
+            peak = measures['peak_memory']
+            rows.append((step_id, measures['name'], measures['n_chunks'],
+                         '%.3f' % measures['wall_time'],
+                         '%.3f' % measures['cpu_time'], measures['rows_in'],
+                         measures['rows_out'],
+                         '%.2f' % (measures['bytes_materialized'] / 2 ** 20),
+                         '-' if peak is None else '%.2f' % (peak / 2 ** 20)))
+        for id_, measures in (('read', self.read), ('write', self.write)):
+            rows.append((id_, '', measures['n_chunks'],
+                         '%.3f' % measures['wall_time'],
+                         '%.3f' % measures['cpu_time'], '', '', '', ''))
+        rows.append(('total', '', '', '%.3f' % self.wall_time, '', '', '', '',
+                     ''))
+        rows = [header] + [tuple(str(item) for item in row) for row in rows]
+        widths = [max(len(row[col]) for row in rows)
+                  for col in range(len(header))]
+        lines = ['  '.join(item.ljust(width) if col < 2 else item.rjust(width)
+                           for col, (item, width) in enumerate(zip(row,
+                                                                   widths)))
+                 for row in rows]
+        lines.insert(1, '-' * len(lines[0]))
+        return '\n'.join(lines) + '\n'
+
+
+def _iterate_timed(items, profiler, measures):
+    'It yields the items adding the time taken to get each one'
+    items = iter(items)
+    while True:
+        start = profiler.start()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        measures.append(profiler.stop(start))
+        yield item
+
+
+def _init_worker(pipeline, fused, fpath, kept_fields, ignored_fields,
+                 profiler):
+    _WORKER_STATE['pipeline'] = pipeline
+    _WORKER_STATE['fused'] = fused
+    _WORKER_STATE['profiler'] = profiler
+    _WORKER_STATE['vars_in'] = None if fpath is None else VariationsH5(fpath,
+                                                                       'r')
+    _WORKER_STATE['kept_fields'] = kept_fields
+    _WORKER_STATE['ignored_fields'] = ignored_fields
+
+
+def _run_pipeline_in_worker(chunk):
+    # The chunk is a slice to read if the workers read the file
+    vars_in = _WORKER_STATE['vars_in']
+    profiler = _WORKER_STATE['profiler']
+    read_measures = None
+    if vars_in is not None:
+        if profiler is not None:
+            start = profiler.start()
+        chunk = vars_in.get_chunk(chunk,
+                                  kept_fields=_WORKER_STATE['kept_fields'],
+                                  ignored_fields=_WORKER_STATE['ignored_fields'])
+        if profiler is not None:
+            read_measures = profiler.stop(start)
+    results, chunk = _WORKER_STATE['pipeline']._pipeline_funct(
+        chunk, _WORKER_STATE['fused'], profiler)
+    return results, chunk, read_measures
+
+
+def _can_be_read_by_workers(vars_in):
+    return (isinstance(vars_in, VariationsH5) and
+            vars_in._h5file.mode == 'r')
+
 
 class Pipeline():
     def __init__(self):
@@ -25,7 +213,9 @@ class Pipeline():
                 'order': len(self._pipeline)}
         self._pipeline.append(step)
 
-    def _pipeline_funct(self, chunk):
+    def _pipeline_funct(self, chunk, fused=False, profiler=None):
+        if fused:
+            return self._fused_pipeline_funct(chunk, profiler)
         results = []
         for step in self._pipeline:
             # This for should be more internal than the for for the HDF5
@@ -36,6 +226,8 @@ class Pipeline():
                 continue
 
             callable_instance = step['callable']
+            if profiler is not None:
+                start, chunk_in = profiler.start(), chunk
             result = callable_instance(chunk)
             if FLT_VARS in result:
                 chunk = result[FLT_VARS]
@@ -43,15 +235,94 @@ class Pipeline():
             elif ANNOTATED_VARS in result:
                 chunk = result[ANNOTATED_VARS]
                 del result[ANNOTATED_VARS]
+            if profiler is not None and isinstance(result, dict):
+                result[STEP_PROFILE] = profiler.stop_step(
+                    start, chunk_in.num_variations, chunk.num_variations,
+                    None if chunk is chunk_in else chunk)
 
             results.append(result)
         return results, chunk
 
-    def _reduce_results(self, results, vars_out):
+    def _fused_pipeline_funct(self, chunk, profiler=None):
+        '''It runs the pipeline keeping a mask of the variations kept.
+
+        The filters that support it update the mask and the variations are
+        only copied for the steps that need them, when most of them have
+        been filtered out and at the end.
+        '''
+        results = []
+        mask = None
+        for step in self._pipeline:
+            n_kept = (chunk.num_variations if mask is None else
+                      numpy.count_nonzero(mask))
+            if n_kept == 0:
+                continue
+
+            callable_instance = step['callable']
+            if profiler is not None:
+                start, chunk_in, rows_in = profiler.start(), chunk, n_kept
+            if getattr(callable_instance, 'can_filter_mask', False):
+                if mask is None:
+                    mask = numpy.ones((chunk.num_variations,),
+                                      dtype=numpy.bool_)
+                result, mask = callable_instance.filter_mask(chunk, mask)
+                n_kept = numpy.count_nonzero(mask)
+                if n_kept < mask.shape[0] * MIN_FUSED_KEPT_FRACTION:
+                    chunk = chunk.get_chunk(mask)
+                    mask = None
+            else:
+                if mask is not None:
+                    chunk = chunk.get_chunk(mask)
+                    mask = None
+                result = callable_instance(chunk)
+                if FLT_VARS in result:
+                    chunk = result.pop(FLT_VARS)
+                elif ANNOTATED_VARS in result:
+                    chunk = result.pop(ANNOTATED_VARS)
+                n_kept = chunk.num_variations
+            if profiler is not None and isinstance(result, dict):
+                result[STEP_PROFILE] = profiler.stop_step(
+                    start, int(rows_in), int(n_kept),
+                    None if chunk is chunk_in else chunk)
+            results.append(result)
+
+        if mask is not None and not numpy.all(mask):
+            chunk = chunk.get_chunk(mask)
+        return results, chunk
+
+    def _flush_pipeline(self):
+        '''It runs the variations held back by the steps through the rest of
+        the pipeline'''
+        for step_idx, step in enumerate(self._pipeline):
+            flush = getattr(step['callable'], 'flush', None)
+            if flush is None:
+                continue
+            result = flush()
+            if FLT_VARS not in result:
+                continue
+            chunk = result.pop(FLT_VARS)
+            results = [{}] * step_idx + [result]
+            for next_step in self._pipeline[step_idx + 1:]:
+                if chunk.num_variations == 0:
+                    break
+                result = next_step['callable'](chunk)
+                if FLT_VARS in result:
+                    chunk = result.pop(FLT_VARS)
+                elif ANNOTATED_VARS in result:
+                    chunk = result.pop(ANNOTATED_VARS)
+                results.append(result)
+            yield results, chunk
+
+    def _reduce_results(self, results, vars_out, profile=None):
         result = OrderedDict()
         for slice_result, chunk in results:
             if vars_out is not None:
+                if profile is not None:
+                    start = _StepProfiler().start()
                 vars_out.put_chunks([chunk])
+                if profile is not None:
+                    profile._add_measures(profile.write,
+                                          _StepProfiler().stop(start))
             for step_result, step in zip(slice_result, self._pipeline):
                 step_id = step['id']
                 callable_instance = step['callable']
@@ -59,6 +330,10 @@ class Pipeline():
                 if step_id not in result:
                     result[step_id] = {'name': step['name'],
                                        'order': step['order']}
+                if STEP_PROFILE in step_result:
+                    measures = step_result.pop(STEP_PROFILE)
+                    if profile is not None:
+                        profile._add_step_measures(step_id, measures)
 
                 if not hasattr(callable_instance, 'do_histogram'):
                     do_hist = False
@@ -66,7 +341,13 @@ class Pipeline():
                     do_hist = callable_instance.do_histogram
                 if not step_result:
                     continue
-                if do_hist:
+                if do_hist and HIST_SKETCH in step_result:
+                    if HIST_SKETCH not in result[step_id]:
+                        result[step_id][HIST_SKETCH] = step_result[HIST_SKETCH]
+                    else:
+                        result[step_id][HIST_SKETCH].merge(
+                                                    step_result[HIST_SKETCH])
+                elif do_hist:
                     if COUNTS not in result[step_id]:
                         result[step_id][COUNTS] = step_result[COUNTS]
                         result[step_id][EDGES] = step_result[EDGES]
@@ -92,18 +373,40 @@ class Pipeline():
                         result[step_id][FLT_STATS][N_KEPT] += n_kept
                         result[step_id][FLT_STATS][TOT] += tot
                         result[step_id][FLT_STATS][N_FILTERED_OUT] += flt_out
+
+        # The histograms are built once all the chunks have been sketched
+        for step in self._pipeline:
+            step_result = result.get(step['id'], {})
+            if HIST_SKETCH in step_result:
+                sketch = step_result.pop(HIST_SKETCH)
+                counts, edges = sketch.histogram(step['callable'].n_bins)
+                step_result[COUNTS] = counts
+                step_result[EDGES] = edges
         return result
 
-    def _check_and_fix_histogram_ranges(self, vars_in, chunk_size, kept_fields,
-                                        ignored_fields):
-        callables_to_check = []
+    def _set_histogram_sketches(self, sketch_histogram):
+        '''It makes the steps that support it sketch their histograms when
+        their range is not known.
+
+        It returns the steps with no sketches and no range.
+        '''
+        callables_with_no_range = []
         for step in self._pipeline:
             callable_instance = step['callable']
-            if not hasattr(callable_instance, 'do_histogram'):
+            if (not getattr(callable_instance, 'do_histogram', False) or
+                    callable_instance.range is not None):
                 continue
-            if (callable_instance.do_histogram and
-               callable_instance.range is None):
-                callables_to_check.append(callable_instance)
+            if hasattr(callable_instance, 'sketch_histogram'):
+                callable_instance.sketch_histogram = sketch_histogram
+            else:
+                callables_with_no_range.append(callable_instance)
+        return callables_with_no_range
+
+    def _check_and_fix_histogram_ranges(self, vars_in, chunk_size, kept_fields,
+                                        ignored_fields):
+        # Only the steps that can not sketch their histograms need a pass to
+        # find the range
+        callables_to_check = self._set_histogram_sketches(True)
         if not callables_to_check:
             return
 
@@ -133,19 +436,109 @@ class Pipeline():
             callable_instance.do_filtering = original_do_filterings[idx]
             callable_instance.range = mins[idx], maxs[idx]
 
+    def _map_in_workers(self, vars_in, chunk_size, kept_fields,
+                        ignored_fields, max_chunks_to_process, n_workers,
+                        fused, profile=None):
+        '''It runs the pipeline for every chunk in a pool of processes.
+
+        The results are yielded in the order of the chunks. The workers read
+        the chunks from the HDF5 file if it is open only to read, otherwise
+        the chunks are sent to them.
+        '''
+        if _can_be_read_by_workers(vars_in):
+            fpath = vars_in.fpath
+            chunks = (slice(start, start + chunk_size)
+                      for start in range(0, vars_in.num_variations,
+                                         chunk_size))
+        else:
+            fpath = None
+            chunks = vars_in.iterate_chunks(kept_fields=kept_fields,
+                                            ignored_fields=ignored_fields,
+                                            chunk_size=chunk_size)
+        if max_chunks_to_process:
+            chunks = itertools.islice(chunks, max_chunks_to_process)
+        profiler = None
+        if profile is not None:
+            profiler = _StepProfiler(profile.trace_memory)
+            read_measures = []
+            if fpath is None:
+                chunks = _iterate_timed(chunks, _StepProfiler(),
+                                        read_measures)
+
+        with Pool(n_workers, initializer=_init_worker,
+                  initargs=(self, fused, fpath, kept_fields,
+                            ignored_fields, profiler)) as pool:
+            for packet in group_in_packets(chunks,
+                                           n_workers * CHUNKS_PER_WORKER):
+                for results, chunk, worker_read in pool.imap(
+                        _run_pipeline_in_worker, packet):
+                    if profile is not None:
+                        if worker_read is not None:
+                            read_measures.append(worker_read)
+                        for measures in read_measures:
+                            profile._add_measures(profile.read, measures)
+                        del read_measures[:]
+                    yield results, chunk
+
     def run(self, vars_in, vars_out=None, chunk_size=SNPS_PER_CHUNK,
-            kept_fields=None, ignored_fields=None, max_chunks_to_process=None):
+            kept_fields=None, ignored_fields=None, max_chunks_to_process=None,
+            n_workers=None, fused=False, profile=None):
+        '''It runs the pipeline for every chunk of vars_in.
+
+        If a PipelineProfile is given as profile, it gets the measures of
+        the run.
+        '''
+
+        if n_workers is not None and n_workers > 1:
+            for step in self._pipeline:
+                if hasattr(step['callable'], 'flush'):
+                    msg = 'The step %s holds variations between chunks, '
+                    msg += 'it can not be run in parallel'
+                    raise ValueError(msg % step['id'])
+
+        profiler = None
+        if profile is not None:
+            profile._start(self._pipeline)
+            profiler = _StepProfiler(profile.trace_memory)
+            was_tracing = tracemalloc.is_tracing()
+            run_start = profiler.start()
 
         self._check_and_fix_histogram_ranges(vars_in, chunk_size,
                                              kept_fields=kept_fields,
                                              ignored_fields=ignored_fields)
 
-        chunks = vars_in.iterate_chunks(kept_fields=kept_fields,
-                                        ignored_fields=ignored_fields,
-                                        chunk_size=chunk_size)
-        if max_chunks_to_process:
-            chunks = itertools.islice(chunks, max_chunks_to_process)
-
-        results_and_chunks = map(self._pipeline_funct, chunks)
+        if n_workers is not None and n_workers > 1:
+            results_and_chunks = self._map_in_workers(vars_in, chunk_size,
+                                                      kept_fields,
+                                                      ignored_fields,
+                                                      max_chunks_to_process,
+                                                      n_workers, fused,
+                                                      profile)
+        else:
+            chunks = vars_in.iterate_chunks(kept_fields=kept_fields,
+                                            ignored_fields=ignored_fields,
+                                            chunk_size=chunk_size)
+            if max_chunks_to_process:
+                chunks = itertools.islice(chunks, max_chunks_to_process)
+            if profile is not None:
+                read_measures = []
+                chunks = _iterate_timed(chunks, _StepProfiler(),
+                                        read_measures)
+            results_and_chunks = map(partial(self._pipeline_funct,
+                                             fused=fused, profiler=profiler),
+                                     chunks)
 
-        return self._reduce_results(results_and_chunks, vars_out)
+        results_and_chunks = itertools.chain(results_and_chunks,
+                                             self._flush_pipeline())
+        try:
+            return self._reduce_results(results_and_chunks, vars_out,
+                                        profile)
+        finally:
+            self._set_histogram_sketches(False)
+            if profile is not None:
+                if n_workers is None or n_workers <= 1:
+                    for measures in read_measures:
+                        profile._add_measures(profile.read, measures)
+                profile.wall_time = profiler.stop(run_start)['wall_time']
+                if profile.trace_memory and not was_tracing:
+                    tracemalloc.stop()
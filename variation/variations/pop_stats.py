@@ -26,7 +26,8 @@ STAT_FUNCTION_METADATA = {'calc_number_of_alleles': {'required_fields': [GT_FIEL
                           'calc_number_of_alleles_and_number_called_gts': {'required_fields': [GT_FIELD],
                                                                            'stat_name': 'number_of_alleles_and_called_gts'},
                           'calc_number_of_private_alleles': {'required_fields': [GT_FIELD],
-                                                             'stat_name': 'number_of_private_alleles'},
+                                                             'stat_name': 'number_of_private_alleles',
+                                                             'all_samples_required': True},
                           'calc_major_allele_freq': {'required_fields': [GT_FIELD],
                                                      'stat_name': 'major_allele_freq'},
                           'calc_exp_het': {'required_fields': [GT_FIELD],
@@ -183,8 +184,16 @@ def calc_pop_stats(variations, populations, pop_stat_functions,
                     (kwarg != 'min_call_dp' and kwarg in funct_metadata['optional_fields'])):
                     kept_fields.update(funct_metadata['optional_fields'][kwarg])
 
+    all_samples_required = any(STAT_FUNCTION_METADATA[funct_name].get('all_samples_required', False)
+                               for funct_name in pop_stat_functions)
+    if all_samples_required:
+        samples = None
+    else:
+        # Only the samples in the populations are read
+        samples = set(itertools.chain(*populations.values()))
     chunks = variations.iterate_chunks(kept_fields=kept_fields,
-                                       chunk_size=chunk_size)
+                                       chunk_size=chunk_size,
+                                       samples=samples)
     results_per_stat = {}
 
     for chunk in chunks:
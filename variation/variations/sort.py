@@ -1,56 +1,145 @@
-
-import itertools
-from array import array
+import os
+from tempfile import NamedTemporaryFile
 
 import numpy
 
-from variation.matrix.methods import is_dataset
+from variation import CHROM_FIELD, POS_FIELD, SNPS_PER_SORT_RUN
+from variation.matrix.categorical import is_categorical
+from variation.variations.vars_matrices import VariationsH5, concat_chunks
 
+# The chrom rank goes in the high bits of the sort keys and the position,
+# made positive, in the low ones
+_POS_OFFSET = 2 ** 31
 
-def _calc_sort_order(variations):
-    chrom = variations['/variations/chrom']
-    pos = variations['/variations/pos']
-    idx_order = numpy.lexsort((pos, chrom))
-    return idx_order
 
+def _get_chrom_sort_keys(variations, index):
+    chrom = variations[CHROM_FIELD]
+    # The encoded chroms are sorted by the rank of their codes
+    if is_categorical(chrom):
+        return chrom.sort_keys(index)
+    return chrom[index]
 
-def _calc_sort_order_by_chrom(variations):
-    chrom = variations['/variations/chrom']
-    if is_dataset(chrom):
-        chrom = chrom[:]
-    pos = variations['/variations/pos']
-    chrom_names = numpy.sort(numpy.unique(chrom))
-    for chrom_name in chrom_names:
-        mask = chrom == chrom_name
-        snps_in_chrom_idx = numpy.where(mask)[0]
-        pos_chrom = pos[mask]
-        sorted_idx = numpy.lexsort((pos_chrom,), axis=0)
-        sorted_snps_in_chrom_idx = snps_in_chrom_idx[sorted_idx]
-        yield sorted_snps_in_chrom_idx
 
+def _get_chrom_names(variations, run):
+    chrom = variations[CHROM_FIELD]
+    if is_categorical(chrom):
+        return chrom.unique()
+    return numpy.unique(run[CHROM_FIELD])
 
-def _sorted_chunks(n_snps, chunk_size, idx_order, variations):
-    for _ in range(0, n_snps, chunk_size):
-        idx = array('L', itertools.islice(idx_order, chunk_size))
-        yield variations.get_chunk(idx)
 
+def _calc_sort_keys(chunk, chrom_names):
+    ranks = numpy.searchsorted(chrom_names, chunk[CHROM_FIELD])
+    poss = chunk[POS_FIELD].astype(numpy.int64) + _POS_OFFSET
+    return (ranks.astype(numpy.int64) << 32) | poss
 
-def sort_variations(variations, output_variations):
-    if True:
-        idx_order = itertools.chain(*_calc_sort_order_by_chrom(variations))
-        n_snps = variations.num_variations
-        chunk_size = variations._vars_in_chunk
-        chunks = _sorted_chunks(n_snps, chunk_size, idx_order, variations)
-        output_variations.put_chunks(chunks)
-    else:
-        # This algorithm sorts all snps at the same time, it does not
-        # iterate over the chromosomes
-        # We haven't tested if it is faster or slower than iterating over the
-        # chromosomes. What we do know is that iterating over the chromosomes
-        # should take less memory
-        idx_order = _calc_sort_order(variations)
-        n_snps = variations.num_variations
-        chunk_size = variations._vars_in_chunk
-        chunks = (variations.get_chunk(idx_order[i: i + chunk_size])
-                  for i in range(0, n_snps, chunk_size))
+
+def _create_tmp_fpath(tmp_dir):
+    fhand = NamedTemporaryFile(suffix='.sort_run.h5', dir=tmp_dir)
+    fpath = fhand.name
+    fhand.close()
+    return fpath
+
+
+def _sort_in_runs(variations, run_size, tmp_dir, runs):
+    # The runs are added to the given list as soon as they are created, so
+    # the caller can remove them if the sorting fails
+    chrom_names = []
+    for start in range(0, variations.num_variations, run_size):
+        rows = slice(start, start + run_size)
+        run = variations.get_chunk(rows)
+        chrom_keys = _get_chrom_sort_keys(variations, rows)
+        run = run.get_chunk(numpy.lexsort((run[POS_FIELD], chrom_keys)))
+        chrom_names.append(_get_chrom_names(variations, run))
+        if run_size >= variations.num_variations:
+            # everything fits in memory, there is nothing to spill
+            runs.append(run)
+            break
+        run_h5 = VariationsH5(_create_tmp_fpath(tmp_dir), 'w',
+                              storage_profile='fast')
+        runs.append(run_h5)
+        run_h5.put_chunks([run])
+    return numpy.unique(numpy.concatenate(chrom_names))
+
+
+class _RunCursor():
+    'It reads a sorted run in blocks and keeps the sort keys of the block'
+    def __init__(self, run, block_size, chrom_names):
+        self._chunks = run.iterate_chunks(chunk_size=block_size)
+        self._chrom_names = chrom_names
+        self.block = None
+        self.keys = None
+        self._fill()
+
+    def _fill(self):
+        self.block, self.keys = None, None
+        for chunk in self._chunks:
+            if chunk.num_variations:
+                self.block = chunk
+                self.keys = _calc_sort_keys(chunk, self._chrom_names)
+                break
+
+    def pop_until(self, max_key):
+        'It returns the rows of the block with a key up to max_key'
+        n_rows = int(numpy.searchsorted(self.keys, max_key, side='right'))
+        if n_rows == self.keys.shape[0]:
+            rows, keys = self.block, self.keys
+            self._fill()
+        else:
+            rows = self.block.get_chunk(slice(0, n_rows))
+            keys = self.keys[:n_rows]
+            self.block = self.block.get_chunk(slice(n_rows, None))
+            self.keys = self.keys[n_rows:]
+        return rows, keys
+
+
+def _merge_runs(runs, chrom_names, run_size, like):
+    '''It yields the chunks of the k-way merge of the sorted runs.
+
+    In every step the rows up to the smallest last key of the blocks are
+    taken from every block, so those rows are final and they are sorted at
+    once.
+    '''
+    block_size = max(run_size // len(runs), 1)
+    cursors = [_RunCursor(run, block_size, chrom_names) for run in runs]
+    while True:
+        cursors = [cursor for cursor in cursors if cursor.keys is not None]
+        if not cursors:
+            break
+        max_key = min(cursor.keys[-1] for cursor in cursors)
+        pieces = [cursor.pop_until(max_key) for cursor in cursors]
+        pieces = [(rows, keys) for rows, keys in pieces if keys.shape[0]]
+        chunk = concat_chunks([rows for rows, _ in pieces], like)
+        keys = numpy.concatenate([keys for _, keys in pieces])
+        # the stable sort keeps the order of the rows with equal keys
+        yield chunk.get_chunk(numpy.argsort(keys, kind='mergesort'))
+
+
+def sort_variations(variations, output_variations, run_size=SNPS_PER_SORT_RUN,
+                    tmp_dir=None):
+    '''It writes the variations sorted by chrom and position.
+
+    The variations are read sequentially in runs of run_size variations that
+    are sorted in memory and spilled to temporary files, then the runs are
+    merged. The sorted variations are just copied, the order status kept by
+    the variations is used to know it.
+    '''
+    chunk_size = variations._vars_in_chunk
+    if variations.order_status['sorted']:
+        output_variations.put_chunks(variations.iterate_chunks(
+            chunk_size=chunk_size))
+        return
+
+    runs = []
+    try:
+        chrom_names = _sort_in_runs(variations, run_size, tmp_dir, runs)
+        if len(runs) == 1:
+            chunks = runs[0].iterate_chunks(chunk_size=chunk_size)
+        else:
+            chunks = _merge_runs(runs, chrom_names, run_size, variations)
         output_variations.put_chunks(chunks)
+    finally:
+        for run in runs:
+            if hasattr(run, 'fpath'):
+                fpath = run.fpath
+                run.close()
+                os.remove(fpath)
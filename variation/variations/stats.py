@@ -15,13 +15,16 @@ from variation import (MISSING_VALUES, SNPS_PER_CHUNK, DEF_MIN_DEPTH,
                        MISSING_INT, GT_FIELD, ALT_FIELD, DP_FIELD,
                        GQ_FIELD, CHROM_FIELD, POS_FIELD, RO_FIELD, AO_FIELD,
                        MIN_NUM_GENOTYPES_FOR_POP_STAT, AD_FIELD)
-from variation.matrix.stats import (counts_by_row, counts_and_allels_by_row,
+from variation.matrix.stats import (counts_and_allels_by_row,
                                     row_value_counter_fact)
 from variation.matrix.methods import (is_missing, calc_min_max,
                                       is_dataset, iterate_matrix_chunks)
 from variation.plot import _estimate_percentiles_from_distrib
 
 DEF_NUM_BINS = 20
+# The distinct values kept by the histogram sketches before their values are
+# rounded
+MAX_SKETCH_VALUES = 2 ** 16
 
 REQUIRED_FIELDS_FOR_STAT = {'calc_maf': [GT_FIELD],
                             'calc_allele_freq': [GT_FIELD],
@@ -33,7 +36,37 @@ REQUIRED_FIELDS_FOR_STAT = {'calc_maf': [GT_FIELD],
                             'calc_obs_het_by_sample': [GT_FIELD]}
 
 
-def _calc_histogram(vector, n_bins, range_, weights=None):
+def _get_cached_stat(variations, key, calc_stat):
+    try:
+        get_cached_stat = variations.get_cached_stat
+    except AttributeError:
+        # The variations can be just a dict with the matrices
+        return calc_stat()
+    return get_cached_stat(key, calc_stat)
+
+
+def _get_allele_counts(variations, missing_value=None, alleles=None):
+    'It returns the allele counts by row and the alleles counted'
+    gts = variations[GT_FIELD]
+    key = ('allele_counts', missing_value,
+           None if alleles is None else tuple(alleles))
+    return _get_cached_stat(variations, key,
+                            lambda: counts_and_allels_by_row(
+                                gts, missing_value=missing_value,
+                                alleles=alleles))
+
+
+def _get_missing_calls(variations):
+    'It returns which calls have any missing allele'
+    def calc_missing_calls():
+        gts = variations[GT_FIELD]
+        if is_dataset(gts):
+            gts = gts[:]
+        return numpy.any(gts == MISSING_VALUES[int], axis=2)
+    return _get_cached_stat(variations, ('missing_calls',), calc_missing_calls)
+
+
+def _remove_missing_values(vector):
     try:
         dtype = vector.dtype
     except AttributeError:
@@ -43,13 +76,18 @@ def _calc_histogram(vector, n_bins, range_, weights=None):
     if is_dataset(vector):
         vector = vector[:]
 
-    if weights is None:
-        if math.isnan(missing_value):
-            not_nan = ~numpy.isnan(vector)
-        else:
-            not_nan = vector != missing_value
+    if math.isnan(missing_value):
+        not_nan = ~numpy.isnan(vector)
+    else:
+        not_nan = vector != missing_value
+    return vector[not_nan]
+
 
-        vector = vector[not_nan]
+def _calc_histogram(vector, n_bins, range_, weights=None):
+    if weights is None:
+        vector = _remove_missing_values(vector)
+    elif is_dataset(vector):
+        vector = vector[:]
     try:
         result = numpy.histogram(vector, bins=n_bins, range=range_,
                                  weights=weights)
@@ -71,6 +109,72 @@ def histogram(vector, n_bins=DEF_NUM_BINS, range_=None, weights=None):
     return _calc_histogram(vector, n_bins, range_=range_, weights=weights)
 
 
+class HistogramSketch():
+    '''A mergeable summary of a vector to build its histogram once all the
+    chunks are seen, without knowing its range in advance.
+
+    It keeps the distinct values and their counts, so the histogram is the
+    one of the whole vector. If there are more than max_values distinct
+    values, they are rounded to a grid with a power of two step, so the
+    grids of different sketches fit, and the rounding only moves the values
+    that lie next to a bin edge.
+    '''
+    def __init__(self, vector=None, max_values=MAX_SKETCH_VALUES):
+        self.max_values = max_values
+        self.values = numpy.array([], dtype=numpy.float64)
+        self.counts = numpy.array([], dtype=numpy.int64)
+        # None while the values are exact
+        self.step = None
+        if vector is not None:
+            self.add(vector)
+
+    def _round(self, values):
+        if self.step is None:
+            return values
+        return numpy.round(values / self.step) * self.step
+
+    def _set_counts(self, values, counts):
+        self.values, idxs = numpy.unique(values, return_inverse=True)
+        self.counts = numpy.bincount(idxs, weights=counts,
+                                     minlength=self.values.shape[0])
+        self.counts = self.counts.astype(numpy.int64)
+
+    def _coarsen(self):
+        if self.step is None:
+            max_abs = numpy.max(numpy.abs(self.values))
+            # the grid has around half max_values steps up to the max value
+            exponent = numpy.frexp(max_abs)[1] if max_abs else 0
+            self.step = 2.0 ** (exponent + 2 -
+                                int(numpy.log2(self.max_values)))
+        else:
+            self.step *= 2
+        self._set_counts(self._round(self.values), self.counts)
+
+    def _add_counts(self, values, counts):
+        self._set_counts(numpy.concatenate([self.values, self._round(values)]),
+                         numpy.concatenate([self.counts, counts]))
+        while self.values.shape[0] > self.max_values:
+            self._coarsen()
+
+    def add(self, vector):
+        vector = _remove_missing_values(vector)
+        vector = vector[~numpy.isinf(vector)].astype(numpy.float64)
+        values, counts = numpy.unique(vector, return_counts=True)
+        self._add_counts(values, counts)
+
+    def merge(self, sketch):
+        if sketch.step is not None and (self.step is None or
+                                        sketch.step > self.step):
+            self.step = sketch.step
+            self._set_counts(self._round(self.values), self.counts)
+        self._add_counts(sketch.values, sketch.counts)
+
+    def histogram(self, n_bins=DEF_NUM_BINS):
+        counts, edges = numpy.histogram(self.values, bins=n_bins,
+                                        weights=self.counts)
+        return counts.astype(numpy.int64), edges
+
+
 def calc_cum_distrib(distrib):
     if len(distrib.shape) == 1:
         return numpy.fliplr(numpy.cumsum(numpy.fliplr([distrib]), axis=1))[0]
@@ -147,13 +251,14 @@ def _calc_range(vectors):
 
 
 def _calc_mac(variations, min_num_genotypes=MIN_NUM_GENOTYPES_FOR_POP_STAT):
-    gt_counts, alleles = counts_and_allels_by_row(variations[GT_FIELD])
+    gt_counts, alleles = _get_allele_counts(variations)
     if gt_counts is None:
         return numpy.array([])
 
     if MISSING_INT in alleles:
         missing_allele_idx = alleles.index(MISSING_INT)
         num_missing = numpy.copy(gt_counts[:, missing_allele_idx])
+        gt_counts = numpy.copy(gt_counts)
         gt_counts[:, missing_allele_idx] = 0
     else:
         num_missing = 0
@@ -168,8 +273,7 @@ def _calc_mac(variations, min_num_genotypes=MIN_NUM_GENOTYPES_FOR_POP_STAT):
 
 
 def _calc_maf(variations, min_num_genotypes=MIN_NUM_GENOTYPES_FOR_POP_STAT):
-    gts = variations[GT_FIELD]
-    gt_counts = counts_by_row(gts, missing_value=MISSING_INT)
+    gt_counts = _get_allele_counts(variations, missing_value=MISSING_INT)[0]
     if gt_counts is None:
         return numpy.array([])
     max_ = numpy.amax(gt_counts, axis=1)
@@ -365,9 +469,7 @@ def calc_missing_gt(variations, rates=True, axis=1):
     gts = variations[GT_FIELD]
     if gts.shape[0] == 0:
         return numpy.array([])
-    if is_dataset(gts):
-        gts = gts[:]
-    missing = numpy.any(gts == MISSING_VALUES[int], axis=2).sum(axis=axis)
+    missing = _get_missing_calls(variations).sum(axis=axis)
     if rates:
         num_items_per_row = gts.shape[axis]
         result = missing / num_items_per_row
@@ -389,6 +491,13 @@ def calc_called_gt(variations, rates=True, axis=1):
 
 
 def _call_is_het(variations, min_call_dp, max_call_dp=None):
+    return _get_cached_stat(variations,
+                            ('call_is_het', min_call_dp, max_call_dp),
+                            lambda: _calc_call_is_het(variations, min_call_dp,
+                                                      max_call_dp))
+
+
+def _calc_call_is_het(variations, min_call_dp, max_call_dp=None):
     is_hom, is_missing = _call_is_hom(variations, min_call_dp,
                                       max_call_dp=max_call_dp)
     if is_hom.shape[0] == 0:
@@ -403,6 +512,13 @@ def call_is_het(gts):
 
 
 def _call_is_hom(variations, min_call_dp, max_call_dp=None):
+    return _get_cached_stat(variations,
+                            ('call_is_hom', min_call_dp, max_call_dp),
+                            lambda: _calc_call_is_hom(variations, min_call_dp,
+                                                      max_call_dp))
+
+
+def _calc_call_is_hom(variations, min_call_dp, max_call_dp=None):
     gts = variations[GT_FIELD]
 
     if gts.shape[0] == 0:
@@ -416,7 +532,7 @@ def _call_is_hom(variations, min_call_dp, max_call_dp=None):
         is_hom = numpy.logical_and(gts[:, :, idx] == gts[:, :, idx - 1],
                                    is_hom)
 
-    missing_gts = is_missing(gts, axis=2)
+    missing_gts = _get_missing_calls(variations)
 
     if min_call_dp or max_call_dp:
         dps = variations[DP_FIELD]
@@ -743,10 +859,6 @@ def calc_snp_density(variations, window):
         yield snps_in_win
 
 
-def _calc_allele_counts(gts, alleles=None):
-    return counts_by_row(gts, MISSING_VALUES[int], alleles=alleles)
-
-
 def calc_allele_freq(variations, alleles=None,
                      min_num_genotypes=MIN_NUM_GENOTYPES_FOR_POP_STAT):
     gts = variations[GT_FIELD]
@@ -754,7 +866,9 @@ def calc_allele_freq(variations, alleles=None,
     if gts.shape[0] == 0:
         return numpy.array([])
 
-    allele_counts = _calc_allele_counts(gts, alleles=alleles)
+    allele_counts = _get_allele_counts(variations,
+                                       missing_value=MISSING_VALUES[int],
+                                       alleles=alleles)[0]
     if allele_counts is None:
         raise ValueError('No alleles, everything is missing data')
     total_counts = numpy.sum(allele_counts, axis=1)
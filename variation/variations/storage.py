@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import posixpath
+from functools import partial
+from multiprocessing import Pool
+
+import numpy
+import h5py
+
+from variation import STORAGE_PROFILES, SNPS_PER_CHUNK, HIDDEN_GROUPS_PREFIX
+from variation.variations.vars_matrices import (VariationsH5,
+                                                get_storage_profile,
+                                                _get_hdf5_dset_paths)
+
+# Missing docstring
+# pylint: disable=C0111
+
+ACCESS_PATTERNS = ('chunks', 'fields', 'random')
+DEF_BENCHMARK_NUM_SNPS = 10000
+DEF_NUM_RANDOM_READS = 100
+
+
+def _read_chunks(variations, kept_fields, chunk_size, n_random_reads):
+    for _ in variations.iterate_chunks(kept_fields=kept_fields,
+                                       chunk_size=chunk_size):
+        pass
+
+
+def _read_random_rows(variations, kept_fields, chunk_size, n_random_reads):
+    n_snps = variations.num_variations
+    # the same rows for every profile
+    random_state = numpy.random.RandomState(42)
+    starts = random_state.randint(0, n_snps, size=n_random_reads)
+    for start in starts:
+        variations.get_chunk(slice(start, start + 1), kept_fields=kept_fields)
+
+
+_READERS = {'chunks': _read_chunks,
+            'fields': _read_chunks,
+            'random': _read_random_rows}
+
+
+def _benchmark_profile(sample, profile, fpath, access_pattern, kept_fields,
+                       chunk_size, n_random_reads):
+    time_start = time.time()
+    variations = VariationsH5(fpath, 'w', storage_profile=profile)
+    variations.put_chunks(sample.iterate_chunks(chunk_size=chunk_size))
+    variations.close()
+    write_time = time.time() - time_start
+    size = os.path.getsize(fpath)
+
+    variations = VariationsH5(fpath, 'r')
+    time_start = time.time()
+    _READERS[access_pattern](variations, kept_fields, chunk_size,
+                             n_random_reads)
+    read_time = time.time() - time_start
+    variations.close()
+    return {'size': size, 'write_time': write_time, 'read_time': read_time}
+
+
+def benchmark_storage_profiles(variations, profiles=None,
+                               access_pattern='chunks', kept_fields=None,
+                               num_snps=DEF_BENCHMARK_NUM_SNPS,
+                               chunk_size=SNPS_PER_CHUNK,
+                               n_random_reads=DEF_NUM_RANDOM_READS,
+                               tmp_dir=None):
+    '''It writes and reads a sample of the variations with every profile.
+
+    The access pattern can be: chunks (iterate over all fields), fields
+    (iterate over the kept_fields) or random (read random rows).
+    It returns a list with the profile, size, write_time and read_time for
+    every profile.
+    '''
+    if access_pattern not in ACCESS_PATTERNS:
+        raise ValueError('Unknown access pattern: ' + access_pattern)
+    if access_pattern == 'fields' and not kept_fields:
+        raise ValueError('The fields access pattern requires kept_fields')
+    if profiles is None:
+        profiles = sorted(STORAGE_PROFILES)
+    for profile in profiles:
+        # we fail before writing anything if a profile is wrong
+        get_storage_profile(profile)
+
+    sample = variations.get_chunk(slice(0, num_snps))
+    tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+    results = []
+    try:
+        for idx, profile in enumerate(profiles):
+            fpath = os.path.join(tmp_dir, '{}.h5'.format(idx))
+            result = _benchmark_profile(sample, profile, fpath,
+                                        access_pattern=access_pattern,
+                                        kept_fields=kept_fields,
+                                        chunk_size=chunk_size,
+                                        n_random_reads=n_random_reads)
+            result['profile'] = profile
+            results.append(result)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def recommend_storage_profile(results, objective='read_time'):
+    'It returns the best profile for the objective: read_time, write_time, size'
+    if objective not in ('read_time', 'write_time', 'size'):
+        raise ValueError('Unknown objective: ' + objective)
+    best = min(results, key=lambda result: (result[objective], result['size']))
+    return best['profile']
+
+
+def apply_storage_profile(variations, out_fpath, profile, chunk_size=None):
+    out_vars = VariationsH5(out_fpath, 'w', storage_profile=profile)
+    out_vars.put_chunks(variations.iterate_chunks(chunk_size=chunk_size))
+    return out_vars
+
+
+def _read_all_chunks(fpath, chunk_size):
+    variations = VariationsH5(fpath, 'r')
+    time_start = time.time()
+    _read_chunks(variations, kept_fields=None, chunk_size=chunk_size,
+                 n_random_reads=None)
+    read_time = time.time() - time_start
+    variations.close()
+    return read_time
+
+
+def _repack_field(path, in_fpath, tmp_dir, storage_profile, chunk_size):
+    in_h5 = h5py.File(in_fpath, 'r')
+    in_dset = in_h5[path]
+    fpath = os.path.join(tmp_dir, path.strip('/').replace('/', '_') + '.h5')
+    out_vars = VariationsH5(fpath, 'w', storage_profile=storage_profile)
+    out_dset = out_vars._create_matrix(path, shape=in_dset.shape,
+                                       dtype=in_dset.dtype,
+                                       fillvalue=in_dset.fillvalue)
+    # The attrs, like the category table used by an encoded field, are kept
+    for key, value in in_dset.attrs.items():
+        out_dset.attrs[key] = value
+    # The dataset is streamed, it never has to fit in memory
+    for start in range(0, in_dset.shape[0], chunk_size):
+        stop = start + chunk_size
+        out_dset[start:stop, ...] = in_dset[start:stop, ...]
+    out_vars.close()
+    in_h5.close()
+    return fpath
+
+
+def _check_repacked_field(in_dset, out_dset, chunk_size):
+    if in_dset.shape != out_dset.shape or in_dset.dtype != out_dset.dtype:
+        return False
+    for start in range(0, in_dset.shape[0], chunk_size):
+        stop = start + chunk_size
+        in_mat = in_dset[start:stop, ...]
+        out_mat = out_dset[start:stop, ...]
+        equal_nan = in_mat.dtype.kind == 'f'
+        if not numpy.array_equal(in_mat, out_mat, equal_nan=equal_nan):
+            return False
+    return True
+
+
+def repack_h5(in_fpath, out_fpath, storage_profile=None, n_processes=None,
+              chunk_size=SNPS_PER_CHUNK, verify=True, tmp_dir=None):
+    '''It writes every field of the HDF5 file into a new compact file.
+
+    Every field is repacked in its own process, with the given storage
+    profile (by default the one used by the input file), into a temporary
+    file and then copied into the output file.
+    It returns a report with the sizes and the times required to read both
+    files.
+    '''
+    with h5py.File(in_fpath, 'r') as in_h5:
+        paths = []
+        _get_hdf5_dset_paths(paths, in_h5)
+        if storage_profile is None and 'storage_profile' in in_h5.attrs:
+            storage_profile = json.loads(in_h5.attrs['storage_profile'])
+    if storage_profile is None:
+        storage_profile = 'default'
+    storage_profile = get_storage_profile(storage_profile)
+
+    tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+    _partial_repack_field = partial(_repack_field, in_fpath=in_fpath,
+                                    tmp_dir=tmp_dir,
+                                    storage_profile=storage_profile,
+                                    chunk_size=chunk_size)
+    in_h5, out_h5 = None, None
+    try:
+        if n_processes is None:
+            tmp_fpaths = list(map(_partial_repack_field, paths))
+        else:
+            with Pool(n_processes) as pool:
+                tmp_fpaths = pool.map(_partial_repack_field, paths)
+
+        in_h5 = h5py.File(in_fpath, 'r')
+        out_h5 = h5py.File(out_fpath, 'w-')
+        for key, value in in_h5.attrs.items():
+            out_h5.attrs[key] = value
+        out_h5.attrs['storage_profile'] = json.dumps(storage_profile)
+        for path, tmp_fpath in zip(paths, tmp_fpaths):
+            tmp_h5 = h5py.File(tmp_fpath, 'r')
+            group_name, dset_name = posixpath.split(path)
+            group = out_h5.require_group(group_name)
+            tmp_h5.copy(tmp_h5[path], group, name=dset_name)
+            tmp_h5.close()
+        # The data derived from the fields is copied as it is
+        for group in in_h5.values():
+            if group.name.startswith(HIDDEN_GROUPS_PREFIX):
+                in_h5.copy(group, out_h5)
+
+        if verify:
+            for path in paths:
+                if not _check_repacked_field(in_h5[path], out_h5[path],
+                                             chunk_size):
+                    msg = 'The repacked field differs from the original: '
+                    raise RuntimeError(msg + path)
+    finally:
+        if out_h5 is not None:
+            out_h5.close()
+        if in_h5 is not None:
+            in_h5.close()
+        shutil.rmtree(tmp_dir)
+
+    report = {'in_size': os.path.getsize(in_fpath),
+              'out_size': os.path.getsize(out_fpath),
+              'in_read_time': _read_all_chunks(in_fpath, chunk_size),
+              'out_read_time': _read_all_chunks(out_fpath, chunk_size)}
+    return report
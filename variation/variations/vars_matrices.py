@@ -1,20 +1,50 @@
+import os
+import struct
 import posixpath
 import json
 import copy
+import time
 from collections import Counter, defaultdict
 import warnings
 import random
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 import numpy
 import h5py
 
 from variation import (SNPS_PER_CHUNK, MISSING_VALUES, DEF_DSET_PARAMS,
+                       STORAGE_PROFILES, PACKED_GT_FIELD, CATEGORIES_GROUP,
+                       FINGERPRINTS_GROUP,
+                       CATEGORICAL_FIELDS, CHROM_RUN_ENDS_FIELD,
+                       POS_BLOCKS_FIELD, RAGGED_OFFSETS_GROUP,
+                       HIDDEN_GROUPS_PREFIX, IN_MEMORY_BATCH_BYTES,
                        MISSING_INT, CHROM_FIELD, POS_FIELD, ID_FIELD,
                        REF_FIELD, ALT_FIELD, QUAL_FIELD, GT_FIELD)
 from variation.iterutils import first, group_items
-from variation.matrix.stats import counts_by_row
+from variation.matrix.stats import counts_by_row, counts_and_allels_by_row
 from variation.matrix.methods import is_dataset, concat_matrices, resize_array
+from variation.matrix.packed_gts import PackedGTs, CALLS_PER_BYTE
+from variation.matrix.categorical import (CategoryTable, CategoricalMatrix,
+                                         is_categorical, CODES_DTYPE,
+                                         MISSING_CODE)
+from variation.matrix.coord_codecs import (RunLengthMatrix, DeltaBlocksMatrix,
+                                          encode_runs, encode_delta_blocks,
+                                          decode_delta_block, N_BLOCK_COLS,
+                                          N_ROWS, ROW_START, BYTE_START,
+                                          POS_BLOCK_SIZE)
+from variation.matrix.ragged import RaggedMatrix, encode_ragged
+from variation.matrix.chunked_dir import (ChunkedDirArray, CHUNK_CODECS,
+                                          DEF_CHUNK_CODEC, DEF_CHUNK_LEVEL,
+                                          create_chunked_dir, is_chunked_dir,
+                                          write_atomically)
+from variation.matrix.h5_chunks import (read_rows_direct, write_rows_direct,
+                                        supports_direct_chunk_io)
 from variation.variations.index import PosIndex
+from variation.variations.order import (OrderTracker, calc_order_status,
+                                        ORDER_STATUS_KEYS)
+from variation.variations.fingerprint import (calc_fingerprints,
+                                              calc_chunk_fingerprints)
 from variation.gt_writers.vcf import write_vcf
 
 # Missing docstring
@@ -61,6 +91,70 @@ def _dset_metadata_from_matrix(mat):
     return shape, dtype, chunks, maxshape, fillvalue
 
 
+CODECS = ('gzip', 'lzf', None)
+PROFILE_OPTIONS = ('codec', 'level', 'shuffle', 'checksum', 'chunks')
+
+
+def get_storage_profile(profile):
+    if isinstance(profile, str):
+        try:
+            profile = STORAGE_PROFILES[profile]
+        except KeyError:
+            raise ValueError('Unknown storage profile: ' + profile)
+    profile = copy.deepcopy(profile)
+    for field_options in profile.values():
+        for option, value in field_options.items():
+            if option not in PROFILE_OPTIONS:
+                raise ValueError('Unknown storage profile option: ' + option)
+            if option == 'codec' and value == 'none':
+                field_options[option] = None
+        if field_options.get('codec') not in CODECS:
+            msg = 'Codec not supported: ' + str(field_options.get('codec'))
+            raise ValueError(msg)
+        if field_options.get('chunks') is not None:
+            field_options['chunks'] = tuple(field_options['chunks'])
+    return profile
+
+
+def _get_field_options(profile, path):
+    options = {'codec': None, 'shuffle': False, 'checksum': False}
+    options.update(profile.get('*', {}))
+    # The most specific groups are applied last
+    groups = sorted(key for key in profile
+                    if key.endswith('/') and path.startswith(key))
+    for group in groups:
+        options.update(profile[group])
+    options.update(profile.get(path, {}))
+    return options
+
+
+def _resolve_chunks(chunks, shape):
+    if chunks is None:
+        chunks = (SNPS_PER_CHUNK,)
+    chunks = list(chunks[:len(shape)])
+    chunks.extend([None] * (len(shape) - len(chunks)))
+    resolved = []
+    for idx, (chunk_len, dim_len) in enumerate(zip(chunks, shape)):
+        if chunk_len is None or (idx and dim_len and chunk_len > dim_len):
+            # only the rows can grow beyond the matrix shape
+            chunk_len = dim_len
+        resolved.append(max(chunk_len, 1))
+    return tuple(resolved)
+
+
+def get_dset_params(profile, path, shape):
+    'It returns the h5py create_dataset parameters for the given field'
+    options = _get_field_options(profile, path)
+    codec = options['codec']
+    params = {'compression': codec,
+              'shuffle': options['shuffle'],
+              'fletcher32': options['checksum'],
+              'chunks': _resolve_chunks(options.get('chunks'), shape)}
+    if codec == 'gzip' and options.get('level') is not None:
+        params['compression_opts'] = options['level']
+    return params
+
+
 def _prepare_metadata(vcf_metadata):
     groups = ['INFO', 'FILTER', 'CALLS', 'OTHER']
     meta = {}
@@ -354,6 +448,14 @@ def _fill_chunk_with_snps(chunk, mat_structure, log):
     return mats, good_snp_idxs
 
 
+def _set_read_only(value):
+    if isinstance(value, numpy.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for item in value:
+            _set_read_only(item)
+
+
 class DataNoFitError(Exception):
     pass
 
@@ -635,6 +737,15 @@ class _VariationMatrices():
         self.kept_fields = kept_fields
         self.ignored_fields = ignored_fields
         self._index = None
+        self._order_status = None
+
+    def get_cached_stat(self, key, calc_stat):
+        '''It returns the stat calculated by calc_stat.
+
+        Only the variations in memory keep the stats, the rest calculate
+        them every time.
+        '''
+        return calc_stat()
 
     @property
     def ploidy(self):
@@ -662,7 +773,7 @@ class _VariationMatrices():
             array = matrix[:]
         else:
             array = matrix
-        new_matrix[:] = array
+        self._write_matrix(new_matrix, 0, array)
         return new_matrix
 
     def _create_mats_from_chunks(self, mats_chunks):
@@ -758,13 +869,48 @@ class _VariationMatrices():
             self._set_samples(variations.samples)
         return matrices
 
+    def _get_order_status(self):
+        return self._order_status
+
+    def _set_order_status(self, status):
+        self._order_status = status
+
+    def _get_order_tracker(self):
+        status = self._get_order_status()
+        if status is not None:
+            return OrderTracker(status)
+        if not self.keys():
+            return OrderTracker()
+        if CHROM_FIELD not in self.keys() or POS_FIELD not in self.keys():
+            return OrderTracker.unknown()
+        return calc_order_status(self)
+
+    @property
+    def order_status(self):
+        '''It returns if the variations are sorted, grouped by chrom and have
+        unique positions.
+
+        The status is tracked while the variations are written, if it is not
+        known the chroms and positions are read.
+        '''
+        status = self._get_order_status()
+        if status is None:
+            status = self._get_order_tracker().to_dict()
+            self._set_order_status(status)
+        return {key: status[key] for key in ORDER_STATUS_KEYS}
+
     def put_chunks(self, chunks):
         if chunks is None:
             return
 
+        order_tracker = self._get_order_tracker()
         for chunk in chunks:
             if chunk.num_variations == 0:
                 continue
+            chunk_paths = chunk.keys()
+            order_tracker.update(
+                chunk[CHROM_FIELD] if CHROM_FIELD in chunk_paths else None,
+                chunk[POS_FIELD] if POS_FIELD in chunk_paths else None)
             if not self.keys():
                 self._create_or_get_mats_from_chunk(chunk)
                 continue
@@ -798,45 +944,41 @@ class _VariationMatrices():
                     dset = self._create_matrix_from_matrix(path, dset_chunk)
                     # dset = numpy.full(shape, missing_value, dset_chunk.dtype)
 
-                mat = concat_matrices([dset, dset_chunk],
-                                      missing_value=self._get_missing_value(path),
-                                      if_first_matrix_is_dataset_replace_it=False)
-                if mat is not dset:
-                    self._replace_matrix(path, mat)
+                self._append_to_matrix(path, dset, dset_chunk)
 
+        self._set_order_status(order_tracker.to_dict())
         if hasattr(self, 'flush'):
-            self._h5file.flush()
+            self.flush()
+
+    def _append_to_matrix(self, path, matrix, matrix_chunk):
+        mat = concat_matrices([matrix, matrix_chunk],
+                              missing_value=self._get_missing_value(path),
+                              if_first_matrix_is_dataset_replace_it=False)
+        if mat is not matrix:
+            self._replace_matrix(path, mat)
 
     def get_chunk(self, index, kept_fields=None, ignored_fields=None,
-                  return_copy=False):
+                  return_copy=False, samples=None):
 
         paths = self._filter_fields(kept_fields=kept_fields,
                                     ignored_fields=ignored_fields)
 
         dsets = {field: self[field] for field in paths}
 
+        if samples is None:
+            kept_samples = self.samples
+        else:
+            sample_cols, kept_samples = self._get_sample_cols(samples)
+
         var_array = None
         for path, dset in dsets.items():
+            if samples is not None and path.startswith('/calls/'):
+                matrix = self._read_matrix_for_samples(dset, index,
+                                                       sample_cols)
+            else:
+                matrix = self._read_matrix(dset, index)
             if var_array is None:
-                try:
-                    matrix = dset[index, ...]
-                except UnboundLocalError:
-                    # This is a workaround for an error in h5py
-                    if (isinstance(index, numpy.ndarray) and
-                        numpy.all(index == False)):
-                        matrix = numpy.array([])
-                    else:
-                        raise
                 var_array = VariationsArrays(vars_in_chunk=matrix.shape[0])
-            try:
-                matrix = dset[index, ...]
-            except UnboundLocalError:
-                # This is a workaround for an error in h5py
-                if (isinstance(index, numpy.ndarray) and
-                    numpy.all(index == False)):
-                    matrix = numpy.array([])
-                else:
-                    raise
             if return_copy:
                 matrix = matrix.copy()
             var_array[path] = matrix
@@ -845,10 +987,57 @@ class _VariationMatrices():
             var_array = self.__class__()
 
         var_array._set_metadata(self.metadata)
-        var_array._set_samples(self.samples)
+        var_array._set_samples(kept_samples)
 
         return var_array
 
+    def _get_sample_cols(self, samples):
+        var_samples = self.samples
+        sample_idxs = {sample: idx for idx, sample in enumerate(var_samples)}
+        try:
+            sample_cols = sorted({sample_idxs[sample] for sample in samples})
+        except KeyError as error:
+            raise ValueError('Sample not found in variations: ' +
+                             str(error.args[0]))
+        # The samples are kept in the same order as in the variations
+        kept_samples = [var_samples[col] for col in sample_cols]
+        return numpy.array(sample_cols, dtype=int), kept_samples
+
+    def _read_matrix_for_samples(self, dset, index, sample_cols):
+        if not is_dataset(dset):
+            return self._read_matrix(dset, index)[:, sample_cols]
+
+        # We read, once, the columns spanned by the samples in every chunk
+        # along the sample axis, so the other chunks are not decompressed
+        samples_in_chunk = dset.chunks[1] if dset.chunks else dset.shape[1]
+        chunk_idxs = sample_cols // samples_in_chunk
+        matrices = []
+        for chunk_idx in numpy.unique(chunk_idxs):
+            cols = sample_cols[chunk_idxs == chunk_idx]
+            matrix = dset[index, cols[0]:cols[-1] + 1, ...]
+            matrices.append(matrix[:, cols - cols[0], ...])
+        if not matrices:
+            n_rows = numpy.arange(dset.shape[0])[index].shape[0]
+            return numpy.empty((n_rows, 0) + dset.shape[2:], dtype=dset.dtype)
+        return numpy.concatenate(matrices, axis=1)
+
+    @staticmethod
+    def _read_matrix(dset, index):
+        try:
+            matrix = dset[index, ...]
+        except UnboundLocalError:
+            # This is a workaround for an error in h5py
+            if (isinstance(index, numpy.ndarray) and
+                numpy.all(index == False)):
+                matrix = numpy.array([])
+            else:
+                raise
+        return matrix
+
+    @staticmethod
+    def _write_matrix(matrix, start, array):
+        matrix[start:start + array.shape[0], ...] = array
+
     def get_genome_chunk(self, chrom, start, end):
         # with index
         # bisect
@@ -914,7 +1103,7 @@ class _VariationMatrices():
     def _iterate_chunks(self, kept_fields=None, ignored_fields=None,
                         chunk_size=None, random_sample_rate=1, start=0,
                         stop=None,
-                        return_copy=False):
+                        return_copy=False, samples=None):
         if chunk_size is None:
             chunk_size = self._vars_in_chunk
 
@@ -924,18 +1113,20 @@ class _VariationMatrices():
         for slice_ in slices:
             yield slice_, self.get_chunk(slice_, kept_fields=kept_fields,
                                          ignored_fields=ignored_fields,
-                                         return_copy=return_copy)
+                                         return_copy=return_copy,
+                                         samples=samples)
 
     def iterate_chunks(self, kept_fields=None, ignored_fields=None,
                        chunk_size=None, random_sample_rate=1, start=0,
-                       stop=None, return_copy=False):
+                       stop=None, return_copy=False, samples=None):
         return (chunk for _, chunk in self._iterate_chunks(kept_fields=kept_fields,
                                                            ignored_fields=ignored_fields,
                                                            chunk_size=chunk_size,
                                                            random_sample_rate=random_sample_rate,
                                                            start=start,
                                                            stop=stop,
-                                                           return_copy=return_copy))
+                                                           return_copy=return_copy,
+                                                           samples=samples))
 
     @property
     def pos_index(self):
@@ -958,11 +1149,6 @@ class _VariationMatrices():
             while True:
                 if pos > chrom_end:
                     break
-                try:
-                    index.get_chrom_range_pos(chrom)
-                except IndexError:
-                    # No snps for this chrom
-                    break
                 idx0 = index.index_pos(chrom, pos)
                 idx1 = index.index_pos(chrom, pos + win_size)
                 if chrom_mat[idx0] != chrom:
@@ -996,6 +1182,8 @@ class _VariationMatrices():
     def iterate_chunk_pairs(self, max_dist, kept_fields=None,
                             ignored_fields=None, chunk_size=None,
                             return_copy=False):
+        if self.order_status['grouped'] is False:
+            raise ValueError('The variations should be sorted by position')
 
         for chunk1_slice, chunk1 in self._iterate_chunks(kept_fields=kept_fields,
                                                          ignored_fields=ignored_fields,
@@ -1064,8 +1252,13 @@ class _VariationMatrices():
     def gts_as_mat012(self):
         '''It transforms the GT matrix into 0 (major allele homo), 1 (het),
         2(other hom)'''
+        return self.get_cached_stat(('gts_as_mat012',), self._calc_gts012)
+
+    def _calc_gts012(self):
         gts = self[GT_FIELD]
-        counts = counts_by_row(gts, missing_value=MISSING_INT)
+        counts = self.get_cached_stat(('allele_counts', MISSING_INT, None),
+                                      lambda: counts_and_allels_by_row(
+                                          gts, missing_value=MISSING_INT))[0]
         if counts is None:
             return numpy.full((gts.shape[0], gts.shape[1]),
                               fill_value=MISSING_INT)
@@ -1077,6 +1270,21 @@ class _VariationMatrices():
         gts012[numpy.any(gts == MISSING_INT, axis=2)] = MISSING_INT
         return gts012
 
+    @property
+    def packed_gts(self):
+        return PackedGTs.from_gts(self[GT_FIELD])
+
+    def iterate_packed_gts(self, chunk_size=SNPS_PER_CHUNK):
+        'It yields the 2 bit packed genotypes of every chunk'
+        for chunk in self.iterate_chunks(kept_fields=[GT_FIELD],
+                                         chunk_size=chunk_size):
+            yield chunk.packed_gts
+
+    def get_fingerprints(self, with_gts=False, chunk_size=SNPS_PER_CHUNK):
+        'It returns the fingerprints of the variations by kind'
+        return calc_fingerprints(self, with_gts=with_gts,
+                                 chunk_size=chunk_size)
+
     def get_random_haploid_gts(self):
         gts = self[GT_FIELD]
         num_vars, num_indis, ploidy = gts.shape
@@ -1087,10 +1295,11 @@ class _VariationMatrices():
                   haplo_choice]
         return gts
 
-    def copy(self, variations=None, kept_fields=None):
+    def copy(self, variations=None, kept_fields=None, chunk_size=None):
         if variations is None:
             variations = VariationsArrays()
-        chunks = self.iterate_chunks(kept_fields=kept_fields)
+        chunks = self.iterate_chunks(kept_fields=kept_fields,
+                                     chunk_size=chunk_size)
         variations.put_chunks(chunks)
         return variations
 
@@ -1105,6 +1314,9 @@ def _get_hdf5_dsets(dsets, h5_or_group_or_dset, var_mat):
     if hasattr(item, 'values'):
         # _h5file or group
         for subitem in item.values():
+            if subitem.name.startswith(HIDDEN_GROUPS_PREFIX):
+                # Data derived from the fields, like the packed genotypes
+                continue
             _get_hdf5_dsets(dsets, subitem, var_mat)
     else:
         # dset
@@ -1124,26 +1336,390 @@ class VariationsH5(_VariationMatrices):
 
     def __init__(self, fpath, mode, vars_in_chunk=SNPS_PER_CHUNK,
                  ignore_undefined_fields=False,
-                 kept_fields=None, ignored_fields=None):
+                 kept_fields=None, ignored_fields=None, n_threads=None,
+                 storage_profile=None, categorical=False,
+                 compact_coords=False, ragged_fields=None,
+                 in_memory=False):
         super().__init__(vars_in_chunk=vars_in_chunk,
                          ignore_undefined_fields=ignore_undefined_fields,
                          kept_fields=kept_fields,
                          ignored_fields=ignored_fields)
         self._fpath = fpath
+        # With n_threads the HDF5 chunks are (de)compressed by us in a
+        # thread pool instead of by h5py in the calling thread
+        self.n_threads = n_threads
+        self._pool = None
         if mode not in ('r', 'w', 'r+'):
             msg = 'mode should be r or w'
             raise ValueError(msg)
         elif mode == 'w':
             mode = 'w-'
+        if in_memory and mode != 'r':
+            msg = 'Only the files opened in read mode can be in memory'
+            raise ValueError(msg)
         self.mode = mode
         self._h5file = h5py.File(fpath, mode)
+        # The stored fingerprints and packed gts are valid while the
+        # generation of the file is the one they were written with
+        self._generation_increased = False
+        self._deriving_data = 0
+
+        if storage_profile is not None:
+            if mode == 'r':
+                msg = 'A storage profile can not be set in read mode'
+                raise ValueError(msg)
+            storage_profile = get_storage_profile(storage_profile)
+            self._h5file.attrs['storage_profile'] = json.dumps(storage_profile)
+        elif 'storage_profile' in self._h5file.attrs:
+            storage_profile = json.loads(self._h5file.attrs['storage_profile'])
+            storage_profile = get_storage_profile(storage_profile)
+        self._storage_profile = storage_profile
+
+        # The chrom, ref and alt fields can be stored as integer codes
+        if categorical:
+            if mode == 'r':
+                msg = 'The categorical encoding can not be set in read mode'
+                raise ValueError(msg)
+            self._h5file.attrs['categorical'] = True
+        self._categorical = bool(self._h5file.attrs.get('categorical', False))
+        self._category_tables = {}
+
+        # The chroms can be stored as runs and the positions as deltas
+        if compact_coords:
+            if mode == 'r':
+                msg = 'The compact coordinates can not be set in read mode'
+                raise ValueError(msg)
+            self._h5file.attrs['compact_coords'] = True
+        self._compact_coords = bool(self._h5file.attrs.get('compact_coords',
+                                                           False))
+        self._coord_matrices = {}
+
+        # The fields stored as the items of every row and the row offsets
+        if ragged_fields:
+            if mode == 'r':
+                msg = 'The ragged fields can not be set in read mode'
+                raise ValueError(msg)
+            self._h5file.attrs['ragged_fields'] = json.dumps(
+                sorted(ragged_fields))
+        ragged_fields = self._h5file.attrs.get('ragged_fields', '[]')
+        self._ragged_fields = set(json.loads(ragged_fields))
+        encoded_fields = set()
+        if self._categorical:
+            encoded_fields.update(CATEGORICAL_FIELDS)
+        if self._compact_coords:
+            encoded_fields.update((CHROM_FIELD, POS_FIELD))
+        if encoded_fields.intersection(self._ragged_fields):
+            msg = 'The ragged fields can not use other encoding: '
+            msg += ', '.join(sorted(encoded_fields & self._ragged_fields))
+            raise ValueError(msg)
+        self._ragged_matrices = {}
+
+        # All the fields can be read at once into numpy arrays
+        self._in_memory_arrays = {}
+        self.load_stats = None
+        if in_memory:
+            self.load_stats = self._load_in_memory()
+
+    def _load_dset(self, dset):
+        array = numpy.empty(dset.shape, dtype=dset.dtype)
+        if not dset.shape[0]:
+            return array
+        row_nbytes = max(array.nbytes // dset.shape[0], 1)
+        batch_rows = max(IN_MEMORY_BATCH_BYTES // row_nbytes, 1)
+        if dset.chunks:
+            # whole chunks are read in every batch
+            batch_rows = max(batch_rows // dset.chunks[0], 1) * dset.chunks[0]
+        use_direct = (self.n_threads is not None and
+                      supports_direct_chunk_io(dset))
+        for start in range(0, dset.shape[0], batch_rows):
+            stop = min(start + batch_rows, dset.shape[0])
+            if use_direct:
+                read_rows_direct(dset, start, stop, pool=self.pool,
+                                 out=array[start:stop])
+            else:
+                dset.read_direct(array, numpy.s_[start:stop],
+                                 numpy.s_[start:stop])
+        return array
+
+    def _load_in_memory(self):
+        '''It reads every field into a numpy array.
+
+        It returns the number of fields and bytes read, the seconds taken and
+        the throughput in MB/s.
+        '''
+        start_time = time.time()
+        n_bytes = 0
+        for path in self.keys():
+            matrix = self[path]
+            if is_dataset(matrix):
+                array = self._load_dset(matrix)
+            else:
+                # The encoded fields are decoded once
+                array = numpy.asarray(matrix)
+            self._in_memory_arrays[path] = array
+            n_bytes += array.nbytes
+        seconds = time.time() - start_time
+        mb_per_second = n_bytes / 1024 ** 2 / seconds if seconds else None
+        return {'n_fields': len(self._in_memory_arrays), 'n_bytes': n_bytes,
+                'seconds': seconds, 'mb_per_second': mb_per_second}
+
+    @property
+    def in_memory(self):
+        return bool(self._in_memory_arrays)
 
     def __getitem__(self, path):
         try:
-            return self._h5file[path]
+            return self._in_memory_arrays[path]
+        except KeyError:
+            pass
+        try:
+            dset = self._h5file[path]
         except KeyError:
             msg = 'field not found: ' + path
             raise KeyError(msg)
+        # In a writable file the matrix returned can be written in place
+        self._increase_generation(path)
+        if path in (CHROM_FIELD, POS_FIELD) and 'codec' in dset.attrs:
+            dset = self._get_coord_matrix(path)
+        elif path in CATEGORICAL_FIELDS and 'categories' in dset.attrs:
+            dset = self._get_categorical_matrix(dset)
+        elif path in self._ragged_fields and 'width' in dset.attrs:
+            dset = self._get_ragged_matrix(path)
+        return dset
+
+    def _get_ragged_matrix(self, path):
+        # The offsets are kept in memory
+        try:
+            return self._ragged_matrices[path]
+        except KeyError:
+            pass
+        dset = self._h5file[path]
+        offsets = self._h5file[RAGGED_OFFSETS_GROUP + path][:]
+        as_bytes = bool(dset.attrs['as_bytes'])
+        missing_value = MISSING_VALUES[numpy.bytes_ if as_bytes
+                                       else dset.dtype]
+        matrix = RaggedMatrix(dset, offsets, int(dset.attrs['width']),
+                              missing_value=missing_value, as_bytes=as_bytes)
+        self._ragged_matrices[path] = matrix
+        return matrix
+
+    def _create_ragged_matrix(self, path, matrix):
+        if is_dataset(matrix):
+            matrix = matrix[:]
+        matrix = numpy.asarray(matrix)
+        as_bytes = matrix.dtype.kind == 'S' and matrix.ndim == 1
+        values, _ = encode_ragged(matrix[:0], MISSING_VALUES[matrix.dtype])
+        shape = (0,) + values.shape[1:]
+        fillvalue = 0 if as_bytes else MISSING_VALUES[values.dtype]
+        dset = self._create_matrix(path, shape=shape, dtype=values.dtype,
+                                   chunks=(SNPS_PER_CHUNK,) + shape[1:],
+                                   fillvalue=fillvalue)
+        dset.attrs['width'] = 0
+        dset.attrs['as_bytes'] = as_bytes
+        offsets = self._create_matrix(RAGGED_OFFSETS_GROUP + path, shape=(1,),
+                                      dtype=numpy.int64, fillvalue=0,
+                                      chunks=(SNPS_PER_CHUNK,))
+        offsets[0] = 0
+        self._append_ragged(path, matrix)
+        return self[path]
+
+    def _append_ragged(self, path, matrix):
+        if is_dataset(matrix):
+            matrix = matrix[:]
+        matrix = numpy.asarray(matrix)
+        dset = self._h5file[path]
+        values, lengths = encode_ragged(matrix, MISSING_VALUES[matrix.dtype])
+        if values.shape[1:] != dset.shape[1:]:
+            msg = 'The chunk and the matrix have different shapes: ' + path
+            raise ValueError(msg)
+        if values.dtype.itemsize > dset.dtype.itemsize:
+            # The items do not fit in the dataset, it is rewritten
+            attrs = dict(dset.attrs)
+            old_values = dset[:].astype(values.dtype)
+            del self._h5file[path]
+            dset = self._create_matrix(path, shape=old_values.shape,
+                                       dtype=values.dtype,
+                                       chunks=(SNPS_PER_CHUNK,) +
+                                       old_values.shape[1:],
+                                       fillvalue=MISSING_VALUES[values.dtype])
+            dset[:] = old_values
+            dset.attrs.update(attrs)
+        offsets_dset = self._h5file[RAGGED_OFFSETS_GROUP + path]
+        offsets = offsets_dset[-1] + numpy.cumsum(lengths)
+        self._extend_dset(dset, values)
+        self._extend_dset(offsets_dset, offsets)
+        if lengths.shape[0]:
+            width = max(int(dset.attrs['width']), int(lengths.max()))
+            dset.attrs['width'] = width
+        self._ragged_matrices.pop(path, None)
+
+    def _get_coord_matrix(self, path):
+        # The run and block tables are small, they are kept in memory
+        try:
+            return self._coord_matrices[path]
+        except KeyError:
+            pass
+        dset = self._h5file[path]
+        if path == CHROM_FIELD:
+            matrix = RunLengthMatrix(self._h5file[CHROM_RUN_ENDS_FIELD][:],
+                                     dset[:])
+        else:
+            matrix = DeltaBlocksMatrix(dset, self._h5file[POS_BLOCKS_FIELD][:],
+                                       dtype=_to_str(dset.attrs['dtype']))
+        self._coord_matrices[path] = matrix
+        return matrix
+
+    def _create_coord_dset(self, path, dtype, codec=None):
+        group_name, dset_name = posixpath.split(path)
+        group = self._h5file.require_group(group_name)
+        shape = (0, N_BLOCK_COLS) if path == POS_BLOCKS_FIELD else (0,)
+        dset = group.create_dataset(dset_name, shape=shape, dtype=dtype,
+                                    maxshape=(None,) + shape[1:],
+                                    chunks=(SNPS_PER_CHUNK,) + shape[1:])
+        if codec is not None:
+            dset.attrs['codec'] = codec
+        return dset
+
+    @staticmethod
+    def _extend_dset(dset, array):
+        start = dset.shape[0]
+        dset.resize((start + array.shape[0],) + dset.shape[1:])
+        dset[start:] = array
+
+    def _append_chrom_runs(self, chroms):
+        run_ends, run_values = encode_runs(chroms)
+        values_dset = self._h5file[CHROM_FIELD]
+        ends_dset = self._h5file[CHROM_RUN_ENDS_FIELD]
+        n_rows = ends_dset[-1] if ends_dset.shape[0] else 0
+        run_ends += n_rows
+        if ends_dset.shape[0] and run_values.shape[0]:
+            # The first run continues the last one
+            if values_dset[-1] == run_values[0]:
+                ends_dset[-1] = run_ends[0]
+                run_ends, run_values = run_ends[1:], run_values[1:]
+        if run_values.dtype.itemsize > values_dset.dtype.itemsize:
+            # The names do not fit in the dataset, it is rewritten
+            old_values = values_dset[:].astype(run_values.dtype)
+            del self._h5file[CHROM_FIELD]
+            values_dset = self._create_coord_dset(CHROM_FIELD,
+                                                  run_values.dtype, 'rle')
+            self._extend_dset(values_dset, old_values)
+        self._extend_dset(values_dset, run_values)
+        self._extend_dset(ends_dset, run_ends)
+
+    def _append_pos_blocks(self, poss):
+        stream_dset = self._h5file[POS_FIELD]
+        blocks_dset = self._h5file[POS_BLOCKS_FIELD]
+        n_rows = self[POS_FIELD].shape[0]
+        byte_start = stream_dset.shape[0]
+        n_blocks = blocks_dset.shape[0]
+        if n_blocks and poss.shape[0]:
+            last_block = blocks_dset[-1]
+            if last_block[N_ROWS] < POS_BLOCK_SIZE:
+                tail = decode_delta_block(
+                    stream_dset[last_block[BYTE_START]:], last_block)
+                # The positions continue the last block, so it is encoded
+                # again with them
+                if poss[0] >= tail[-1]:
+                    poss = numpy.append(tail, poss)
+                    n_rows = last_block[ROW_START]
+                    byte_start = last_block[BYTE_START]
+                    stream_dset.resize((byte_start,))
+                    blocks_dset.resize((n_blocks - 1, N_BLOCK_COLS))
+        stream, blocks = encode_delta_blocks(poss, row_start=n_rows,
+                                             byte_start=byte_start)
+        self._extend_dset(stream_dset, stream)
+        self._extend_dset(blocks_dset, blocks)
+
+    def _append_coords(self, path, matrix):
+        if is_dataset(matrix):
+            matrix = matrix[:]
+        if path == CHROM_FIELD:
+            self._append_chrom_runs(numpy.asarray(matrix))
+        else:
+            self._append_pos_blocks(numpy.asarray(matrix))
+        self._coord_matrices.pop(path, None)
+
+    def _create_coord_matrix(self, path, matrix):
+        if path == CHROM_FIELD:
+            dtype = matrix.dtype if matrix.dtype.kind == 'S' else 'S1'
+            self._create_coord_dset(CHROM_FIELD, dtype, 'rle')
+            self._create_coord_dset(CHROM_RUN_ENDS_FIELD, numpy.int64)
+        else:
+            stream_dset = self._create_coord_dset(POS_FIELD, numpy.uint8,
+                                                  'delta')
+            stream_dset.attrs['dtype'] = numpy.dtype(matrix.dtype).str
+            self._create_coord_dset(POS_BLOCKS_FIELD, numpy.int64)
+        self._append_coords(path, matrix)
+        return self[path]
+
+    def _get_category_table(self, name):
+        try:
+            return self._category_tables[name]
+        except KeyError:
+            pass
+        path = posixpath.join(CATEGORIES_GROUP, name)
+        categories = self._h5file[path][:] if path in self._h5file else None
+        table = CategoryTable(categories)
+        self._category_tables[name] = table
+        return table
+
+    def _save_category_table(self, name):
+        table = self._category_tables[name]
+        path = posixpath.join(CATEGORIES_GROUP, name)
+        if path in self._h5file:
+            del self._h5file[path]
+        self._h5file.create_dataset(path, data=table.categories)
+        table.changed = False
+
+    def _get_categorical_matrix(self, dset):
+        name = _to_str(dset.attrs['categories'])
+        return CategoricalMatrix(dset, self._get_category_table(name),
+                                 on_change=partial(self._save_category_table,
+                                                   name))
+
+    def _create_matrix_from_matrix(self, path, matrix):
+        if path in self._ragged_fields:
+            return self._create_ragged_matrix(path, matrix)
+        if self._compact_coords and path in (CHROM_FIELD, POS_FIELD):
+            return self._create_coord_matrix(path, matrix)
+        if not self._categorical or path not in CATEGORICAL_FIELDS:
+            return super()._create_matrix_from_matrix(path, matrix)
+        name = CATEGORICAL_FIELDS[path]
+        table = self._get_category_table(name)
+        codes = table.encode(matrix[:] if is_dataset(matrix) else matrix)
+        chunks = _dset_metadata_from_matrix(codes)[2]
+        dset = self._create_matrix(path, shape=codes.shape, dtype=CODES_DTYPE,
+                                   chunks=chunks, fillvalue=MISSING_CODE)
+        dset.attrs['categories'] = name
+        self._write_matrix(dset, 0, codes)
+        if table.changed:
+            self._save_category_table(name)
+        return self._get_categorical_matrix(dset)
+
+    def _append_to_categorical_matrix(self, matrix, matrix_chunk):
+        if is_dataset(matrix_chunk):
+            matrix_chunk = matrix_chunk[:]
+        codes = matrix.table.encode(matrix_chunk)
+        dset = matrix.codes
+        if codes.ndim != dset.ndim:
+            msg = 'The chunk and the matrix have different dimensions'
+            raise ValueError(msg)
+        # The codes matrix grows in every dimension, the new cells are
+        # filled with the missing code
+        start = dset.shape[0]
+        shape = (start + codes.shape[0],)
+        shape += tuple(max(dim, chunk_dim) for dim, chunk_dim in
+                       zip(dset.shape[1:], codes.shape[1:]))
+        dset.resize(shape)
+        if codes.shape[1:] == shape[1:]:
+            self._write_matrix(dset, start, codes)
+        else:
+            index = (slice(start, shape[0]),)
+            index += tuple(slice(0, dim) for dim in codes.shape[1:])
+            dset[index] = codes
+        if matrix.table.changed:
+            self._save_category_table(_to_str(dset.attrs['categories']))
 
     def keys(self):
         dsets = []
@@ -1154,12 +1730,204 @@ class VariationsH5(_VariationMatrices):
         self._h5file.flush()
 
     def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._in_memory_arrays = {}
         self._h5file.close()
 
+    @property
+    def pool(self):
+        if self.n_threads is None:
+            return None
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        return self._pool
+
+    def _read_matrix(self, dset, index):
+        if is_categorical(dset):
+            return dset.table.decode(self._read_matrix(dset.codes, index))
+        if (self.n_threads is not None and is_dataset(dset) and
+                isinstance(index, slice) and
+                index.step in (None, 1) and supports_direct_chunk_io(dset)):
+            start, stop, _ = index.indices(dset.shape[0])
+            return read_rows_direct(dset, start, stop, pool=self.pool)
+        return super()._read_matrix(dset, index)
+
+    def _get_generation(self):
+        return int(self._h5file.attrs.get('generation', 0))
+
+    def _increase_generation(self, path=None):
+        'It invalidates the stored data derived from the fields'
+        if (self.mode == 'r' or self._generation_increased or
+                self._deriving_data or
+                (path is not None and path.startswith(HIDDEN_GROUPS_PREFIX))):
+            return
+        self._h5file.attrs['generation'] = self._get_generation() + 1
+        self._generation_increased = True
+
+    def _set_derived_data_valid(self, dset_or_group):
+        dset_or_group.attrs['generation'] = self._get_generation()
+        # The fields that were written before are not written again
+        self._generation_increased = False
+
+    def _is_derived_data_valid(self, dset_or_group):
+        return dset_or_group.attrs.get('generation') == self._get_generation()
+
+    def _write_matrix(self, matrix, start, array):
+        self._increase_generation(getattr(matrix, 'name', None))
+        if (self.n_threads is not None and is_dataset(matrix) and
+                supports_direct_chunk_io(matrix)):
+            write_rows_direct(matrix, start, array, pool=self.pool)
+        else:
+            super()._write_matrix(matrix, start, array)
+
+    def _append_to_matrix(self, path, matrix, matrix_chunk):
+        self._increase_generation(path)
+        if is_categorical(matrix):
+            self._append_to_categorical_matrix(matrix, matrix_chunk)
+            return
+        if isinstance(matrix, (RunLengthMatrix, DeltaBlocksMatrix)):
+            self._append_coords(path, matrix_chunk)
+            return
+        if isinstance(matrix, RaggedMatrix):
+            self._append_ragged(path, matrix_chunk)
+            return
+        # When the chunk fits in the dataset we can resize it and write the
+        # new rows, so that they are compressed in the pool
+        if (self.n_threads is None or not is_dataset(matrix) or
+                is_dataset(matrix_chunk) or
+                matrix.shape[1:] != matrix_chunk.shape[1:] or
+                not numpy.can_cast(matrix_chunk.dtype, matrix.dtype)):
+            super()._append_to_matrix(path, matrix, matrix_chunk)
+            return
+        start = matrix.shape[0]
+        matrix.resize((start + matrix_chunk.shape[0],) + matrix.shape[1:])
+        self._write_matrix(matrix, start, matrix_chunk)
+
     @property
     def fpath(self):
         return self._h5file.filename
 
+    def _get_stored_packed_gts(self):
+        if PACKED_GT_FIELD not in self._h5file:
+            return None
+        packed = self._h5file[PACKED_GT_FIELD]
+        # The stored packed gts are not used if the GTs have been written
+        # since
+        if not self._is_derived_data_valid(packed):
+            return None
+        self._deriving_data += 1
+        try:
+            if packed.shape[0] != self[GT_FIELD].shape[0]:
+                return None
+        finally:
+            self._deriving_data -= 1
+        return packed
+
+    @property
+    def packed_gts(self):
+        packed = self._get_stored_packed_gts()
+        if packed is None:
+            return super().packed_gts
+        return PackedGTs(packed[:], packed.attrs['n_samples'])
+
+    def iterate_packed_gts(self, chunk_size=SNPS_PER_CHUNK):
+        packed = self._get_stored_packed_gts()
+        if packed is None:
+            for packed_gts in super().iterate_packed_gts(chunk_size):
+                yield packed_gts
+            return
+        n_samples = packed.attrs['n_samples']
+        for start in range(0, packed.shape[0], chunk_size):
+            yield PackedGTs(packed[start:start + chunk_size], n_samples)
+
+    def _calc_gts012(self):
+        packed = self._get_stored_packed_gts()
+        if packed is None:
+            return super()._calc_gts012()
+        packed_gts = PackedGTs(packed[:], packed.attrs['n_samples'])
+        return packed_gts.as_mat012().astype(int)
+
+    def write_packed_gts(self, chunk_size=SNPS_PER_CHUNK):
+        '''It stores the 2 bit packed genotypes along with the GTs.
+
+        They are used until the GTs are written, as the fingerprints.
+        '''
+        if PACKED_GT_FIELD in self._h5file:
+            del self._h5file[PACKED_GT_FIELD]
+        self._deriving_data += 1
+        try:
+            gts = self[GT_FIELD]
+            n_snps, n_samples = gts.shape[:2]
+            n_bytes = -(-n_samples // CALLS_PER_BYTE)
+            packed = self._create_matrix(PACKED_GT_FIELD,
+                                         shape=(n_snps, n_bytes),
+                                         dtype=numpy.uint8,
+                                         fillvalue=numpy.uint8(255))
+            packed.attrs['n_samples'] = n_samples
+            for start in range(0, n_snps, chunk_size):
+                stop = start + chunk_size
+                packed[start:stop] = PackedGTs.from_gts(gts[start:stop]).packed
+        finally:
+            self._deriving_data -= 1
+        self._set_derived_data_valid(packed)
+        self._h5file.flush()
+
+    def get_fingerprints(self, with_gts=False, chunk_size=SNPS_PER_CHUNK):
+        self._deriving_data += 1
+        try:
+            if FINGERPRINTS_GROUP in self._h5file:
+                group = self._h5file[FINGERPRINTS_GROUP]
+                # The stored fingerprints are not used if the variations have
+                # been written since or if they lack the GTs
+                if (self._is_derived_data_valid(group) and
+                        group['locus'].shape[0] == self.num_variations and
+                        (not with_gts or 'gts' in group)):
+                    kinds = ['locus', 'site'] + (['gts'] if with_gts else [])
+                    return {kind: group[kind][:] for kind in kinds}
+            return super().get_fingerprints(with_gts=with_gts,
+                                            chunk_size=chunk_size)
+        finally:
+            self._deriving_data -= 1
+
+    def write_fingerprints(self, with_gts=False, chunk_size=SNPS_PER_CHUNK):
+        '''It stores the fingerprints of the variations.
+
+        They are used until the variations are written. In a writable file,
+        getting a field counts as writing it, because it can be written in
+        place.
+        '''
+        if FINGERPRINTS_GROUP in self._h5file:
+            del self._h5file[FINGERPRINTS_GROUP]
+        self._deriving_data += 1
+        try:
+            n_snps = self.num_variations
+            kinds = ['locus', 'site'] + (['gts'] if with_gts else [])
+            dsets = {kind: self._create_matrix(FINGERPRINTS_GROUP + '/' + kind,
+                                               shape=(n_snps,),
+                                               dtype=numpy.uint64,
+                                               fillvalue=numpy.uint64(0))
+                     for kind in kinds}
+            kept_fields = [field for field in (CHROM_FIELD, POS_FIELD,
+                                               REF_FIELD, ALT_FIELD)
+                           if field in self.keys()]
+            if with_gts:
+                kept_fields.append(GT_FIELD)
+            start = 0
+            for chunk in self.iterate_chunks(kept_fields=kept_fields,
+                                             chunk_size=chunk_size):
+                fingerprints = calc_chunk_fingerprints(chunk,
+                                                       with_gts=with_gts)
+                stop = start + chunk.num_variations
+                for kind, dset in dsets.items():
+                    dset[start:stop] = fingerprints[kind]
+                start = stop
+        finally:
+            self._deriving_data -= 1
+        self._set_derived_data_valid(self._h5file[FINGERPRINTS_GROUP])
+        self._h5file.flush()
+
     @property
     def allele_count(self):
         counts = None
@@ -1186,6 +1954,7 @@ class VariationsH5(_VariationMatrices):
         return counts
 
     def _create_matrix(self, path, *args, **kwargs):
+        self._increase_generation(path)
         hdf5 = self._h5file
         group_name, dset_name = posixpath.split(path)
         if not dset_name:
@@ -1204,9 +1973,13 @@ class VariationsH5(_VariationMatrices):
         except KeyError:
             group = hdf5.create_group(group_name)
 
-        for key, value in DEF_DSET_PARAMS.items():
-            if key not in kwargs:
-                kwargs[key] = value
+        if self._storage_profile is None:
+            for key, value in DEF_DSET_PARAMS.items():
+                if key not in kwargs:
+                    kwargs[key] = value
+        else:
+            shape = kwargs['shape'] if 'shape' in kwargs else args[0]
+            kwargs.update(get_dset_params(self._storage_profile, path, shape))
 
         if 'fillvalue' not in kwargs:
             if 'dtype' in kwargs:
@@ -1240,6 +2013,21 @@ class VariationsH5(_VariationMatrices):
     def _set_samples(self, samples):
         self._h5file.attrs['samples'] = json.dumps(samples)
 
+    def _get_order_status(self):
+        if 'order_status' in self._h5file.attrs:
+            return json.loads(self._h5file.attrs['order_status'])
+        return self._order_status
+
+    def _set_order_status(self, status):
+        # In read mode the status is only kept in memory
+        if self.mode == 'r':
+            self._order_status = status
+        elif status is None:
+            if 'order_status' in self._h5file.attrs:
+                del self._h5file.attrs['order_status']
+        else:
+            self._h5file.attrs['order_status'] = json.dumps(status)
+
     def get_samples(self):
         if 'samples' in self._h5file.attrs:
             samples = json.loads(self._h5file.attrs['samples'])
@@ -1267,14 +2055,17 @@ class VariationsH5(_VariationMatrices):
 
     def _replace_matrices(self, matrices):
         self._check_same_paths(matrices)
+        self._increase_generation()
         h5file = self._h5file
         for path in self.keys():
             del h5file[path]
             h5file[path] = matrices[path]
 
         self._index = None
+        self._set_order_status(None)
 
     def _replace_matrix(self, path, new_matrix):
+        self._increase_generation(path)
         h5file = self._h5file
 
         del h5file[path]
@@ -1287,6 +2078,18 @@ def select_dset_from_chunks(chunks, dset_path):
     return (chunk[dset_path] for chunk in chunks)
 
 
+def concat_chunks(chunks, like):
+    'It joins the chunks and takes the metadata and samples from like'
+    if len(chunks) == 1:
+        return chunks[0]
+    concat = chunks[0].__class__()
+    for path in chunks[0].keys():
+        concat[path] = numpy.concatenate([chunk[path] for chunk in chunks])
+    concat._set_metadata(like.metadata)
+    concat._set_samples(like.samples)
+    return concat
+
+
 class VariationsArrays(_VariationMatrices):
 
     def __init__(self, vars_in_chunk=SNPS_PER_CHUNK,
@@ -1299,6 +2102,9 @@ class VariationsArrays(_VariationMatrices):
         self._hArrays = {}
         self._metadata = {}
         self._samples = []
+        # The intermediate stats shared by the steps that use the same chunk,
+        # they are forgotten when a matrix is set or removed
+        self._stat_cache = {}
 
     def __getitem__(self, path):
         return self._hArrays[path]
@@ -1310,16 +2116,38 @@ class VariationsArrays(_VariationMatrices):
         if path in self._hArrays:
             raise ValueError('This path was already in the var_array', path)
         self._hArrays[path] = array
+        self._stat_cache = {}
+        if path in (CHROM_FIELD, POS_FIELD):
+            self._order_status = None
 
     def __delitem__(self, path):
         if path in self._hArrays:
             del self._hArrays[path]
+            self._stat_cache = {}
+            if path in (CHROM_FIELD, POS_FIELD):
+                self._order_status = None
         else:
             raise KeyError('The path is not in the variation_array', path)
 
     def keys(self):
         return self._hArrays.keys()
 
+    def get_cached_stat(self, key, calc_stat):
+        '''It returns the stat calculated by calc_stat, it is calculated only
+        once for this chunk.
+
+        The cached stats are read only. If a matrix is modified in place the
+        cache should be cleared.
+        '''
+        if key not in self._stat_cache:
+            stat = calc_stat()
+            _set_read_only(stat)
+            self._stat_cache[key] = stat
+        return self._stat_cache[key]
+
+    def clear_stat_cache(self):
+        self._stat_cache = {}
+
     @property
     def allele_count(self):
         gts = self['/calls/GT']
@@ -1351,8 +2179,351 @@ class VariationsArrays(_VariationMatrices):
 
         self._hArrays = matrices
         self._index = None
+        self._order_status = None
+        self._stat_cache = {}
 
     def _replace_matrix(self, path, new_matrix):
         self._hArrays[path] = new_matrix
 
         self._index = None
+        self._stat_cache = {}
+
+
+VARS_DIR_METADATA_FNAME = 'variations.json'
+NPY_EXTENSION = '.npy'
+# The npy headers are written with room for the shape to grow, so the rows
+# can be appended without rewriting the file
+NPY_HEADER_LEN = 256
+
+
+def _write_npy_header(fhand, dtype, shape):
+    # The h5py string dtypes carry metadata that numpy can not save
+    dtype = numpy.dtype(numpy.dtype(dtype).str)
+    header = {'descr': numpy.lib.format.dtype_to_descr(dtype),
+              'fortran_order': False, 'shape': tuple(shape)}
+    magic = numpy.lib.format.magic(1, 0)
+    header_len = NPY_HEADER_LEN - len(magic) - 2
+    header = repr(header).ljust(header_len - 1) + '\n'
+    if len(header) > header_len:
+        raise ValueError('The npy header does not fit: ' + header)
+    fhand.seek(0)
+    fhand.write(magic)
+    fhand.write(struct.pack('<H', header_len))
+    fhand.write(header.encode('latin1'))
+
+
+def _write_npy(fpath, array):
+    array = numpy.ascontiguousarray(array)
+    with open(fpath, 'wb') as fhand:
+        _write_npy_header(fhand, array.dtype, array.shape)
+        fhand.write(array.tobytes())
+
+
+class _VariationsDir(_VariationMatrices):
+    '''The variations stored as files in a directory.
+
+    The metadata and the samples are kept in a JSON file.
+    '''
+    def __init__(self, dir_path, mode, vars_in_chunk=SNPS_PER_CHUNK,
+                 ignore_undefined_fields=False,
+                 kept_fields=None, ignored_fields=None):
+        super().__init__(vars_in_chunk=vars_in_chunk,
+                         ignore_undefined_fields=ignore_undefined_fields,
+                         kept_fields=kept_fields,
+                         ignored_fields=ignored_fields)
+        if mode not in ('r', 'w', 'r+'):
+            msg = 'mode should be r, w or r+'
+            raise ValueError(msg)
+        if mode == 'w':
+            if os.path.exists(dir_path) and os.listdir(dir_path):
+                msg = 'The directory is not empty: ' + dir_path
+                raise ValueError(msg)
+            os.makedirs(dir_path, exist_ok=True)
+        elif not os.path.isdir(dir_path):
+            raise ValueError('The directory does not exist: ' + dir_path)
+        self.mode = mode
+        self._dir_path = dir_path
+
+    @property
+    def dir_path(self):
+        return self._dir_path
+
+    def _get_field_path(self, path):
+        return os.path.join(self._dir_path, *path.strip('/').split('/'))
+
+    def _field_from_fpath(self, fpath):
+        path = os.path.relpath(fpath, self._dir_path)
+        return '/' + os.path.normpath(path).replace(os.sep, '/')
+
+    def _check_writable(self):
+        if self.mode == 'r':
+            raise ValueError('The variations were opened in read mode')
+
+    def _read_metadata_file(self):
+        fpath = os.path.join(self._dir_path, VARS_DIR_METADATA_FNAME)
+        if not os.path.exists(fpath):
+            return {}
+        with open(fpath) as fhand:
+            return json.load(fhand)
+
+    def _write_metadata_file(self, key, value):
+        self._check_writable()
+        content = self._read_metadata_file()
+        content[key] = value
+        write_atomically(os.path.join(self._dir_path, VARS_DIR_METADATA_FNAME),
+                         json.dumps(content), mode='w')
+
+    def _set_metadata(self, metadata):
+        self._write_metadata_file('metadata', metadata)
+
+    @property
+    def metadata(self):
+        return self._read_metadata_file().get('metadata', {})
+
+    def _set_samples(self, samples):
+        self._write_metadata_file('samples', samples)
+
+    def _get_samples(self):
+        return self._read_metadata_file().get('samples')
+
+    samples = property(_get_samples, _set_samples)
+
+    def _get_order_status(self):
+        return self._read_metadata_file().get('order_status',
+                                              self._order_status)
+
+    def _set_order_status(self, status):
+        if self.mode == 'r':
+            self._order_status = status
+        else:
+            self._write_metadata_file('order_status', status)
+
+    @property
+    def allele_count(self):
+        return counts_by_row(self[GT_FIELD], missing_value=MISSING_INT)
+
+
+class VariationsNpy(_VariationsDir):
+    '''The fields are uncompressed npy files in a directory.
+
+    The files are memory mapped, so opening is instant, the slices are not
+    copied and the OS page cache is shared between processes.
+    '''
+    def __init__(self, dir_path, mode, vars_in_chunk=SNPS_PER_CHUNK,
+                 ignore_undefined_fields=False,
+                 kept_fields=None, ignored_fields=None):
+        super().__init__(dir_path, mode, vars_in_chunk=vars_in_chunk,
+                         ignore_undefined_fields=ignore_undefined_fields,
+                         kept_fields=kept_fields,
+                         ignored_fields=ignored_fields)
+        self._mmaps = {}
+
+    def _get_fpath(self, path):
+        return self._get_field_path(path) + NPY_EXTENSION
+
+    def __getitem__(self, path):
+        try:
+            return self._mmaps[path]
+        except KeyError:
+            pass
+        fpath = self._get_fpath(path)
+        if not os.path.exists(fpath):
+            raise KeyError('field not found: ' + path)
+        mmap_mode = 'r' if self.mode == 'r' else 'r+'
+        matrix = numpy.load(fpath, mmap_mode=mmap_mode)
+        self._mmaps[path] = matrix
+        return matrix
+
+    def keys(self):
+        paths = []
+        for dir_path, _, fnames in os.walk(self._dir_path):
+            for fname in fnames:
+                if not fname.endswith(NPY_EXTENSION):
+                    continue
+                path = self._field_from_fpath(
+                    os.path.join(dir_path, fname[:-len(NPY_EXTENSION)]))
+                if not path.startswith(HIDDEN_GROUPS_PREFIX):
+                    paths.append(path)
+        return sorted(paths)
+
+    def flush(self):
+        for matrix in self._mmaps.values():
+            if isinstance(matrix, numpy.memmap) and self.mode != 'r':
+                matrix.flush()
+
+    def close(self):
+        self.flush()
+        self._mmaps = {}
+
+    def _create_matrix(self, path, shape, dtype, fillvalue):
+        self._check_writable()
+        fpath = self._get_fpath(path)
+        if os.path.exists(fpath):
+            raise ValueError('The array already exists: ' + path)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        _write_npy(fpath, numpy.full(shape, fillvalue, dtype=dtype))
+        self._mmaps.pop(path, None)
+        return self[path]
+
+    def _replace_matrix(self, path, new_matrix):
+        self._check_writable()
+        self._mmaps.pop(path, None)
+        _write_npy(self._get_fpath(path), new_matrix)
+        self._index = None
+
+    def _append_to_matrix(self, path, matrix, matrix_chunk):
+        if is_dataset(matrix_chunk):
+            matrix_chunk = matrix_chunk[:]
+        if (matrix.shape[1:] != matrix_chunk.shape[1:] or
+                matrix_chunk.dtype != matrix.dtype):
+            super()._append_to_matrix(path, matrix, matrix_chunk)
+            return
+        # The rows are written at the end of the file and the shape in the
+        # header is updated
+        self._check_writable()
+        self.flush()
+        self._mmaps.pop(path, None)
+        shape = (matrix.shape[0] + matrix_chunk.shape[0],) + matrix.shape[1:]
+        with open(self._get_fpath(path), 'r+b') as fhand:
+            fhand.seek(0, os.SEEK_END)
+            fhand.write(numpy.ascontiguousarray(matrix_chunk).tobytes())
+            _write_npy_header(fhand, matrix.dtype, shape)
+        self._index = None
+
+
+class VariationsChunkedDir(_VariationsDir):
+    '''Every field is a directory of compressed chunks of rows.
+
+    The shape, dtype and compression of every field are kept in a JSON
+    manifest. As every chunk is an independent file several processes can
+    write disjoint chunks at once (see allocate and write_rows) and the
+    chunks are read in parallel when n_threads is given.
+    '''
+    def __init__(self, dir_path, mode, vars_in_chunk=SNPS_PER_CHUNK,
+                 ignore_undefined_fields=False,
+                 kept_fields=None, ignored_fields=None,
+                 chunk_rows=SNPS_PER_CHUNK, codec=DEF_CHUNK_CODEC,
+                 level=DEF_CHUNK_LEVEL, n_threads=None):
+        super().__init__(dir_path, mode, vars_in_chunk=vars_in_chunk,
+                         ignore_undefined_fields=ignore_undefined_fields,
+                         kept_fields=kept_fields,
+                         ignored_fields=ignored_fields)
+        if codec not in CHUNK_CODECS:
+            raise ValueError('Unknown codec: ' + str(codec))
+        self.chunk_rows = chunk_rows
+        self.codec = codec
+        self.level = level
+        self.n_threads = n_threads
+        self._pool = None
+        self._arrays = {}
+
+    @property
+    def pool(self):
+        if self.n_threads is None:
+            return None
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        return self._pool
+
+    def __getitem__(self, path):
+        try:
+            return self._arrays[path]
+        except KeyError:
+            pass
+        field_path = self._get_field_path(path)
+        if not is_chunked_dir(field_path):
+            raise KeyError('field not found: ' + path)
+        array = ChunkedDirArray(field_path, pool=self.pool,
+                                writable=self.mode != 'r')
+        self._arrays[path] = array
+        return array
+
+    def keys(self):
+        paths = []
+        for dir_path, _, _ in os.walk(self._dir_path):
+            if not is_chunked_dir(dir_path):
+                continue
+            path = self._field_from_fpath(dir_path)
+            if not path.startswith(HIDDEN_GROUPS_PREFIX):
+                paths.append(path)
+        return sorted(paths)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._arrays = {}
+
+    def _create_matrix(self, path, shape, dtype, fillvalue):
+        self._check_writable()
+        create_chunked_dir(self._get_field_path(path), shape, dtype,
+                           fillvalue, chunk_rows=self.chunk_rows,
+                           codec=self.codec, level=self.level)
+        self._arrays.pop(path, None)
+        return self[path]
+
+    def _replace_matrix(self, path, new_matrix):
+        self._check_writable()
+        self[path].remove()
+        self._arrays.pop(path, None)
+        new_matrix = numpy.asarray(new_matrix)
+        matrix = self._create_matrix(path, new_matrix.shape, new_matrix.dtype,
+                                     MISSING_VALUES[new_matrix.dtype])
+        self._write_matrix(matrix, 0, new_matrix)
+        self._index = None
+
+    def _append_to_matrix(self, path, matrix, matrix_chunk):
+        if is_dataset(matrix_chunk):
+            matrix_chunk = matrix_chunk[:]
+        if (matrix.shape[1:] != matrix_chunk.shape[1:] or
+                not numpy.can_cast(matrix_chunk.dtype, matrix.dtype)):
+            super()._append_to_matrix(path, matrix[:], matrix_chunk)
+            return
+        start = matrix.shape[0]
+        matrix.resize(start + matrix_chunk.shape[0])
+        self._write_matrix(matrix, start, matrix_chunk)
+        self._index = None
+
+    def allocate(self, chunk, num_variations):
+        '''It creates the fields of the chunk with room for all variations.
+
+        Afterwards the rows can be written with write_rows, also by other
+        processes that open the directory in r+ mode.
+        '''
+        if self.keys():
+            raise ValueError('The fields were already created')
+        for path in chunk.keys():
+            mat = chunk[path]
+            self._create_matrix(path, (num_variations,) + mat.shape[1:],
+                                mat.dtype, MISSING_VALUES[mat.dtype])
+        self._set_metadata(chunk.metadata)
+        self._set_samples(chunk.samples)
+
+    def write_rows(self, chunk, start):
+        '''It writes the chunk variations from the start row.
+
+        The rows should start and end at the chunk boundaries (or at the last
+        row) so that the different writers do not share chunks. The chunks
+        are the ones of the stored fields, not the chunk_rows given to open
+        the directory.
+        '''
+        stop = start + chunk.num_variations
+        for path in chunk.keys():
+            matrix = self[path]
+            array = chunk[path]
+            chunk_rows = matrix.chunk_rows
+            if (start % chunk_rows or
+                    (stop % chunk_rows and stop != matrix.shape[0])):
+                msg = 'The rows to write should be aligned with the chunks: '
+                raise ValueError(msg + path)
+            if (matrix.shape[1:] != array.shape[1:] or
+                    not numpy.can_cast(array.dtype, matrix.dtype)):
+                msg = 'The chunk does not fit in the allocated field: '
+                raise ValueError(msg + path)
+        for path in chunk.keys():
+            self._write_matrix(self[path], start, chunk[path])
+        if CHROM_FIELD in chunk.keys() or POS_FIELD in chunk.keys():
+            # A status calculated before these rows were written is wrong
+            self._index = None
+            if self._read_metadata_file().get('order_status') is not None:
+                self._set_order_status(None)